@@ -0,0 +1,172 @@
+from typing import *
+import log_files
+import sqlite3
+import socket
+import time
+import os
+
+logger = log_files.module_logger(__name__, "crawl_queue.log")
+
+QUEUE_PATH = "./data/crawl_queue.sqlite"
+LEASE = 10 * 60  # Seconds after which a composer that is still in-flight is assumed to belong to a crashed worker
+
+PENDING = "pending"
+IN_FLIGHT = "in-flight"
+DONE = "done"
+FAILED = "failed"
+STATES = [PENDING, IN_FLIGHT, DONE, FAILED]
+
+
+def worker_id(pid: Optional[int] = None) -> str:
+    """Name of a worker process, by which reclaim_dead can tell whether it is still running."""
+    return f"{socket.gethostname()}:{os.getpid() if pid is None else pid}"
+
+
+def _is_dead(worker: str) -> bool:
+    """Whether worker (named by worker_id) was a process of this host that is no longer running."""
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False  # Only its lease tells when a worker of another host, or with another name, has stopped
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class CrawlQueue:
+    """
+    Durable queue of composers to scrape, stored in sqlite. Every composer is pending, in-flight, done or failed, and
+    the texts of done composers are kept in the queue itself, so a crawl can be resumed after a crash. Claims are made
+    in an IMMEDIATE transaction, so several processes can drain the same queue without handing out a composer twice.
+    A claim is a lease: composers that are in-flight for longer than lease seconds are handed out again, so the
+    composers of a crashed worker are picked up without disturbing workers that are still running. Only the worker
+    that holds the claim on a composer can complete or fail it.
+    """
+    def __init__(self, path: str = QUEUE_PATH, lease: float = LEASE):
+        self.path = path
+        self.lease = lease
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS composers (
+                id INTEGER PRIMARY KEY,
+                link TEXT NOT NULL,
+                name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                worker TEXT,
+                updated_at REAL NOT NULL,
+                text TEXT,
+                UNIQUE (link, name)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS composers_state ON composers(state)")
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM composers").fetchone()[0]
+
+    def enqueue(self, composers_per_link: dict) -> int:
+        """Adds composers as pending, composers that are already queued keep their state. Returns the number added."""
+        now = time.time()
+        before = len(self)
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.executemany(
+            "INSERT OR IGNORE INTO composers (link, name, state, updated_at) VALUES (?, ?, ?, ?)",
+            [(link, name, PENDING, now) for link, composers in composers_per_link.items() for name in composers]
+        )
+        self.db.execute("COMMIT")
+        added = len(self) - before
+        logger.info(f"Enqueued {added} composers")
+        return added
+
+    def claim(self, worker: str, n: int) -> List[Tuple[int, str, str]]:
+        """
+        Marks up to n pending composers, or in-flight composers with an expired lease, as in-flight for worker and
+        returns their (id, link, name).
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        rows = self.db.execute(
+            "SELECT id, link, name FROM composers WHERE state = ? OR (state = ? AND updated_at <= ?) ORDER BY id LIMIT ?",
+            (PENDING, IN_FLIGHT, now - self.lease, n)
+        ).fetchall()
+        self.db.executemany(
+            "UPDATE composers SET state = ?, worker = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            [(IN_FLIGHT, worker, now, row[0]) for row in rows]
+        )
+        self.db.execute("COMMIT")
+        return rows
+
+    def complete(self, composer_id: int, worker: str, text: str) -> bool:
+        """Marks a composer claimed by worker as done, returns False if worker lost its claim, e.g. to a lease."""
+        return self._finish(composer_id, worker, "text = ?, error = NULL", (DONE, text))
+
+    def fail(self, composer_id: int, worker: str, error: str) -> bool:
+        return self._finish(composer_id, worker, "error = ?", (FAILED, error))
+
+    def _finish(self, composer_id: int, worker: str, columns: str, values: tuple) -> bool:
+        cursor = self.db.execute(f"UPDATE composers SET state = ?, {columns}, updated_at = ? "
+                                 f"WHERE id = ? AND worker = ? AND state = ?",
+                                 (*values, time.time(), composer_id, worker, IN_FLIGHT))
+        if not cursor.rowcount:
+            logger.info(f"Worker {worker} no longer holds composer {composer_id}, its result is dropped")
+        return cursor.rowcount > 0
+
+    def resume(self, older_than: float = 0) -> int:
+        """
+        Puts in-flight composers that were claimed more than older_than seconds ago back to pending, without waiting
+        for their lease to expire. Without older_than, this must only be called when no workers are running.
+        """
+        cursor = self.db.execute("UPDATE composers SET state = ?, worker = NULL WHERE state = ? AND updated_at <= ?",
+                                 (PENDING, IN_FLIGHT, time.time() - older_than))
+        logger.info(f"Resumed {cursor.rowcount} in-flight composers")
+        return cursor.rowcount
+
+    def reclaim_dead(self) -> int:
+        """Puts in-flight composers of workers of this host that are no longer running back to pending."""
+        dead = [(PENDING, composer_id) for composer_id, worker in
+                self.db.execute("SELECT id, worker FROM composers WHERE state = ?", (IN_FLIGHT,))
+                if worker and _is_dead(worker)]
+        self.db.executemany("UPDATE composers SET state = ?, worker = NULL WHERE id = ?", dead)
+        if dead:
+            logger.info(f"Reclaimed {len(dead)} composers of workers that are no longer running")
+        return len(dead)
+
+    def unfinished(self) -> int:
+        """Number of composers that are pending or in-flight."""
+        return self.db.execute("SELECT COUNT(*) FROM composers WHERE state IN (?, ?)",
+                               (PENDING, IN_FLIGHT)).fetchone()[0]
+
+    def retry_failed(self) -> int:
+        cursor = self.db.execute("UPDATE composers SET state = ?, worker = NULL WHERE state = ?", (PENDING, FAILED))
+        logger.info(f"Queued {cursor.rowcount} failed composers for a retry")
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Number of composers per state, per link and in total (under the key 'total')."""
+        result = {"total": {state: 0 for state in STATES}}
+        for link, state, count in self.db.execute("SELECT link, state, COUNT(*) FROM composers GROUP BY link, state"):
+            result.setdefault(link, {s: 0 for s in STATES})[state] = count
+            result["total"][state] += count
+        return result
+
+    def failures(self) -> List[Tuple[str, str, str]]:
+        return self.db.execute("SELECT link, name, error FROM composers WHERE state = ? ORDER BY id",
+                               (FAILED,)).fetchall()
+
+    def export(self) -> dict:
+        """The texts of all done composers, as {link: {composer: text}} in the order they were enqueued."""
+        composers_per_link = {link: {} for (link,) in
+                              self.db.execute("SELECT link FROM composers GROUP BY link ORDER BY MIN(id)")}
+        for link, name, text in self.db.execute("SELECT link, name, text FROM composers WHERE state = ? ORDER BY id",
+                                                (DONE,)):
+            composers_per_link[link][name] = text
+        return composers_per_link
@@ -1,29 +1,38 @@
-from bs4.element import NavigableString
-from urllib.request import urlopen
+from Fetcher import AsyncFetcher, page_url
+from CrawlQueue import CrawlQueue, QUEUE_PATH, worker_id
+from multiprocessing import Process
+from ResponseCache import ResponseCache
 from Processor import Processor
-from bs4 import BeautifulSoup
+import instrumentation
+import chunked_storage
+import html_extraction
 from data_types import *
 from tqdm import tqdm
 from typing import *
-import wikipedia
-import logging
+import argparse
+import log_files
 import msgpack
+import time
 import os
 
-if os.path.isfile("./logs/data_collection.log"):
-    os.remove("./logs/data_collection.log")
+logger = log_files.module_logger(__name__, "data_collection.log")
 
-# Setting up the logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('logs/data_collection.log')
-file_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-logger.addHandler(file_handler)
-logger.propagate = False
+# Eras that are scraped, but left out of the analysis
+EXCLUDED_LINKS = ["List of 20th-century classical composers", "List of 21st-century classical composers"]
+CRAWL_POLL = 10  # Seconds between checks on composers that other crawls have in flight
 
 
 class DataCollector:
-    def __init__(self, processor):
+    def __init__(self, processor, fetcher: Optional[AsyncFetcher] = None, base_url: Optional[str] = None,
+                 crawl_workers: int = 1, queue_path: str = QUEUE_PATH, html_engine: str = "bs4"):
+        """
+        :param html_engine: "bs4" uses the BeautifulSoup based parsers, "stream" extracts paragraphs and composer names
+            in a single (much faster) pass with html_extraction, which gives the same results on the pages in
+            tests/fixtures
+        """
+        if html_engine not in ("stream", "bs4"):
+            raise ValueError(f"Unknown html engine {html_engine}")
+
         self.parser_per_link = {
             "List of Renaissance composers": self.plain_list_parser,
             "List of postmodernist composers": self.plain_list_parser,
@@ -37,50 +46,149 @@ class DataCollector:
         }
 
         self.processor = processor if processor else Processor()
+        self.fetcher = fetcher if fetcher else AsyncFetcher(cache=ResponseCache())
+        self.base_url = base_url  # Allows pointing the scraper at e.g. a local mirror
+        self.crawl_workers = crawl_workers
+        self.queue_path = queue_path
+        self.html_engine = html_engine
+        # Per link, the number of composers the last iter_composer_texts scraped rather than found in the crawl queue
+        self.scraped: Dict[str, int] = {}
+
+    def iter_composer_texts(self, links: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields (link, composer, text) for all scraped composers. The eras of parser_per_link that are not in
+        ./data/scraped_data yet are scraped first and added to it.
+        """
+        self.scraped = {}
+        stored = set(data_links("scraped_data"))
+        missing = [link for link in self.parser_per_link if link not in stored]
+        if missing:
+            logger.info(f"Scraping the eras that are not stored yet: {missing}")
+            store_data(self.scrape_composers(missing), "scraped_data", append=True)
+
+        # Stream the composers from disk one at a time, instead of loading every text at once
+        for link, (name, text) in iter_data("scraped_data", links):
+            yield link, name, text
+
+    @instrumentation.timed("scrape")
+    def scrape_composers(self, links: Optional[Iterable[str]] = None) -> dict:
+        """
+        Crawls the composers of links (by default, of all eras) and returns their texts once none of them is pending
+        or in-flight anymore. Composers left in-flight by workers of this host that stopped are crawled again right
+        away, composers that other crawls still have in flight are waited for, until they are done or their lease
+        expires.
+        """
+        links = list(self.parser_per_link) if links is None else list(links)
+        queue = CrawlQueue(self.queue_path)
+        if len(queue):
+            logger.info(f"Continuing the crawl in {self.queue_path}: {queue.stats()['total']}")
+        # Composers that are queued already keep their state, so only eras and composers that are new get crawled
+        queue.enqueue(self.get_parsed_data(links))
+
+        done = {link: counts["done"] for link, counts in queue.stats().items()}
+        queue.reclaim_dead()
+        self.crawl(queue)
+        while queue.unfinished():
+            logger.info(f"Waiting for {queue.unfinished()} composers that other crawls have in flight")
+            time.sleep(CRAWL_POLL)
+            queue.reclaim_dead()
+            self.crawl(queue)
+        for link, name, error in queue.failures():
+            logger.info(f"Could not load \'{name}\' of \'{link}\': {error}")
+        stats = queue.stats()
+        self.scraped = {link: counts["done"] - done.get(link, 0) for link, counts in stats.items() if link != "total"}
+        instrumentation.count("composers.done", stats["total"]["done"])
+        instrumentation.count("composers.scraped", stats["total"]["done"] - done.get("total", 0))
+        instrumentation.count("composers.failed", stats["total"]["failed"])
+
+        exported = queue.export()
+        return {link: exported.get(link, {}) for link in links}  # Eras without composers are kept as well
+
+    @instrumentation.timed()
+    def crawl(self, queue: CrawlQueue, batch_size: int = 64):
+        """
+        Drains the queue using crawl_workers processes, which use the same fetcher settings as this collector and
+        share its rate limit. Other crawls of the same queue can run at the same time. Composers left in-flight by a
+        crashed run are picked up again once their lease expires, or right away after queue.reclaim_dead() or an
+        explicit queue.resume().
+        """
+        if self.crawl_workers <= 1:
+            self.drain(queue, worker_id(), batch_size)
+            return
+
+        settings = self.fetcher.settings()
+        settings["rate"] = settings["rate"] / self.crawl_workers  # Every worker limits its own requests
+        workers = [Process(target=_crawl_worker, args=(self.queue_path, self.base_url, self.html_engine, batch_size,
+                                                        settings))
+                   for _ in range(self.crawl_workers)]
+        for worker in workers:
+            worker.start()
+
+        total = queue.stats()["total"]
+        pbar = tqdm(total=sum(total.values()), initial=total["done"] + total["failed"],
+                    desc=f"Crawling composers with {self.crawl_workers} workers")
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+            total = queue.stats()["total"]
+            pbar.update(total["done"] + total["failed"] - pbar.n)
+        pbar.close()
 
-    def get_temporospatial(self) -> Tuple[dict, List[str], dict]:
-        temporospatial_data = get_data(
-            file_name="temporospatial_data",
-            per_link=lambda a: [temporospatial_from_json(x) for x in a]
-        )
-        country_data = get_data(
-            file_name="countries_found"
-        )
-
-        if country_data:
-            countries, country_codes = country_data
-
-        if not temporospatial_data:
-            composers_per_link = get_data("scraped_data")
-            if not composers_per_link:
-                composers_per_link = self.scrape_composers()
-            store_data(composers_per_link, "scraped_data")
-
-            preprocessed = self.processor.preprocess(composers_per_link)
-            temporospatial_data, countries, country_codes = self.processor.filter_temporospatial(preprocessed)
-            store_data(temporospatial_data, "temporospatial_data", per_link=lambda a: [x.to_dict() for x in a])
-            store_data([countries, country_codes], "countries_found")
-
-        del temporospatial_data["List of 20th-century classical composers"]
-        del temporospatial_data["List of 21st-century classical composers"]
-
-        return temporospatial_data, countries, country_codes
-
-    def scrape_composers(self) -> dict:
-        composers = self.get_parsed_data()
-        self.load_composer_texts(composers)
-
-        return composers
-
-    def get_parsed_data(self) -> dict:
-        era_pages = {link: {} for link in self.parser_per_link}
-        pbar = tqdm(total=len(self.parser_per_link))
+        for worker in workers:
+            worker.join()
+
+    def drain(self, queue: CrawlQueue, worker: str, batch_size: int = 64):
+        """Claims and scrapes batches of composers until the queue has no pending composers left."""
+        while True:
+            batch = queue.claim(worker, batch_size)
+            if not batch:
+                return
+
+            urls = {composer_id: self.page_url(name) for composer_id, _, name in batch}
+            pages, failures = self.fetcher.fetch_many(list(urls.values()), desc=f"Crawling batch of worker {worker}")
+            errors = {failure.url: failure.error for failure in failures}
+
+            for composer_id, url in urls.items():
+                if url not in pages:
+                    queue.fail(composer_id, worker, errors.get(url, "Unknown error"))
+                    continue
+                text = self.extract_text(pages[url])
+                if text is None:
+                    queue.fail(composer_id, worker, "Disambiguation page")
+                else:
+                    queue.complete(composer_id, worker, text)
+
+    def extract_text(self, html: str) -> Optional[str]:
+        """The joined paragraphs of a page, or None for disambiguation pages."""
+        if self.html_engine == "stream":
+            return html_extraction.paragraph_text(html)
+
+        from bs4 import BeautifulSoup  # Only needed by the bs4 engine, and slow to import
+        bsoup = BeautifulSoup(html, 'html.parser')
+        if bsoup.find(id="disambigbox"):
+            # wikipedia.WikipediaPage used to reject these by raising a DisambiguationError
+            return None
+        return " ".join([par.text.strip() for par in bsoup.find_all("p")])
+
+    @instrumentation.timed("composer_lists")
+    def get_parsed_data(self, links: Optional[Iterable[str]] = None) -> dict:
+        """The composers of links (by default, of all eras), as {link: {composer: ""}}."""
+        links = list(self.parser_per_link) if links is None else list(links)
+        urls = {link: self.page_url(link) for link in links}
+        pages, failures = self.fetcher.fetch_many(list(urls.values()), desc="Retrieving composer lists")
+        if failures:
+            raise RuntimeError(f"Could not retrieve the composer lists: {[f.to_dict() for f in failures]}")
+
+        era_pages = {link: {} for link in links}
+        pbar = tqdm(total=len(links))
         pbar.set_description("Retrieving composer names")
-        for link, parser in self.parser_per_link.items():
-            logger.info(f"Retrieving page of link \'{link}\'")
-            era_pages[link]['page'] = wikipedia.WikipediaPage(title=link)
-            logger.info(f"Retrieving bsoup of link \'{link}\'")
-            era_pages[link]['bsoup'] = BeautifulSoup(urlopen(era_pages[link]['page'].url), 'html.parser')
+        for link in links:
+            parser = self.parser_per_link[link]
+            if self.html_engine == "bs4":
+                from bs4 import BeautifulSoup
+                logger.info(f"Retrieving bsoup of link \'{link}\'")
+                era_pages[link]['bsoup'] = BeautifulSoup(pages[urls[link]], 'html.parser')
+            else:
+                era_pages[link]['html'] = pages[urls[link]]
 
             logger.info(f"Parsing page of link \'{link}\' using {parser}")
             era_pages[link] = {composer: "" for composer in parser(era_pages, link)}
@@ -92,27 +200,30 @@ class DataCollector:
 
         return era_pages
 
-    @staticmethod
-    def load_composer_texts(composers_per_link: dict):
-        for link, composers in composers_per_link.items():
-            pbar = tqdm(total=len(composers), desc=f"Loading texts for composers in {link}")
-            to_remove = []
-            for composer in composers:
-                try:
-                    bsoup = BeautifulSoup(urlopen(wikipedia.WikipediaPage(title=composer).url), parser='html.parser')
-                    composers_per_link[link][composer] = " ".join([par.text.strip() for par in bsoup.find_all("p")])
-                except:
-                    to_remove.append(composer)
-
-                pbar.update(1)
-            pbar.close()
-
-            for c in to_remove:
-                del composers_per_link[link][c]
+    def page_url(self, title: str) -> str:
+        return page_url(title, self.base_url) if self.base_url else page_url(title)
 
     @staticmethod
     def plain_list_parser(era_pages: dict, link: str) -> list:
-        ul_items = era_pages[link]['bsoup'].find_all('ul')
+        if 'html' in era_pages[link]:
+            composers = html_extraction.list_anchor_names(era_pages[link]['html'])
+        else:
+            composers = DataCollector.bsoup_list_names(era_pages[link]['bsoup'])
+
+        composer = {
+            "List of Renaissance composers": "Nicholas Dáll Pierce",
+            "List of postmodernist composers": "Philip Glass",
+            "List of Baroque composers": "Santa della Pietà",
+            "List of Classical era composers": "Oscar I of Sweden",
+            "List of modernist composers": "William Walton",
+        }[link]
+        i = composers.index(composer)
+        return composers[:i + 1]
+
+    @staticmethod
+    def bsoup_list_names(bsoup: "BeautifulSoup") -> list:
+        from bs4.element import NavigableString
+        ul_items = bsoup.find_all('ul')
 
         composers = []
 
@@ -126,19 +237,13 @@ class DataCollector:
                             name = str(name)
                             if len(name) and '[' not in name:
                                 composers.append(name)
-
-        composer = {
-            "List of Renaissance composers": "Nicholas Dáll Pierce",
-            "List of postmodernist composers": "Philip Glass",
-            "List of Baroque composers": "Santa della Pietà",
-            "List of Classical era composers": "Oscar I of Sweden",
-            "List of modernist composers": "William Walton",
-        }[link]
-        i = composers.index(composer)
-        return composers[:i + 1]
+        return composers
 
     @staticmethod
     def table_parser(era_pages: dict, link: str) -> list:
+        if 'html' in era_pages[link]:
+            return html_extraction.table_anchor_names(era_pages[link]['html'])
+
         tables = [t.find_all('tr') for t in era_pages[link]['bsoup'].find_all('table')]
         # table_rows = tables[np.argmax([len(t) for t in tables])]
         table_rows = [t for t in tables if len(t) > 70]
@@ -154,26 +259,122 @@ class DataCollector:
         return composers
 
 
-def get_data(file_name: str, per_link=None):
+def _crawl_worker(queue_path: str, base_url: Optional[str], html_engine: str, batch_size: int, fetcher_settings: dict):
+    # The fetcher is recreated rather than inherited, its cache holds a database connection of the parent
+    data_collector = DataCollector(processor=None, fetcher=AsyncFetcher.from_settings(fetcher_settings),
+                                   base_url=base_url, html_engine=html_engine)
+    data_collector.drain(CrawlQueue(queue_path), worker_id(), batch_size)
+
+
+def get_data(file_name: str, per_link=None, links: Optional[Iterable[str]] = None):
+    """
+    Loads a dataset from ./data. For per-link datasets, links limits which links are read. Files in the chunked
+    format only decode the records of those links.
+    """
     data = {}
+    path = f"./data/{file_name}"
     if not os.path.isdir("./data"):
         os.mkdir("./data")
-    if os.path.isfile(f"./data/{file_name}"):
-        with open(f"./data/{file_name}", "rb") as file:
-            data = msgpack.unpackb(file.read())
-        logger.info(f"Retrieved data from ./data/{file_name}")
+    if os.path.isfile(path):
+        if chunked_storage.is_chunked(path):
+            data = chunked_storage.read_chunked(path, links)
+        else:
+            with open(path, "rb") as file:
+                data = msgpack.unpackb(file.read())
+            if links is not None and isinstance(data, dict):
+                data = {link: data[link] for link in links if link in data}
+        logger.info(f"Retrieved data from {path}")
     else:
-        logger.info(f"Could not retrieve data from ./data/{file_name}")
+        logger.info(f"Could not retrieve data from {path}")
 
     if data and per_link:
         data = {link: per_link(data[link]) for link in data.keys()}
     return data
 
 
-def store_data(data, file_name: str, per_link=None):
-    if per_link:
-        data = {link: per_link(data[link]) for link in data.keys()}
+def data_links(file_name: str) -> List[str]:
+    """The links of a per-link dataset in ./data, without decoding their values. Empty if there is no such dataset."""
+    path = f"./data/{file_name}"
+    if not os.path.isfile(path):
+        return []
+    if chunked_storage.is_chunked(path):
+        return list(dict.fromkeys(key for key, _, _ in chunked_storage.read_index(path) if key is not None))
+
+    with open(path, "rb") as file:
+        unpacker = msgpack.Unpacker(file)
+        links = []
+        for _ in range(unpacker.read_map_header()):
+            links.append(unpacker.unpack())
+            unpacker.skip()
+        return links
+
+
+def iter_data(file_name: str, links: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Streams a per-link dataset stored by store_data without decoding the whole file at once. Items of list values
+    are yielded as they are, items of dict values as (key, value) pairs.
+    """
+    path = f"./data/{file_name}"
+    wanted = set(links) if links is not None else None
+
+    if chunked_storage.is_chunked(path):
+        for link, payload in chunked_storage.iter_records(path, links):
+            yield from ((link, item) for item in (payload.items() if isinstance(payload, dict) else payload))
+        logger.info(f"Streamed data from {path}")
+        return
+
+    with open(path, "rb") as file:
+        unpacker = msgpack.Unpacker(file)
+        for _ in range(unpacker.read_map_header()):
+            link = unpacker.unpack()
+            wanted_link = wanted is None or link in wanted
+            try:
+                for _ in range(unpacker.read_map_header()):
+                    key = unpacker.unpack()
+                    if wanted_link:
+                        yield link, (key, unpacker.unpack())
+                    else:
+                        unpacker.skip()
+            except ValueError:  # Not a map, so the items are stored as an array
+                for _ in range(unpacker.read_array_header()):
+                    if wanted_link:
+                        yield link, unpacker.unpack()
+                    else:
+                        unpacker.skip()
+    logger.info(f"Streamed data from {path}")
+
+
+def store_data(data, file_name: str, per_link=None, append: bool = False):
+    """
+    Stores a dataset in ./data in the chunked format. per_link is applied to every chunk of a list value separately.
+    With append, the links of a per-link dataset are added to the ones that are stored already.
+    """
     if not os.path.isdir("./data"):
         os.mkdir("./data")
-    with open(f"./data/{file_name}", "wb") as file:
-        file.write(msgpack.packb(data))
+    path = f"./data/{file_name}"
+    if append and os.path.isfile(path) and not chunked_storage.is_chunked(path):
+        data = {**get_data(file_name), **data}  # Files in the old format are rewritten as a whole
+        append = False
+    chunked_storage.write_chunked(path, data, per_link, append=append)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Manage the crawl queue of composer pages")
+    arg_parser.add_argument("command", choices=["crawl", "resume", "retry-failed", "stats"],
+                            help="crawl drains the queue next to any running crawls (taking back the composers of "
+                                 "crawls that stopped), resume first takes back all in-flight composers and must "
+                                 "only be used when no other crawl is running")
+    arg_parser.add_argument("--workers", type=int, default=1)
+    arg_parser.add_argument("--queue", default=QUEUE_PATH)
+    args = arg_parser.parse_args()
+
+    crawl_queue = CrawlQueue(args.queue)
+    if args.command == "retry-failed":
+        print(f"Queued {crawl_queue.retry_failed()} failed composers for a retry")
+    if args.command == "resume":
+        print(f"Resumed {crawl_queue.resume()} in-flight composers")
+    if args.command in ("crawl", "resume", "retry-failed"):
+        crawl_queue.reclaim_dead()
+        DataCollector(processor=None, crawl_workers=args.workers, queue_path=args.queue).crawl(crawl_queue)
+    for link, counts in crawl_queue.stats().items():
+        print(f"{link}: {counts}")
@@ -0,0 +1,164 @@
+from urllib.parse import urlsplit, quote
+from ResponseCache import ResponseCache
+from collections import Counter
+from data_types import *
+from tqdm import tqdm
+import instrumentation
+import asyncio
+import log_files
+import random
+import time
+
+logger = log_files.module_logger(__name__, "fetcher.log")
+
+WIKIPEDIA_URL = "https://en.wikipedia.org/wiki/"
+USER_AGENT = "txmm_project/1.0 (temporospatial analysis of Western classical music; research scraper)"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def page_url(title: str, base_url: str = WIKIPEDIA_URL) -> str:
+    return base_url + quote(title.replace(" ", "_"), safe="()',")
+
+
+class RateLimiter:
+    """Spaces out requests to the same host so that at most `rate` requests per second are started."""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot: Dict[str, float] = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        async with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncFetcher:
+    """
+    Fetches many pages concurrently over a pool of keep-alive connections, with a bound on the number of requests
+    in flight, per-host rate limiting and retries with exponential backoff. Failures are collected as FetchFailure
+    objects instead of being dropped silently. With a cache, fresh responses are served without a request and stale
+    ones are revalidated with a conditional request.
+    """
+    def __init__(self, concurrency: int = 16, per_host: int = 8, rate: float = 20.0, retries: int = 3,
+                 backoff: float = 1.0, timeout: float = 30.0, user_agent: str = USER_AGENT,
+                 cache: Optional[ResponseCache] = None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.cache = cache
+        self.stats = Counter()  # Cache hits, revalidations, network fetches and bytes fetched
+
+    def settings(self) -> dict:
+        """The arguments to create an equivalent fetcher with in another process, see from_settings."""
+        return {"concurrency": self.concurrency, "per_host": self.per_host, "rate": self.rate, "retries": self.retries,
+                "backoff": self.backoff, "timeout": self.timeout, "user_agent": self.user_agent,
+                "cache": self.cache.settings() if self.cache else None}
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "AsyncFetcher":
+        settings = dict(settings)
+        cache = settings.pop("cache")
+        return cls(cache=ResponseCache(**cache) if cache is not None else None, **settings)
+
+    def session(self) -> "aiohttp.ClientSession":
+        import aiohttp  # Slow to import, and not needed when everything is cached
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, keepalive_timeout=30)
+        return aiohttp.ClientSession(connector=connector, headers={"User-Agent": self.user_agent},
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def fetch(self, session: "aiohttp.ClientSession", url: str, limiter: RateLimiter) \
+            -> Tuple[Optional[str], Optional[FetchFailure]]:
+        import aiohttp
+        cached = self.cache.get(url) if self.cache else None
+        if cached and cached.fresh:
+            self.stats["cache_hits"] += 1
+            instrumentation.cache("http_cache", hits=1)
+            return cached.body, None
+        headers = cached.conditional_headers() if cached else {}
+
+        host = urlsplit(url).netloc
+        failure = None
+
+        for attempt in range(1, self.retries + 2):
+            await limiter.wait(host)
+            retry_after = None
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        self.stats["revalidated"] += 1
+                        instrumentation.cache("http_cache", hits=1)
+                        instrumentation.count("http.revalidated")
+                        self.cache.revalidated(url)
+                        return cached.body, None
+                    if response.status == 200:
+                        body = await response.read()
+                        text = body.decode(response.get_encoding())
+                        self.stats["fetched"] += 1
+                        self.stats["bytes"] += len(body)
+                        instrumentation.cache("http_cache", misses=1)
+                        instrumentation.count("http.fetched")
+                        instrumentation.count("http.bytes", len(body))
+                        if self.cache:
+                            self.cache.put(url, text, response.headers.get("ETag"),
+                                           response.headers.get("Last-Modified"))
+                        return text, None
+
+                    failure = FetchFailure(url, response.reason or "HTTP error", response.status, attempt)
+                    if response.status not in RETRY_STATUSES:
+                        break
+                    if "Retry-After" in response.headers and response.headers["Retry-After"].isdigit():
+                        retry_after = int(response.headers["Retry-After"])
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failure = FetchFailure(url, f"{type(e).__name__}: {e}", None, attempt)
+
+            if attempt <= self.retries:
+                delay = retry_after if retry_after is not None else self.backoff * 2 ** (attempt - 1)
+                logger.info(f"Attempt {attempt} for {url} failed ({failure.error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay * (1 + random.random() / 10))  # Jitter, so retries do not align
+
+        logger.warning(f"Failed to fetch {url}: {failure.to_dict()}")
+        instrumentation.count("http.failures")
+        return None, failure
+
+    async def fetch_all(self, urls: List[str], desc: Optional[str] = None) \
+            -> Tuple[Dict[str, str], List[FetchFailure]]:
+        results: Dict[str, str] = {}
+        failures: List[FetchFailure] = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.rate)
+        pbar = tqdm(total=len(urls), desc=desc)
+
+        async with self.session() as session:
+            async def bounded(url: str):
+                async with semaphore:
+                    try:
+                        text, failure = await self.fetch(session, url, limiter)
+                    except Exception as e:
+                        # Anything unexpected (like a body that does not decode) fails this url, not the batch
+                        logger.exception(f"Unexpected error fetching {url}")
+                        instrumentation.count("http.failures")
+                        text, failure = None, FetchFailure(url, f"{type(e).__name__}: {e}", None, 1)
+                if failure:
+                    failures.append(failure)
+                else:
+                    results[url] = text
+                pbar.update(1)
+
+            await asyncio.gather(*[bounded(url) for url in urls])
+        pbar.close()
+        if self.cache:
+            self.cache.flush()
+        logger.info(f"Fetched {len(urls)} urls ({desc}), {len(failures)} failures, totals so far: {dict(self.stats)}")
+
+        return results, failures
+
+    def fetch_many(self, urls: List[str], desc: Optional[str] = None) -> Tuple[Dict[str, str], List[FetchFailure]]:
+        return asyncio.run(self.fetch_all(urls, desc))
@@ -0,0 +1,295 @@
+from SpatialGrid import SpatialGrid
+from typing import *
+import functools
+import argparse
+import hashlib
+import numpy as np
+import log_files
+import msgpack
+import zlib
+import struct
+import mmap
+import csv
+import os
+
+logger = log_files.module_logger(__name__, "gazetteer.log")
+
+WORLDCITIES_PATH = "./resources/worldcities.csv"
+GAZETTEER_PATH = "./data/gazetteer.bin"
+MIN_POPULATION = 50000
+MAX_CITY_WORDS = 3
+# Number of lookups memoized per table, word frequencies are heavily skewed so most lookups are repeats
+LOOKUP_CACHE_SIZE = 1 << 16
+
+MAGIC = b"GZTR"
+VERSION = 2
+# magic, version, sha256 of the source csv, minimum population,
+# (offset, count) of the city table, (offset, count) of the prefix table, (offset, length) of the metadata,
+# offset of the coordinates (lat, lng as float32, one pair per city record)
+HEADER = struct.Struct("<4sI32sIQIQIQQQ")
+# key offset, key length, value id
+RECORD = struct.Struct("<IIH")
+# record number + 1 per hash slot, 0 marks an empty slot
+SLOT = struct.Struct("<I")
+
+
+def read_worldcities(csv_path: str = WORLDCITIES_PATH, min_population: int = MIN_POPULATION) \
+        -> Tuple[dict, dict, dict]:
+    """
+    Parses worldcities.csv into a city/ascii name -> country lookup table, a country -> ISO code table and a
+    city/ascii name -> (lat, lng) table. When a name occurs multiple times, the city with the highest population wins.
+    """
+    cities_population = {}
+    country_codes = {}
+    cities_lut = {}
+    coordinates = {}
+    dropped = 0
+
+    with open(csv_path, "r") as csvfile:
+        reader = csv.reader(csvfile, delimiter=",", quotechar="\"")
+        headers = reader.__next__()
+        for row in reader:
+            if row[4] not in country_codes:
+                country_codes[row[4]] = row[5].lower()
+            population = -1 if not row[9] else int(float(row[9]))
+
+            if 0 <= population < min_population:
+                dropped += 1
+                continue
+
+            if not row[0] in cities_lut or\
+                  (row[0] in cities_population and population > cities_population[row[0]]):
+                cities_lut[row[0]] = row[4]
+                cities_lut[row[1]] = row[4]
+                coordinates[row[0]] = coordinates[row[1]] = (float(row[2]), float(row[3]))
+                cities_population[row[0]] = population
+
+    logger.info(f"Left out {dropped} towns with a population < {min_population}")
+
+    return cities_lut, country_codes, coordinates
+
+
+def city_prefixes(names: Iterable[str]) -> Set[str]:
+    """Returns all leading word sequences of multi-word names, used to stop n-gram lookups early."""
+    prefixes = set()
+    for name in names:
+        words = name.split(" ")
+        for w in range(2, min(len(words), MAX_CITY_WORDS) + 1):
+            prefixes.add(" ".join(words[:w - 1]))
+    return prefixes
+
+
+def file_hash(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def _slot_count(count: int) -> int:
+    # Keep the load factor at or below 0.5, so misses (the common case) end after very few probes
+    size = 1
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def _pack_table(keys: List[str], values: List[int], offset: int) -> Tuple[bytes, int]:
+    """
+    Packs keys into an open-addressing hash table: a slot array followed by the records and the key bytes.
+    """
+    encoded = [key.encode("utf-8") for key in keys]
+    n_slots = _slot_count(len(encoded))
+    mask = n_slots - 1
+    records_offset = offset + SLOT.size * n_slots
+    keys_offset = records_offset + RECORD.size * len(encoded)
+
+    slots = [0] * n_slots
+    records = bytearray()
+    blob = bytearray()
+    for i, (key, value) in enumerate(zip(encoded, values)):
+        records += RECORD.pack(keys_offset + len(blob), len(key), value)
+        blob += key
+
+        h = zlib.crc32(key) & mask
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = i + 1
+
+    return struct.pack(f"<{n_slots}I", *slots) + bytes(records + blob), len(encoded)
+
+
+def compile_gazetteer(csv_path: str = WORLDCITIES_PATH, out_path: str = GAZETTEER_PATH,
+                      min_population: int = MIN_POPULATION):
+    logger.info(f"Compiling {csv_path} into {out_path}")
+    cities_lut, country_codes, coordinates = read_worldcities(csv_path, min_population)
+
+    countries = sorted(set(cities_lut.values()))
+    country_ids = {country: i for i, country in enumerate(countries)}
+    names = list(cities_lut.keys())
+    prefixes = sorted(city_prefixes(names))
+
+    cities_offset = HEADER.size
+    cities_table, n_cities = _pack_table(names, [country_ids[cities_lut[n]] for n in names], cities_offset)
+    prefixes_offset = cities_offset + len(cities_table)
+    prefixes_table, n_prefixes = _pack_table(prefixes, [0] * len(prefixes), prefixes_offset)
+    meta_offset = prefixes_offset + len(prefixes_table)
+    meta = msgpack.packb({"countries": countries, "country_codes": country_codes})
+    points_offset = meta_offset + len(meta)
+    points = np.array([coordinates[n] for n in names], dtype="<f4").reshape(-1, 2)  # In the order of the records
+
+    header = HEADER.pack(MAGIC, VERSION, file_hash(csv_path), min_population, cities_offset, n_cities,
+                         prefixes_offset, n_prefixes, meta_offset, len(meta), points_offset)
+
+    directory = os.path.dirname(out_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write to a temporary file first, so concurrent readers never see a partial gazetteer
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header)
+        file.write(cities_table)
+        file.write(prefixes_table)
+        file.write(meta)
+        file.write(points.tobytes())
+    os.replace(tmp_path, out_path)
+
+    logger.info(f"Compiled gazetteer with {n_cities} names and {n_prefixes} prefixes")
+
+
+class MappedTable(Mapping):
+    """Read-only str -> str mapping backed by a hash table inside a memory map."""
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int, values: Optional[List[str]] = None,
+                 cache_size: int = LOOKUP_CACHE_SIZE):
+        self.buffer = buffer
+        self.count = count
+        self.values_list = values
+        n_slots = _slot_count(count)
+        self.mask = n_slots - 1
+        self.slots_offset = offset
+        self.records_offset = offset + SLOT.size * n_slots
+        self._cached_find = functools.lru_cache(maxsize=cache_size)(self._find)
+
+    def _find(self, key: str) -> Tuple[int, int]:
+        """The record number and value id of key, (-1, -1) if it is missing."""
+        encoded = key.encode("utf-8")
+        buffer = self.buffer
+        h = zlib.crc32(encoded) & self.mask
+
+        while True:
+            (slot,) = SLOT.unpack_from(buffer, self.slots_offset + h * SLOT.size)
+            if not slot:
+                return -1, -1
+            key_offset, key_length, value = RECORD.unpack_from(buffer, self.records_offset + (slot - 1) * RECORD.size)
+            if key_length == len(encoded) and buffer[key_offset:key_offset + key_length] == encoded:
+                return slot - 1, value
+            h = (h + 1) & self.mask
+
+    def cache_info(self):
+        return self._cached_find.cache_info()
+
+    def get(self, key, default=None):
+        _, value = self._cached_find(key) if isinstance(key, str) else (-1, -1)
+        if value < 0:
+            return default
+        return self.values_list[value] if self.values_list is not None else key
+
+    def record(self, key: str) -> int:
+        """Number of the record of key, which indexes tables aligned with the records, or -1 if it is missing."""
+        return self._cached_find(key)[0] if isinstance(key, str) else -1
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._cached_find(key)[0] >= 0
+
+    def __getitem__(self, key: str) -> str:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.count):
+            key_offset, key_length, _ = RECORD.unpack_from(self.buffer, self.records_offset + i * RECORD.size)
+            yield self.buffer[key_offset:key_offset + key_length].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class Gazetteer:
+    """
+    Memory-mapped, precompiled version of worldcities.csv. The compiled file is rebuilt automatically whenever the
+    hash of the source csv or the population threshold changes. Since the tables are read straight from the page
+    cache, processes opening the same file share its memory.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.source_hash, self.min_population, cities_offset, n_cities,
+         prefixes_offset, n_prefixes, meta_offset, meta_length, points_offset) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} gazetteer file")
+
+        meta = msgpack.unpackb(self.buffer[meta_offset:meta_offset + meta_length])
+        self.countries: List[str] = meta["countries"]
+        self.country_codes: Dict[str, str] = meta["country_codes"]
+        self.cities = MappedTable(self.buffer, cities_offset, n_cities, self.countries)
+        self.prefixes = MappedTable(self.buffer, prefixes_offset, n_prefixes)
+        # points[i] is the (lat, lng) of city record i, read straight from the memory map as well
+        self.points = np.frombuffer(self.buffer, dtype="<f4", count=2 * n_cities, offset=points_offset) \
+            .reshape(n_cities, 2)
+
+    def coordinates(self, city: str) -> Optional[Tuple[float, float]]:
+        record = self.cities.record(city)
+        if record < 0:
+            return None
+        lat, lng = self.points[record].tolist()
+        return lat, lng
+
+    @functools.cached_property
+    def city_names(self) -> List[str]:
+        """Names of the city records, in record order. Cities with a different ascii name have two records."""
+        return list(self.cities)
+
+    @functools.cached_property
+    def grid(self) -> SpatialGrid:
+        return SpatialGrid(self.points)
+
+    def nearest_city(self, lat: float, lng: float) -> Optional[Tuple[str, float]]:
+        """Name of and distance in km to the city nearest to (lat, lng)."""
+        record, distance = self.grid.nearest(lat, lng)
+        return (self.city_names[record], distance) if record >= 0 else None
+
+    def cities_within(self, south: float, west: float, north: float, east: float) -> List[str]:
+        """Names of the cities inside a bounding box, see SpatialGrid.within."""
+        return [self.city_names[record] for record in self.grid.within(south, west, north, east)]
+
+    @classmethod
+    def load(cls, csv_path: str = WORLDCITIES_PATH, path: str = GAZETTEER_PATH,
+             min_population: int = MIN_POPULATION) -> "Gazetteer":
+        source_hash = file_hash(csv_path)
+
+        if os.path.isfile(path):
+            try:
+                gazetteer = cls(path)
+                if gazetteer.source_hash == source_hash and gazetteer.min_population == min_population:
+                    logger.info(f"Loaded compiled gazetteer from {path}")
+                    return gazetteer
+                logger.info(f"{path} is outdated")
+            except (ValueError, struct.error) as e:
+                logger.warning(f"Could not read {path}: {e}")
+
+        compile_gazetteer(csv_path, path, min_population)
+        return cls(path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compile worldcities.csv into a memory-mappable gazetteer")
+    arg_parser.add_argument("--csv", default=WORLDCITIES_PATH)
+    arg_parser.add_argument("--out", default=GAZETTEER_PATH)
+    arg_parser.add_argument("--min-population", type=int, default=MIN_POPULATION)
+    args = arg_parser.parse_args()
+
+    compile_gazetteer(args.csv, args.out, args.min_population)
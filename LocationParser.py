@@ -1,67 +1,154 @@
+from Gazetteer import Gazetteer, city_prefixes, MAX_CITY_WORDS, WORLDCITIES_PATH, GAZETTEER_PATH, MIN_POPULATION
 from typing import *
-import logging
-import csv
-import re
-import os
+import instrumentation
+import hashlib
+import inspect
+import log_files
 
-if os.path.isfile("./logs/location_parser.log"):
-    os.remove("./logs/location_parser.log")
+logger = log_files.module_logger(__name__, "location_parser.log")
 
-# Setting up the logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('logs/location_parser.log')
-file_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-logger.addHandler(file_handler)
-logger.propagate = False
+# Characters that have to follow a country name for it to count as a match
+COUNTRY_TERMINATORS = frozenset(" .,-!?$")
+
+_END = ""  # Trie key marking the end of a country name
+
+
+class GazetteerMatcher:
+    """
+    Single-pass matcher for country and city names.
+
+    Countries are matched with a character trie using the same leftmost-first, non-overlapping semantics as the
+    alternation regex `(c1|c2|...)[ .,\\-!?$]`: at each position the first country (in file order) that is followed
+    by a terminator wins. Cities are matched with prefix-gated word n-gram lookups, so a sentence is split only
+    once.
+    """
+    def __init__(self, countries: List[str], cities_lut: Mapping[str, str],
+                 prefixes: Optional[Container[str]] = None):
+        self.country_trie: dict = {}
+        for priority, country in enumerate(countries):
+            if not country:
+                continue
+            node = self.country_trie
+            for char in country:
+                node = node.setdefault(char, {})
+            node.setdefault(_END, (priority, country))
+
+        self.cities_lut = cities_lut
+        self.city_prefixes = prefixes if prefixes is not None else city_prefixes(cities_lut)
+
+    def match_countries(self, sentence: str) -> Set[str]:
+        found = set()
+        trie = self.country_trie
+        i, n = 0, len(sentence)
+
+        while i < n:
+            node = trie.get(sentence[i])
+            best = None
+            j = i + 1
+            while node is not None:
+                if _END in node and j < n and sentence[j] in COUNTRY_TERMINATORS:
+                    if best is None or node[_END][0] < best[0]:
+                        best = node[_END] + (j,)
+                if j >= n:
+                    break
+                node = node.get(sentence[j])
+                j += 1
+
+            if best is None:
+                i += 1
+            else:
+                found.add(best[1])
+                i = best[2] + 1  # The terminator is consumed as part of the match
+
+        return found
+
+    def match_city_names(self, sentence: str) -> Dict[str, str]:
+        """The names of the cities in sentence, with their countries."""
+        found = {}
+        lut = self.cities_lut
+        prefixes = self.city_prefixes
+        words = sentence.split(" ")
+
+        for i in range(len(words)):
+            name = words[i]
+            for w in range(1, MAX_CITY_WORDS + 1):
+                if w > 1:
+                    if i + w > len(words) or name not in prefixes:
+                        break
+                    name = name + " " + words[i + w - 1]
+                country = lut.get(name)
+                if country is not None:
+                    found[name] = country
+
+        return found
+
+    def match_cities(self, sentence: str) -> Set[str]:
+        return set(self.match_city_names(sentence).values())
+
+    def match(self, sentence: str) -> Set[str]:
+        return self.match_countries(sentence) | self.match_cities(sentence)
 
 
 class LocationParser:
-    def __init__(self):
-        with open("resources/countries.txt", "r") as file:
+    @instrumentation.timed("load_gazetteer")
+    def __init__(self, countries_path: str = "resources/countries.txt", csv_path: str = WORLDCITIES_PATH,
+                 gazetteer_path: str = GAZETTEER_PATH, min_population: int = MIN_POPULATION):
+        with open(countries_path, "r") as file:
             lines = [line.strip() for line in file.readlines()]
-            self.countries_regex = r"(" + "|".join(lines) + ")[ .,\\-!?$]"
-            logger.info(f"Loaded ./resources/countries.txt! Contains {len(lines)} countries.")
-
-        cities_population = {}
-        self.country_codes = {}
-        self.cities_lut = {}
-
-        with open("./resources/worldcities.csv", "r") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar="\"")
-            headers = reader.__next__()
-            for row in reader:
-                if row[4] not in self.country_codes:
-                    self.country_codes[row[4]] = row[5].lower()
-                population = -1 if not row[9] else int(float(row[9]))
-
-                if 0 <= population < 50000:
-                    logger.info(f"Population of town < 50000! Leaving out \'{row}\'")
-                    continue
-
-                if not row[0] in self.cities_lut or\
-                      (row[0] in cities_population and population > cities_population[row[0]]):
-                    self.cities_lut[row[0]] = row[4]
-                    self.cities_lut[row[1]] = row[4]
-                    cities_population[row[0]] = population
-
-        del cities_population
+            logger.info(f"Loaded {countries_path}! Contains {len(lines)} countries.")
+
+        self.gazetteer = Gazetteer.load(csv_path, gazetteer_path, min_population)
+        self.country_codes = self.gazetteer.country_codes
+        self.cities_lut = self.gazetteer.cities
+
+        self.matcher = GazetteerMatcher(lines, self.cities_lut, self.gazetteer.prefixes)
         self.countries_found = set()
+        self.countries = lines
 
         logger.info(f"Created lookup table! Contains {len(self.cities_lut)} entries.")
 
     def get_countries(self, sentence: str) -> List[str]:
-        found = set()
+        found = self.matcher.match(sentence)
+        self.countries_found.update(found)
 
-        for country in re.findall(self.countries_regex, sentence):
-            found.add(country)
+        return list(found)
 
-        for w in range(1, 4):
-            for i in range(len(sentence.split(" ")) - (w - 1)):
-                name = " ".join(sentence.split(" ")[i:i+w])
-                if name in self.cities_lut:
-                    found.add(self.cities_lut[name])
+    def get_locations(self, sentence: str) -> Tuple[List[str], List[List[float]]]:
+        """The countries like get_countries, and the [lat, lng] of every city that was found (offline geocoding)."""
+        cities = self.matcher.match_city_names(sentence)
+        found = self.matcher.match_countries(sentence) | set(cities.values())
+        self.countries_found.update(found)
 
-        self.countries_found = self.countries_found.union(found)
+        # A city can be mentioned by both of its names
+        coordinates = {self.gazetteer.coordinates(name) for name in cities}
+        return list(found), [[lat, lng] for lat, lng in sorted(coordinates)]
 
-        return list(found)
+    def get_countries_many(self, sentences: Iterable[str]) -> List[List[str]]:
+        match = self.matcher.match
+        result = []
+
+        for sentence in sentences:
+            found = match(sentence)
+            self.countries_found.update(found)
+            result.append(list(found))
+
+        return result
+
+    def record_cache_stats(self):
+        """Adds the hits and misses of the gazetteer lookup caches to the instrumentation of the current stage."""
+        for name, table in [("cities", self.cities_lut), ("prefixes", self.gazetteer.prefixes)]:
+            info = table.cache_info()
+            instrumentation.cache(f"gazetteer.{name}", info.hits, info.misses)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of everything that determines the output of get_countries and get_locations: the gazetteer data and the
+        matcher code.
+        """
+        digest = hashlib.sha256()
+        digest.update("\n".join(self.countries).encode("utf-8"))
+        digest.update(self.gazetteer.source_hash)
+        digest.update(str(self.gazetteer.min_population).encode("utf-8"))
+        digest.update(inspect.getsource(GazetteerMatcher).encode("utf-8"))
+        digest.update(inspect.getsource(LocationParser.get_locations).encode("utf-8"))
+        return digest.hexdigest()
@@ -0,0 +1,244 @@
+from TemporospatialStore import TemporospatialStore, TemporospatialView
+from TemporospatialIndex import TemporospatialIndex, INDEX_PATH
+from DataCollector import DataCollector, EXCLUDED_LINKS
+from LocationParser import LocationParser
+from collections import Counter
+from Processor import Processor, YEAR_REGEX
+from data_types import *
+import instrumentation
+import numpy as np
+import datetime
+import hashlib
+import inspect
+import log_files
+import msgpack
+import sqlite3
+import os
+
+logger = log_files.module_logger(__name__, "pipeline.log")
+
+STAGE_CACHE_PATH = "./data/stage_cache.sqlite"
+
+# Bump these to invalidate a stage by hand, e.g. after changing code the source hashes below do not cover
+PREPROCESS_VERSION = 1
+EXTRACT_VERSION = 1
+FILTER_VERSION = 1
+
+STAGES = ["scrape", "preprocess", "extract", "filter_outliers", "aggregate"]
+
+
+def content_hash(*parts) -> str:
+    return hashlib.sha256(msgpack.packb(parts)).hexdigest()
+
+
+def source_hash(*functions) -> str:
+    return content_hash(*[inspect.getsource(f) for f in functions])
+
+
+class StageCache:
+    """Outputs of pipeline stages in sqlite, keyed by stage and input key, together with the hash of the output."""
+    def __init__(self, path: str = STAGE_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS outputs (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                output_hash TEXT NOT NULL,
+                value BLOB NOT NULL,
+                PRIMARY KEY (stage, key)
+            )
+        """)
+
+    def output_hash(self, stage: str, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT output_hash FROM outputs WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+        return row[0] if row else None
+
+    def load(self, stage: str, key: str):
+        row = self.db.execute("SELECT value FROM outputs WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+        return msgpack.unpackb(row[0])
+
+    def store(self, stage: str, key: str, value) -> str:
+        packed = msgpack.packb(value)
+        output_hash = hashlib.sha256(packed).hexdigest()
+        self.db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)", (stage, key, output_hash, packed))
+        return output_hash
+
+    def prune(self, stage: str, keys: Set[str]) -> int:
+        """Removes outputs of stage that are not in keys, i.e. outputs of inputs or code that no longer exist."""
+        stale = [(stage, key) for (key,) in self.db.execute("SELECT key FROM outputs WHERE stage = ?", (stage,))
+                 if key not in keys]
+        self.db.executemany("DELETE FROM outputs WHERE stage = ? AND key = ?", stale)
+        self.db.commit()
+        return len(stale)
+
+    def commit(self):
+        self.db.commit()
+
+
+class Pipeline:
+    """
+    The analysis as explicit stages: scrape -> preprocess -> extract -> filter_outliers -> aggregate.
+
+    Every stage output up to filter_outliers is cached per composer under a key made of the stage name, the stage's
+    code version and the hash of its input (the output of the previous stage). A re-run therefore only recomputes
+    the composers and stages whose input or code changed. Scraping is cached per composer by the crawl queue and the
+    response cache, its output (the text) is hashed to key the following stages. filter_outliers caches which years
+    of a composer's entries are kept. The aggregate is not cached, as it would only be a copy of those outputs: it
+    builds one store of the cached entries of all composers and applies the cached masks to it.
+
+    Next to the analysis, the pipeline keeps a TemporospatialIndex of the extracted entries (before filtering) at
+    index_path up to date, for queries on the data. It is only rebuilt when an extract output changed.
+    """
+    def __init__(self, data_collector: DataCollector, processor: Processor, cache: Optional[StageCache] = None,
+                 index_path: Optional[str] = INDEX_PATH):
+        self.data_collector = data_collector
+        self.processor = processor
+        self.cache = cache if cache else StageCache()
+        self.index_path = index_path
+        self.stats: Dict[str, Counter] = {}
+        self.keys: Dict[str, Set[str]] = {}
+
+    def stage_versions(self, loc_parser: LocationParser) -> Dict[str, str]:
+        return {
+            "preprocess": content_hash(PREPROCESS_VERSION, source_hash(Processor.sentence_tokenize_text)),
+            "extract": content_hash(EXTRACT_VERSION, source_hash(Processor.extract_entries), YEAR_REGEX.pattern,
+                                    loc_parser.fingerprint(), datetime.datetime.now().year, self.processor.geocode),
+            "filter_outliers": content_hash(FILTER_VERSION, source_hash(Processor.era_windows,
+                                                                        Processor.outlier_year_mask,
+                                                                        TemporospatialStore.years_in_era_ranges,
+                                                                        _year_mask)),
+        }
+
+    def _cached(self, stage: str, key: str, compute: Callable[[], Any]) -> Tuple[str, Callable[[], Any]]:
+        """Returns the output hash of a stage and a function loading its output, computing it only when needed."""
+        self.keys[stage].add(key)
+        output_hash = self.cache.output_hash(stage, key)
+        if output_hash is not None:
+            self.stats[stage]["cached"] += 1
+            return output_hash, lambda: self.cache.load(stage, key)
+
+        value = compute()
+        self.stats[stage]["computed"] += 1
+        return self.cache.store(stage, key, value), lambda: value
+
+    @instrumentation.timed("pipeline")
+    def run(self, order: list, buffer_fraction: float = 0.25) -> Tuple[TemporospatialView, List[str], dict]:
+        """
+        Runs all stages and returns the filtered data, the countries that were found and the country codes, like
+        Processor.filter_temporospatial followed by Processor.filter_outliers. The countries are those of the
+        extracted entries, before filtering.
+        """
+        self.stats = {stage: Counter() for stage in STAGES}
+        self.keys = {stage: set() for stage in STAGES}
+        loc_parser = LocationParser()
+        versions = self.stage_versions(loc_parser)
+        windows = Processor.era_windows(order, buffer_fraction)
+        links = [link for link in self.data_collector.parser_per_link if link not in EXCLUDED_LINKS]
+
+        # scrape -> preprocess, passing on the composers whose extraction is not cached yet
+        composers: List[Tuple[str, str]] = []  # link and extract key of every composer, in order
+        missing: Dict[Tuple[str, str], str] = {}  # extract keys of the composers that are being extracted
+
+        # Scraping and preprocessing only happen while extract pulls in the composers, so they are timed as stages of
+        # their own around every pull instead of as part of extract
+        def to_extract() -> Iterator[Composer]:
+            texts = self.data_collector.iter_composer_texts(links)
+            while True:
+                with instrumentation.interleaved("scrape"):
+                    item = next(texts, None)
+                if item is None:
+                    return
+                link, name, text = item
+
+                with instrumentation.interleaved("preprocess"):
+                    preprocess_hash, sentences = self._cached(
+                        "preprocess", content_hash(versions["preprocess"], content_hash(text)),
+                        lambda: Processor.sentence_tokenize_text(text)
+                    )
+                # The entries hold the composer's name, so composers with the same text (e.g. two names redirecting to
+                # one article) do not share them
+                extract_key = content_hash(versions["extract"], preprocess_hash, link, name)
+                composers.append((link, extract_key))
+                self.keys["extract"].add(extract_key)
+
+                if self.cache.output_hash("extract", extract_key) is None:
+                    missing[(link, name)] = extract_key
+                    with instrumentation.interleaved("preprocess"):
+                        composer = Composer(name, link, text, sentences())
+                    yield composer
+                else:
+                    self.stats["extract"]["cached"] += 1
+
+        # extract, possibly in parallel, only for the composers that need it
+        with instrumentation.stage("extract"):
+            for composer, entries in self.processor.extract_per_composer(to_extract(), loc_parser):
+                self.cache.store("extract", missing.pop((composer.era, composer.name)),
+                                 [e.to_dict() for e in entries])
+                self.stats["extract"]["computed"] += 1
+            self.cache.commit()
+            loc_parser.record_cache_stats()
+
+        scraped = sum(self.data_collector.scraped.get(link, 0) for link in links)
+        self.stats["scrape"].update(cached=len(composers) - scraped, computed=scraped)
+
+        # filter_outliers, per composer
+        extract_hashes = []
+        filtered: List[Tuple[str, str, Callable[[], bytes]]] = []
+        with instrumentation.stage("filter_outliers"):
+            for link, extract_key in composers:
+                extract_hash = self.cache.output_hash("extract", extract_key)
+                window = windows.get(link)
+                _, year_mask = self._cached(
+                    "filter_outliers", content_hash(versions["filter_outliers"], extract_hash, window),
+                    lambda key=extract_key, link=link: _year_mask(self.cache.load("extract", key), link, windows)
+                )
+                extract_hashes.append(extract_hash)
+                filtered.append((link, extract_key, year_mask))
+            self.cache.commit()
+
+        # aggregate: all entries, grouped per link, with the years filter_outliers keeps
+        with instrumentation.stage("aggregate"):
+            entries = {link: [] for link in links}
+            year_masks = {link: [] for link in links}
+            for link, extract_key, year_mask in filtered:
+                entries[link].extend(self.cache.load("extract", extract_key))
+                year_masks[link].append(year_mask())
+            self.stats["aggregate"]["computed"] += 1
+
+            store = TemporospatialStore.from_entries(
+                ((link, temporospatial_from_json(entry)) for link in links for entry in entries[link]),
+                era_names=links
+            )
+            year_mask = b"".join(mask for link in links for mask in year_masks[link])
+            view = TemporospatialView(store, np.frombuffer(year_mask, dtype=bool).copy())
+            countries = sorted(store.country_names)
+            instrumentation.count("entries", len(store))
+
+        # index, of the unfiltered entries like Processor.filter_temporospatial returns them
+        if self.index_path:
+            with instrumentation.stage("index"):
+                index_source = content_hash(links, extract_hashes)
+                if TemporospatialIndex.stored_source(self.index_path) != index_source:
+                    index = TemporospatialIndex.from_store(store, index_source)
+                    index.save(self.index_path)
+                    instrumentation.count("entries", len(index))
+                    logger.info(f"Saved the index of {len(index)} entries to {self.index_path}")
+
+        # Pruning also removes the outputs of the aggregate stage, which were cached by earlier versions
+        for stage in STAGES:
+            removed = self.cache.prune(stage, self.keys[stage]) if stage != "scrape" else 0
+            instrumentation.cache(f"stage_cache.{stage}", self.stats[stage]["cached"], self.stats[stage]["computed"])
+            logger.info(f"Stage {stage}: {dict(self.stats[stage])}, {removed} stale outputs removed")
+
+        return view, countries, loc_parser.country_codes
+
+
+def _year_mask(entries: List[dict], link: str, windows: Dict[str, Tuple[int, int]]) -> bytes:
+    """The years of the entries of a composer of link that Processor.filter_outliers keeps, as a packed mask."""
+    store = TemporospatialStore.from_entries(((link, temporospatial_from_json(entry)) for entry in entries),
+                                             era_names=[link])
+    return Processor.outlier_year_mask(store, windows).tobytes()
@@ -1,26 +1,71 @@
+from TemporospatialStore import TemporospatialStore, TemporospatialView
 from LocationParser import LocationParser
 from data_types import *
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from tqdm import tqdm
+import instrumentation
 import numpy as np
+import itertools
 import datetime
-import logging
-import copy
+import log_files
 import re
 import os
 
-if os.path.isfile("./logs/processor.log"):
-    os.remove("./logs/processor.log")
+logger = log_files.module_logger(__name__, "processor.log")
 
-# Setting up the logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('logs/processor.log')
-file_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-logger.addHandler(file_handler)
-logger.propagate = False
+YEAR_REGEX = re.compile("([12]?[0-9]{3})( BC| B.C.| BC.)?")
+
+# Location parser and geocoding mode of a worker process, set once by _init_worker
+_worker_loc_parser: Optional[LocationParser] = None
+_worker_geocode = False
+
+
+def _init_worker(geocode: bool = False):
+    global _worker_loc_parser, _worker_geocode
+    _worker_loc_parser = LocationParser()
+    _worker_geocode = geocode
+
+
+def _filter_composer(composer: Composer) -> Tuple[List[TemporospatialEntry], Set[str]]:
+    _worker_loc_parser.countries_found = set()
+    entries = Processor.extract_entries(composer, _worker_loc_parser, datetime.datetime.now().year, _worker_geocode)
+    return entries, _worker_loc_parser.countries_found
+
+
+def _filter_composers(composers: List[Composer]) -> List[Tuple[List[TemporospatialEntry], Set[str]]]:
+    return [_filter_composer(composer) for composer in composers]
+
+
+def _count_extracted(composer: Composer, entries: List[TemporospatialEntry]):
+    instrumentation.count("composers")
+    instrumentation.count("sentences", len(composer.sentences))
+    instrumentation.count("entries", len(entries))
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class Processor:
+    def __init__(self, workers: Optional[int] = 1, chunk_size: int = 8, geocode: bool = False):
+        """
+        :param workers: Number of processes used by filter_temporospatial. 1 keeps everything in this process,
+            which is easiest to debug. None uses all cores.
+        :param chunk_size: Number of composers sent to a worker at once
+        :param geocode: Whether to attach the coordinates of the cities in a sentence to its entry, which are looked
+            up offline in the gazetteer
+        """
+        self.workers = workers if workers else os.cpu_count()
+        self.chunk_size = chunk_size
+        self.geocode = geocode
+
+    @instrumentation.timed()
     def preprocess(self, composers_per_link: dict) -> dict:
         result: Dict[str, List[Composer]] = {
             link: [] for link in composers_per_link.keys()
@@ -48,8 +93,28 @@ class Processor:
         return sentences
 
     @staticmethod
-    def filter_temporospatial(composers_per_link: dict) -> Tuple[dict, List[str], dict]:
+    def extract_entries(composer: Composer, loc_parser: LocationParser, current_year: int, geocode: bool = False) \
+            -> List[TemporospatialEntry]:
+        entries = []
+        for sentence in composer.sentences:
+            years = YEAR_REGEX.findall(sentence)
+            years = [int(y) for y, bc in years if len(bc) == 0 and int(y) <= current_year]
+            if years:
+                if geocode:
+                    locations, coordinates = loc_parser.get_locations(sentence)
+                else:
+                    locations, coordinates = loc_parser.get_countries(sentence), []
+                if locations:
+                    entries.append(TemporospatialEntry(years, list(locations), sentence, composer.name, coordinates))
+        return entries
+
+    @instrumentation.timed()
+    def filter_temporospatial(self, composers_per_link: dict) -> Tuple[dict, List[str], dict]:
+        if self.workers > 1:
+            return self.filter_temporospatial_parallel(composers_per_link)
+
         loc_parser = LocationParser()
+        current_year = datetime.datetime.now().year
 
         x: Dict[str, List[TemporospatialEntry]] = {link: [] for link in composers_per_link}
 
@@ -58,37 +123,144 @@ class Processor:
                         desc=f"Filtering years and locations for {link}")
             logger.info(f"Filtering years and locations for \'{link}\'")
             for composer in composers_per_link[link]:
-                for sentence in composer.sentences:
-                    years = re.findall("([12]?[0-9]{3})( BC| B.C.| BC.)?", sentence)
-                    years = [int(y) for y, bc in years if len(bc) == 0 and int(y) <= datetime.datetime.now().year]
-                    if years:
-                        locations = loc_parser.get_countries(sentence)
-                        if locations:
-                            x[link].append(TemporospatialEntry(years, list(locations), sentence, composer.name))
-                    pbar.update(1)
+                entries = self.extract_entries(composer, loc_parser, current_year, self.geocode)
+                _count_extracted(composer, entries)
+                x[link].extend(entries)
+                pbar.update(len(composer.sentences))
             pbar.close()
 
-        return x, list(loc_parser.countries_found), loc_parser.country_codes
+        return x, sorted(loc_parser.countries_found), loc_parser.country_codes
+
+    def filter_temporospatial_parallel(self, composers_per_link: dict) -> Tuple[dict, List[str], dict]:
+        """
+        Same as filter_temporospatial, but shards the composers over a pool of self.workers processes. Every worker
+        creates its own LocationParser once. Results are merged in submission order, so the output is identical to
+        the serial one.
+        """
+        loc_parser = LocationParser()  # Compiles the gazetteer if needed, before the workers try to map it
+        countries_found = set()
+
+        x: Dict[str, List[TemporospatialEntry]] = {link: [] for link in composers_per_link}
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.geocode,)) as executor:
+            # All eras are submitted at once, so workers never idle at era boundaries
+            results = executor.map(_filter_composer, itertools.chain.from_iterable(composers_per_link.values()),
+                                   chunksize=self.chunk_size)
+
+            for link in x:
+                composers = composers_per_link[link]
+                pbar = tqdm(total=sum([len(composer.sentences) for composer in composers]),
+                            desc=f"Filtering years and locations for {link} ({self.workers} workers)")
+                logger.info(f"Filtering years and locations for \'{link}\' using {self.workers} workers")
+
+                for composer in composers:
+                    entries, found = next(results)
+                    _count_extracted(composer, entries)
+                    x[link].extend(entries)
+                    countries_found.update(found)
+                    pbar.update(len(composer.sentences))
+                pbar.close()
+
+        return x, sorted(countries_found), loc_parser.country_codes
+
+    def iter_composers(self, composer_texts: Iterable[Tuple[str, str, str]]) -> Iterator[Composer]:
+        """
+        Lazily turns (link, composer name, text) triples into preprocessed composers, one at a time.
+        """
+        current_link = None
+        for link, name, text in composer_texts:
+            if link != current_link:
+                logger.info(f"Streaming texts of composers in \'{link}\'")
+                current_link = link
+            yield Composer(name, link, text, self.sentence_tokenize_text(text))
+
+    def extract_per_composer(self, composers: Iterable[Composer], loc_parser: LocationParser) \
+            -> Iterator[Tuple[Composer, List[TemporospatialEntry]]]:
+        """
+        Lazily extracts the entries of a stream of composers, in input order. Countries that are found are added to
+        loc_parser.countries_found. With multiple workers, only a bounded window of composers is in flight, so memory
+        stays proportional to the window instead of to the corpus.
+        """
+        if self.workers <= 1:
+            current_year = datetime.datetime.now().year
+            for composer in composers:
+                entries = self.extract_entries(composer, loc_parser, current_year, self.geocode)
+                _count_extracted(composer, entries)
+                yield composer, entries
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.geocode,)) as executor:
+            pending = deque()
+            chunks = _chunked(composers, self.chunk_size)
+
+            while True:
+                for chunk in itertools.islice(chunks, 2 * self.workers - len(pending)):
+                    pending.append((chunk, executor.submit(_filter_composers, chunk)))
+                if not pending:
+                    return
+
+                chunk, future = pending.popleft()
+                for composer, (entries, found) in zip(chunk, future.result()):
+                    loc_parser.countries_found.update(found)
+                    _count_extracted(composer, entries)
+                    yield composer, entries
+
+    def stream_temporospatial(self, composers: Iterable[Composer], loc_parser: LocationParser) \
+            -> Iterator[Tuple[str, TemporospatialEntry]]:
+        """Lazily extracts (link, entry) pairs from a stream of composers, see extract_per_composer."""
+        for composer, entries in self.extract_per_composer(composers, loc_parser):
+            for entry in entries:
+                yield composer.era, entry
 
     @staticmethod
-    def filter_outliers(temporospatial_data: dict, order: list) -> dict:
-        x = copy.deepcopy(temporospatial_data)
+    def group_per_link(stream: Iterable[Tuple[str, TemporospatialEntry]], links: Iterable[str]) -> dict:
+        """
+        Collects a stream of (link, entry) pairs into the per-link dict used by store_data, filter_outliers and the
+        visualizations.
+        """
+        x: Dict[str, List[TemporospatialEntry]] = {link: [] for link in links}
+        for link, entry in stream:
+            x.setdefault(link, []).append(entry)
+        return x
 
+    @staticmethod
+    def era_windows(order: list, buffer_fraction: float = 0.25) -> Dict[str, Tuple[int, int]]:
+        """Per era link, the predefined time period extended by buffer_fraction of its length on both sides."""
+        windows = {}
         for _, era, (start, end), _ in order:
-            entries: List[TemporospatialEntry] = x[era]
+            buffer = int((end - start) * buffer_fraction)
+            windows[era] = (start - buffer, end + buffer)
+        return windows
 
-            # Get new start and end year, adding some buffer to the boundaries
-            buffer = int((end - start)/4)
-            start -= buffer
-            end += buffer
+    @staticmethod
+    def outlier_year_mask(store: TemporospatialStore, windows: Dict[str, Tuple[int, int]]) -> np.ndarray:
+        """Boolean mask over the years of store, False for years outside the window of their era (see era_windows)."""
+        year_mask = store.years_in_era_ranges(windows)
 
-            # Filter years too far outside predefined time period
-            to_remove: List[int] = []
-            for i, entry in enumerate(entries):
-                if entry.filter_years(start, end) == 0:
-                    to_remove.append(i)
+        # Years of eras without a window are not filtered
+        windowed = np.array([era in windows for era in store.era_names], dtype=bool)
+        year_mask |= ~windowed[store.year_era_ids()]
+        return year_mask
 
-            for idx in reversed(to_remove):
-                entries.pop(idx)
+    @staticmethod
+    @instrumentation.timed()
+    def filter_outliers(temporospatial_data: Union[dict, TemporospatialStore, TemporospatialView], order: list,
+                        buffer_fraction: float = 0.25) -> TemporospatialView:
+        """
+        Drops years too far outside the time period of their era, and entries without any years left. Eras that are
+        not in order are kept as they are. The result is a view on the data, so filtering again (e.g. with a
+        different buffer_fraction) can reuse the same store.
+        """
+        if isinstance(temporospatial_data, TemporospatialView):
+            store = temporospatial_data.store
+        elif isinstance(temporospatial_data, TemporospatialStore):
+            store = temporospatial_data
+        else:
+            store = TemporospatialStore.from_temporospatial(temporospatial_data)
 
-        return x
+        year_mask = Processor.outlier_year_mask(store, Processor.era_windows(order, buffer_fraction))
+        instrumentation.count("years.in", len(year_mask))
+        instrumentation.count("years.kept", int(year_mask.sum()))
+        return TemporospatialView(store, year_mask)
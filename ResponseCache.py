@@ -0,0 +1,175 @@
+from data_types import *
+import hashlib
+import log_files
+import sqlite3
+import time
+import os
+
+logger = log_files.module_logger(__name__, "response_cache.log")
+
+CACHE_PATH = "./data/http_cache"
+TTL = 7 * 24 * 60 * 60  # Seconds a response is used without revalidating it
+MAX_BYTES = 1 << 30
+EVICT_TO = 0.9  # Eviction frees space down to this fraction of max_bytes, so it does not run on every put
+ACCESS_BATCH = 256  # Number of access times kept in memory before they are written
+DB_TIMEOUT = 30.0  # Seconds to wait for a lock held by another crawl process
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Persistent per-URL cache of response bodies. Bodies are stored once per content hash under objects/, an sqlite
+    index maps urls to hashes and validators (ETag, Last-Modified). Responses older than ttl are revalidated instead
+    of refetched, and the least recently used responses are evicted once the bodies exceed max_bytes. Access times
+    are written in batches (see flush), and the size of the bodies is kept as a running total, so reads and writes
+    do not scan the index. The index can be shared by several crawl processes.
+    """
+    def __init__(self, path: str = CACHE_PATH, ttl: float = TTL, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=DB_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer of another process
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_hash ON responses(hash)")
+        self.db.commit()
+
+        self.accessed: Dict[str, float] = {}  # Access times not written yet
+        self.total = self.size()
+
+    def settings(self) -> dict:
+        """The arguments to open the same cache with, e.g. in another process."""
+        return {"path": self.path, "ttl": self.ttl, "max_bytes": self.max_bytes}
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest)
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        row = self.db.execute("SELECT hash, etag, last_modified, fetched_at FROM responses WHERE url = ?",
+                              (url,)).fetchone()
+        if row is None:
+            return None
+
+        digest, etag, last_modified, fetched_at = row
+        try:
+            with open(self._object_path(digest), "rb") as file:
+                body = file.read().decode("utf-8")
+        except FileNotFoundError:
+            logger.warning(f"Object {digest} of {url} is missing, dropping it from the index")
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.db.commit()
+            return None
+
+        now = time.time()
+        self.accessed[url] = now
+        if len(self.accessed) >= ACCESS_BATCH:
+            self.flush()
+        return CachedResponse(url, body, etag, last_modified, now - fetched_at < self.ttl)
+
+    def put(self, url: str, body: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f"{object_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, object_path)
+            self.total += len(data)
+
+        previous = self.db.execute("SELECT hash FROM responses WHERE url = ?", (url,)).fetchone()
+        now = time.time()
+        self.accessed.pop(url, None)
+        self._write_accessed()
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (url, digest, len(data), etag, last_modified, now, now))
+        self.db.commit()
+
+        if previous and previous[0] != digest:
+            self._drop_object(previous[0])
+        self.evict()
+
+    def revalidated(self, url: str):
+        """Marks a cached response as fresh again, after the server answered 304 Not Modified."""
+        now = time.time()
+        self.accessed.pop(url, None)
+        self._write_accessed()
+        self.db.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+        self.db.commit()
+
+    def _write_accessed(self):
+        if self.accessed:
+            self.db.executemany("UPDATE responses SET accessed_at = ? WHERE url = ?",
+                                [(accessed_at, url) for url, accessed_at in self.accessed.items()])
+            self.accessed.clear()
+
+    def flush(self):
+        """Writes the access times of the responses read since the last write."""
+        if self.accessed:
+            self._write_accessed()
+            self.db.commit()
+
+    def size(self) -> int:
+        row = self.db.execute("SELECT SUM(size) FROM (SELECT DISTINCT hash, size FROM responses)").fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        if self.total <= self.max_bytes:
+            return
+        # Other processes sharing the cache change the total as well, so it is only trusted to trigger eviction
+        self._write_accessed()
+        self.total = self.size()
+        if self.total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for url, digest in self.db.execute("SELECT url, hash FROM responses ORDER BY accessed_at").fetchall():
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self._drop_object(digest)
+            evicted += 1
+            if self.total <= self.max_bytes * EVICT_TO:
+                break
+        self.db.commit()
+        logger.info(f"Evicted {evicted} responses, cache now holds {self.total} bytes")
+
+    def _drop_object(self, digest: str) -> int:
+        """Removes an object once no url refers to it anymore. Returns the number of bytes freed."""
+        if self.db.execute("SELECT 1 FROM responses WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+            return 0
+        object_path = self._object_path(digest)
+        if not os.path.isfile(object_path):
+            return 0
+        size = os.path.getsize(object_path)
+        os.remove(object_path)
+        self.total -= size
+        return size
@@ -0,0 +1,123 @@
+from typing import *
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+CELL_SIZE = 1.0  # Degrees
+
+
+def distance_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Great-circle (haversine) distances from (lat, lng) to all (lats, lngs)."""
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def grid_shape(cell_size: float = CELL_SIZE) -> Tuple[int, int]:
+    """Rows and columns of a grid of cell_size by cell_size degrees over the globe."""
+    return int(np.ceil(180 / cell_size)), int(np.ceil(360 / cell_size))
+
+
+def grid_rows(lats: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    n_rows, _ = grid_shape(cell_size)
+    return np.clip(np.floor((np.asarray(lats) + 90) / cell_size).astype(np.int64), 0, n_rows - 1)
+
+
+def grid_cols(lngs: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    _, n_cols = grid_shape(cell_size)
+    return np.clip(np.floor((np.asarray(lngs) + 180) / cell_size).astype(np.int64), 0, n_cols - 1)
+
+
+def grid_cells(lats: np.ndarray, lngs: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    """Numbers of the cells of points, row by row from the south-west."""
+    return grid_rows(lats, cell_size) * grid_shape(cell_size)[1] + grid_cols(lngs, cell_size)
+
+
+class SpatialGrid:
+    """
+    Grid index over (lat, lng) points for nearest-point and bounding box queries. The globe is divided into cells of
+    cell_size by cell_size degrees, numbered row by row from the south-west. The point ids are sorted by cell:
+        ids[offsets[cell]:offsets[cell + 1]]    the points in cell = row * n_cols + col
+    so the points of adjacent cells in a row are one slice. A nearest-point query searches growing boxes of cells
+    around the cell of the query point, until no cell outside the box can be closer than the best point found.
+    """
+    def __init__(self, points: np.ndarray, cell_size: float = CELL_SIZE):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+        self.n_rows, self.n_cols = grid_shape(cell_size)
+
+        cells = grid_cells(self.points[:, 0], self.points[:, 1], cell_size)
+        self.ids = np.argsort(cells, kind="stable")
+        self.offsets = np.zeros(self.n_rows * self.n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.n_rows * self.n_cols), out=self.offsets[1:])
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def rows(self, lats: np.ndarray) -> np.ndarray:
+        return grid_rows(lats, self.cell_size)
+
+    def cols(self, lngs: np.ndarray) -> np.ndarray:
+        return grid_cols(lngs, self.cell_size)
+
+    def _cell_ids(self, cells: np.ndarray) -> np.ndarray:
+        """Ids of the points in cells, concatenated."""
+        starts = self.offsets[cells]
+        lengths = self.offsets[cells + 1] - starts
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.ids[np.repeat(starts, lengths) + within]
+
+    def within(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """
+        Sorted ids of the points inside a bounding box (inclusive). A box with west > east crosses the antimeridian.
+        """
+        rows = np.arange(self.rows(south), self.rows(north) + 1)
+        if west <= east:
+            cols = np.arange(self.cols(west), self.cols(east) + 1)
+        else:
+            cols = np.concatenate([np.arange(self.cols(west), self.n_cols), np.arange(0, self.cols(east) + 1)])
+        ids = self._cell_ids((rows[:, np.newaxis] * self.n_cols + cols[np.newaxis, :]).ravel())
+
+        lats, lngs = self.points[ids, 0], self.points[ids, 1]
+        inside = (south <= lats) & (lats <= north)
+        inside &= ((west <= lngs) & (lngs <= east)) if west <= east else ((west <= lngs) | (lngs <= east))
+        return np.sort(ids[inside])
+
+    def _box(self, row: int, col: int, r: int) -> np.ndarray:
+        """The cells at most r cells away from (row, col), wrapping around in longitude."""
+        rows = np.arange(max(row - r, 0), min(row + r, self.n_rows - 1) + 1)
+        cols = np.arange(col - r, col + r + 1) % self.n_cols if 2 * r + 1 < self.n_cols else np.arange(self.n_cols)
+        return (rows[:, np.newaxis] * self.n_cols + cols[np.newaxis, :]).ravel()
+
+    def _unsearched_distance_km(self, lat: float, lng: float, row: int, col: int, r: int) -> float:
+        """Lower bound on the distance to any point outside the box of cells at most r away from (row, col)."""
+        bound = np.inf
+        if row - r > 0:
+            bound = min(bound, lat - ((row - r) * self.cell_size - 90))
+        if row + r < self.n_rows - 1:
+            bound = min(bound, (row + r + 1) * self.cell_size - 90 - lat)
+        bound = np.radians(bound)
+
+        if 2 * r + 1 < self.n_cols:
+            # Points beyond a meridian at dlng degrees are at least as far as that meridian's great circle
+            dlng = min(lng - ((col - r) * self.cell_size - 180), (col + r + 1) * self.cell_size - 180 - lng)
+            bound = min(bound, np.arcsin(np.cos(np.radians(lat)) * np.sin(np.radians(min(dlng, 90)))))
+        return bound * EARTH_RADIUS_KM
+
+    def nearest(self, lat: float, lng: float) -> Tuple[int, float]:
+        """Id of and distance in km to the point nearest to (lat, lng), (-1, inf) if there are no points."""
+        if not len(self):
+            return -1, np.inf
+
+        row, col = int(self.rows(lat)), int(self.cols(lng))
+        r = 0
+        while True:
+            # Searching boxes that double in size takes few steps, also near the poles where the box has to span
+            # all longitudes, while the total work stays within a small factor of that of the last box
+            ids = self._cell_ids(self._box(row, col, r))
+            if len(ids):
+                distances = distance_km(lat, lng, self.points[ids, 0], self.points[ids, 1])
+                i = int(np.argmin(distances))
+                if distances[i] <= self._unsearched_distance_km(lat, lng, row, col, r):
+                    return int(ids[i]), float(distances[i])
+            r = 2 * r if r else 1
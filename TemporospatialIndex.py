@@ -0,0 +1,250 @@
+from TemporospatialStore import TemporospatialStore
+from data_types import *
+import numpy as np
+import argparse
+import os
+
+INDEX_PATH = "./data/temporospatial_index.npz"
+INDEX_VERSION = 2
+
+
+class TemporospatialIndex:
+    """
+    Query index over the entries of a TemporospatialStore, so that lookups do not scan all entries. The entries of
+    every country, era and composer are kept as a sorted posting list of entry ids, all lists of a field in one array:
+        country_postings[country_posting_offsets[c]:country_posting_offsets[c + 1]]      entries mentioning country id c
+        era_postings[era_posting_offsets[e]:era_posting_offsets[e + 1]]                  entries of era id e
+        composer_postings[composer_posting_offsets[c]:composer_posting_offsets[c + 1]]   entries of composer id c
+    The years are kept sorted, together with the entry they belong to, so a range of years is two binary searches.
+    A query intersects the postings of all its conditions.
+    """
+    def __init__(self, store: TemporospatialStore, country_postings: np.ndarray, country_posting_offsets: np.ndarray,
+                 era_postings: np.ndarray, era_posting_offsets: np.ndarray, composer_postings: np.ndarray,
+                 composer_posting_offsets: np.ndarray, sorted_years: np.ndarray, sorted_year_entries: np.ndarray,
+                 source: Optional[str] = None):
+        self.store = store
+        self.country_postings = country_postings
+        self.country_posting_offsets = country_posting_offsets
+        self.era_postings = era_postings
+        self.era_posting_offsets = era_posting_offsets
+        self.composer_postings = composer_postings
+        self.composer_posting_offsets = composer_posting_offsets
+        self.sorted_years = sorted_years
+        self.sorted_year_entries = sorted_year_entries
+        self.source = source  # Identifies the data the index was built from, to detect an outdated index
+
+        self.composer_index = {name: i for i, name in enumerate(store.composer_names)}
+
+    @classmethod
+    def from_store(cls, store: TemporospatialStore, source: Optional[str] = None) -> "TemporospatialIndex":
+        entry_ids = np.arange(len(store), dtype=np.int32)
+        country_entries = np.repeat(entry_ids, np.diff(store.country_offsets))
+        year_order = np.argsort(store.years, kind="stable")
+
+        return cls(
+            store,
+            *_postings(store.countries, country_entries, len(store.country_names)),
+            *_postings(store.era_ids, entry_ids, len(store.era_names)),
+            *_postings(store.composer_ids, entry_ids, len(store.composer_names)),
+            sorted_years=store.years[year_order],
+            sorted_year_entries=store.year_entry_ids()[year_order].astype(np.int32),
+            source=source,
+        )
+
+    @classmethod
+    def from_temporospatial(cls, temporospatial_data: dict, source: Optional[str] = None) -> "TemporospatialIndex":
+        """Builds the index of the per-link dict of entries, like the output of Processor.filter_temporospatial."""
+        return cls.from_store(TemporospatialStore.from_temporospatial(temporospatial_data), source)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    # Postings of single conditions, all sorted and without duplicates
+
+    def country_entries(self, country: str) -> np.ndarray:
+        return _posting(self.country_postings, self.country_posting_offsets, self.store.country_index.get(country))
+
+    def era_entries(self, era: str) -> np.ndarray:
+        return _posting(self.era_postings, self.era_posting_offsets, self.store.era_index.get(era))
+
+    def composer_entries(self, composer: str) -> np.ndarray:
+        return _posting(self.composer_postings, self.composer_posting_offsets, self.composer_index.get(composer))
+
+    def year_entries(self, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """Entries mentioning at least one year in start..end (inclusive), open ended when start or end is None."""
+        lower = 0 if start is None else np.searchsorted(self.sorted_years, np.int64(start), side="left")
+        upper = len(self.sorted_years) if end is None else np.searchsorted(self.sorted_years, np.int64(end), "right")
+        return np.unique(self.sorted_year_entries[lower:upper])
+
+    def query(self, countries: Optional[Iterable[str]] = None, eras: Optional[Iterable[str]] = None,
+              composers: Optional[Iterable[str]] = None, start: Optional[int] = None,
+              end: Optional[int] = None) -> np.ndarray:
+        """
+        Sorted ids of the entries that mention one of countries, belong to one of eras (links) and to one of
+        composers, and mention a year in start..end. Conditions that are None are not applied.
+        """
+        postings = []
+        for values, lookup in [(countries, self.country_entries), (eras, self.era_entries),
+                               (composers, self.composer_entries)]:
+            if values is not None:
+                postings.append(_union([lookup(value) for value in values]))
+        if start is not None or end is not None:
+            postings.append(self.year_entries(start, end))
+
+        if not postings:
+            return np.arange(len(self), dtype=np.int32)
+        postings.sort(key=len)  # Intersecting the shortest lists first keeps the intermediate results small
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    # Results
+
+    def entries(self, ids: np.ndarray) -> List[TemporospatialEntry]:
+        return [self.store.entry(i) for i in ids]
+
+    def sentences(self, ids: np.ndarray) -> List[str]:
+        return [self.store.sentence(i) for i in ids]
+
+    def composers(self, ids: np.ndarray) -> List[str]:
+        return [self.store.composer_names[i] for i in np.unique(self.store.composer_ids[ids])]
+
+    # Persistence
+
+    def save(self, path: str = INDEX_PATH):
+        store = self.store
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first, so readers never see a partial index
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                version=np.array(INDEX_VERSION),
+                source=np.array(self.source or ""),
+                years=store.years,
+                year_offsets=store.year_offsets,
+                countries=store.countries,
+                country_offsets=store.country_offsets,
+                composer_ids=store.composer_ids,
+                era_ids=store.era_ids,
+                text=np.frombuffer(store.text.encode("utf-8"), dtype=np.uint8),
+                text_offsets=store.text_offsets,
+                country_names=np.array(store.country_names, dtype=str),
+                composer_names=np.array(store.composer_names, dtype=str),
+                era_names=np.array(store.era_names, dtype=str),
+                points=store.points,
+                point_offsets=store.point_offsets,
+                country_postings=self.country_postings,
+                country_posting_offsets=self.country_posting_offsets,
+                era_postings=self.era_postings,
+                era_posting_offsets=self.era_posting_offsets,
+                composer_postings=self.composer_postings,
+                composer_posting_offsets=self.composer_posting_offsets,
+                sorted_years=self.sorted_years,
+                sorted_year_entries=self.sorted_year_entries,
+            )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def stored_source(path: str = INDEX_PATH) -> Optional[str]:
+        """The source of the index stored at path, None if there is no readable index of the current version."""
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as arrays:
+                if int(arrays["version"]) != INDEX_VERSION:
+                    return None
+                return str(arrays["source"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH, source: Optional[str] = None) -> Optional["TemporospatialIndex"]:
+        """Loads the index stored at path, None if it is missing, of another version or (given source) outdated."""
+        stored_source = cls.stored_source(path)
+        if stored_source is None or (source is not None and stored_source != source):
+            return None
+
+        with np.load(path) as arrays:
+            store = TemporospatialStore(
+                years=arrays["years"],
+                year_offsets=arrays["year_offsets"],
+                countries=arrays["countries"],
+                country_offsets=arrays["country_offsets"],
+                composer_ids=arrays["composer_ids"],
+                era_ids=arrays["era_ids"],
+                text=arrays["text"].tobytes().decode("utf-8"),
+                text_offsets=arrays["text_offsets"],
+                country_names=arrays["country_names"].tolist(),
+                composer_names=arrays["composer_names"].tolist(),
+                era_names=arrays["era_names"].tolist(),
+                points=arrays["points"],
+                point_offsets=arrays["point_offsets"],
+            )
+            return cls(
+                store,
+                country_postings=arrays["country_postings"],
+                country_posting_offsets=arrays["country_posting_offsets"],
+                era_postings=arrays["era_postings"],
+                era_posting_offsets=arrays["era_posting_offsets"],
+                composer_postings=arrays["composer_postings"],
+                composer_posting_offsets=arrays["composer_posting_offsets"],
+                sorted_years=arrays["sorted_years"],
+                sorted_year_entries=arrays["sorted_year_entries"],
+                source=stored_source or None,
+            )
+
+
+def _postings(keys: np.ndarray, entry_ids: np.ndarray, n_keys: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Posting lists of (key, entry id) pairs: the entry ids sorted by key and then by id, and the offsets per key."""
+    order = np.lexsort((entry_ids, keys))
+    keys, entry_ids = keys[order], entry_ids[order]
+    # An entry that mentions a value twice is listed once
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = (keys[1:] != keys[:-1]) | (entry_ids[1:] != entry_ids[:-1])
+    keys, entry_ids = keys[unique], entry_ids[unique]
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return entry_ids.astype(np.int32), offsets
+
+
+def _posting(postings: np.ndarray, offsets: np.ndarray, key: Optional[int]) -> np.ndarray:
+    if key is None:
+        return postings[:0]
+    return postings[offsets[key]:offsets[key + 1]]
+
+
+def _union(postings: List[np.ndarray]) -> np.ndarray:
+    if len(postings) == 1:
+        return postings[0]
+    return np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int32)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Query the temporospatial index, as kept up to date by main.py")
+    arg_parser.add_argument("--index", default=INDEX_PATH)
+    arg_parser.add_argument("--country", nargs="+", dest="countries")
+    arg_parser.add_argument("--era", nargs="+", dest="eras", help="links of composer lists, like "
+                                                                  "\"List of Baroque composers\"")
+    arg_parser.add_argument("--composer", nargs="+", dest="composers")
+    arg_parser.add_argument("--start", type=int, help="first year (inclusive)")
+    arg_parser.add_argument("--end", type=int, help="last year (inclusive)")
+    arg_parser.add_argument("--sentences", action="store_true", help="print the matching sentences as well")
+    args = arg_parser.parse_args()
+
+    index = TemporospatialIndex.load(args.index)
+    if index is None:
+        raise SystemExit(f"No index at {args.index}, run main.py first")
+
+    ids = index.query(args.countries, args.eras, args.composers, args.start, args.end)
+    print(f"{len(ids)} entries of {len(index.composers(ids))} composers")
+    if args.sentences:
+        for i in ids:
+            print(f"{index.store.composer_names[index.store.composer_ids[i]]}: {index.store.sentence(i)}")
+    else:
+        print("\n".join(index.composers(ids)))
@@ -0,0 +1,196 @@
+from data_types import *
+import numpy as np
+
+
+class TemporospatialStore:
+    """
+    Columnar storage of temporospatial entries. Per entry i:
+        years[year_offsets[i]:year_offsets[i + 1]]              the years mentioned in the sentence
+        countries[country_offsets[i]:country_offsets[i + 1]]    ids into country_names
+        composer_ids[i], era_ids[i]                             ids into composer_names and era_names
+        text[text_offsets[i]:text_offsets[i + 1]]               the sentence, sliced from one shared buffer
+        points[point_offsets[i]:point_offsets[i + 1]]           (lat, lng) of the cities in the sentence, if geocoded
+    """
+    def __init__(self, years: np.ndarray, year_offsets: np.ndarray, countries: np.ndarray,
+                 country_offsets: np.ndarray, composer_ids: np.ndarray, era_ids: np.ndarray, text: str,
+                 text_offsets: np.ndarray, country_names: List[str], composer_names: List[str], era_names: List[str],
+                 points: Optional[np.ndarray] = None, point_offsets: Optional[np.ndarray] = None):
+        self.years = years
+        self.year_offsets = year_offsets
+        self.countries = countries
+        self.country_offsets = country_offsets
+        self.composer_ids = composer_ids
+        self.era_ids = era_ids
+        self.text = text
+        self.text_offsets = text_offsets
+        self.country_names = country_names
+        self.composer_names = composer_names
+        self.era_names = era_names
+        self.points = points if points is not None else np.zeros((0, 2), dtype=np.float32)
+        self.point_offsets = point_offsets if point_offsets is not None else np.zeros(len(era_ids) + 1, dtype=np.int64)
+
+        self.country_index = {name: i for i, name in enumerate(country_names)}
+        self.era_index = {name: i for i, name in enumerate(era_names)}
+
+    @classmethod
+    def from_entries(cls, pairs: Iterable[Tuple[str, TemporospatialEntry]],
+                     era_names: Optional[List[str]] = None) -> "TemporospatialStore":
+        """Builds a store from a stream of (link, entry) pairs, e.g. the output of Processor.stream_temporospatial."""
+        era_index = {name: i for i, name in enumerate(era_names or [])}
+        country_index = {}
+        composer_index = {}
+
+        years, year_counts = [], []
+        countries, country_counts = [], []
+        composer_ids, era_ids = [], []
+        sentences = []
+        points, point_counts = [], []
+
+        for link, entry in pairs:
+            years.extend(entry.years)
+            year_counts.append(len(entry.years))
+            countries.extend(country_index.setdefault(c, len(country_index)) for c in entry.countries)
+            country_counts.append(len(entry.countries))
+            composer_ids.append(composer_index.setdefault(entry.composer, len(composer_index)))
+            era_ids.append(era_index.setdefault(link, len(era_index)))
+            sentences.append(entry.text)
+            points.extend(entry.coordinates)
+            point_counts.append(len(entry.coordinates))
+
+        return cls(
+            years=np.array(years, dtype=np.int16),
+            year_offsets=_offsets(year_counts),
+            countries=np.array(countries, dtype=np.int16),
+            country_offsets=_offsets(country_counts),
+            composer_ids=np.array(composer_ids, dtype=np.int32),
+            era_ids=np.array(era_ids, dtype=np.int8),
+            text="".join(sentences),
+            text_offsets=_offsets([len(s) for s in sentences]),
+            country_names=list(country_index),
+            composer_names=list(composer_index),
+            era_names=list(era_index),
+            points=np.array(points, dtype=np.float32).reshape(-1, 2),
+            point_offsets=_offsets(point_counts),
+        )
+
+    @classmethod
+    def from_temporospatial(cls, temporospatial_data: dict) -> "TemporospatialStore":
+        return cls.from_entries(
+            ((link, entry) for link, entries in temporospatial_data.items() for entry in entries),
+            era_names=list(temporospatial_data)
+        )
+
+    def __len__(self) -> int:
+        return len(self.era_ids)
+
+    def sentence(self, i: int) -> str:
+        return self.text[self.text_offsets[i]:self.text_offsets[i + 1]]
+
+    def entry(self, i: int) -> TemporospatialEntry:
+        country_ids = self.countries[self.country_offsets[i]:self.country_offsets[i + 1]]
+        return TemporospatialEntry(
+            years=self.years[self.year_offsets[i]:self.year_offsets[i + 1]].tolist(),
+            countries=[self.country_names[c] for c in country_ids],
+            text=self.sentence(i),
+            composer=self.composer_names[self.composer_ids[i]],
+            coordinates=self.points[self.point_offsets[i]:self.point_offsets[i + 1]].tolist(),
+        )
+
+    def to_temporospatial(self, indices: Optional[np.ndarray] = None) -> dict:
+        """Materializes (a subset of) the store back into the per-link dict of TemporospatialEntry lists."""
+        x: Dict[str, List[TemporospatialEntry]] = {link: [] for link in self.era_names}
+        for i in (range(len(self)) if indices is None else indices):
+            x[self.era_names[self.era_ids[i]]].append(self.entry(i))
+        return x
+
+    # Vectorized accessors, all arrays are aligned with self.years
+
+    def year_counts(self) -> np.ndarray:
+        return np.diff(self.year_offsets)
+
+    def year_entry_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), self.year_counts())
+
+    def year_era_ids(self) -> np.ndarray:
+        return np.repeat(self.era_ids, self.year_counts())
+
+    def years_in_range(self, start: int, end: int) -> np.ndarray:
+        return (start <= self.years) & (self.years <= end)
+
+    def years_in_era_ranges(self, ranges: Dict[str, Tuple[int, int]]) -> np.ndarray:
+        """
+        Boolean mask over all years, True where a year lies within the (inclusive) range of the era of its entry.
+        Years of eras without a range are never kept.
+        """
+        lower = np.full(len(self.era_names), np.iinfo(np.int32).max, dtype=np.int32)
+        upper = np.full(len(self.era_names), np.iinfo(np.int32).min, dtype=np.int32)
+        for era, (start, end) in ranges.items():
+            if era in self.era_index:
+                lower[self.era_index[era]] = start
+                upper[self.era_index[era]] = end
+
+        year_eras = self.year_era_ids()
+        return (lower[year_eras] <= self.years) & (self.years <= upper[year_eras])
+
+    def entries_with_years(self, year_mask: np.ndarray) -> np.ndarray:
+        """Boolean mask over entries, True where at least one year is kept by year_mask."""
+        return np.bincount(self.year_entry_ids()[year_mask], minlength=len(self)) > 0
+
+    # Vectorized accessors, aligned with the entries
+
+    def era_mask(self, era: str) -> np.ndarray:
+        return self.era_ids == self.era_index.get(era, -1)
+
+    def country_mask(self, country: str) -> np.ndarray:
+        country_id = self.country_index.get(country, -1)
+        hits = np.repeat(np.arange(len(self)), np.diff(self.country_offsets))[self.countries == country_id]
+        mask = np.zeros(len(self), dtype=bool)
+        mask[hits] = True
+        return mask
+
+
+def _offsets(counts: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+class TemporospatialView(Mapping):
+    """
+    Filtered view on a TemporospatialStore, defined by a boolean mask over all years. Nothing is copied: entries are
+    only materialized when an era is accessed like the per-link dict of TemporospatialEntry lists, while the
+    vectorized accessors work on the masked columns directly.
+    """
+    def __init__(self, store: TemporospatialStore, year_mask: np.ndarray):
+        self.store = store
+        self.year_mask = year_mask
+        self.entry_mask = store.entries_with_years(year_mask)
+
+    def __getitem__(self, link: str) -> List[TemporospatialEntry]:
+        if link not in self.store.era_index:
+            raise KeyError(link)
+
+        store = self.store
+        entries = []
+        for i in self.entry_ids(link):
+            start, end = store.year_offsets[i], store.year_offsets[i + 1]
+            entry = store.entry(i)
+            entry.years = store.years[start:end][self.year_mask[start:end]].tolist()
+            entries.append(entry)
+        return entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.era_names)
+
+    def __len__(self) -> int:
+        return len(self.store.era_names)
+
+    def entry_ids(self, link: Optional[str] = None) -> np.ndarray:
+        mask = self.entry_mask if link is None else self.entry_mask & self.store.era_mask(link)
+        return np.flatnonzero(mask)
+
+    def years(self, link: Optional[str] = None) -> np.ndarray:
+        mask = self.year_mask
+        if link is not None:
+            mask = mask & (self.store.year_era_ids() == self.store.era_index.get(link, -1))
+        return self.store.years[mask]
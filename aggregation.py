@@ -0,0 +1,161 @@
+"""
+Aggregates of the (filtered) temporospatial data, computed once with NumPy instead of per year in Python.
+"""
+from TemporospatialStore import TemporospatialStore, TemporospatialView
+from SpatialGrid import CELL_SIZE, grid_shape, grid_cells
+from data_types import *
+import numpy as np
+
+NO_ERA = -1
+
+
+class EraYearCounts:
+    """
+    Mentions per country, era and year as a dense tensor: counts[c, e, y] is the number of times a sentence of an
+    era e composer mentions year start + y together with country c. Eras are indexed in the order of the ORDER list.
+    """
+    def __init__(self, counts: np.ndarray, countries: List[str], era_names: List[str], start: int):
+        self.counts = counts
+        self.countries = countries
+        self.era_names = era_names
+        self.start = start
+
+    @classmethod
+    def from_data(cls, filtered_data: Union[dict, TemporospatialView], order: list,
+                  start: Optional[int] = None, end: Optional[int] = None) -> "EraYearCounts":
+        """Counts the data of the eras in order, for the years start..end (by default, the range of order)."""
+        start = order[0][2][0] if start is None else start
+        end = order[-1][2][1] if end is None else end
+
+        if isinstance(filtered_data, TemporospatialView):
+            store, year_mask = filtered_data.store, filtered_data.year_mask
+        else:
+            store = TemporospatialStore.from_temporospatial(filtered_data)
+            year_mask = np.ones(len(store.years), dtype=bool)
+
+        # Era ids of the store to era indices of order
+        links = [link for _, link, _, _ in order]
+        era_lut = np.array([links.index(era) if era in links else NO_ERA for era in store.era_names] + [NO_ERA],
+                           dtype=np.int64)
+
+        # One (country, era, year) triple per kept year of an entry, per country of that entry
+        kept = np.flatnonzero(year_mask & (start <= store.years) & (store.years <= end))
+        entries = store.year_entry_ids()[kept]
+        country_counts = np.diff(store.country_offsets)[entries]
+        first = np.repeat(store.country_offsets[:-1][entries], country_counts)
+        within = np.arange(len(first)) - np.repeat(np.cumsum(country_counts) - country_counts, country_counts)
+
+        countries = store.countries[first + within].astype(np.int64)
+        eras = np.repeat(era_lut[store.era_ids[entries]], country_counts)
+        years = np.repeat(store.years[kept].astype(np.int64) - start, country_counts)
+        in_order = eras != NO_ERA
+
+        shape = (len(store.country_names), len(order), end - start + 1)
+        flat = np.ravel_multi_index((countries[in_order], eras[in_order], years[in_order]), shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        return cls(counts, list(store.country_names), [name for name, _, _, _ in order], start)
+
+    @property
+    def years(self) -> np.ndarray:
+        return np.arange(self.start, self.start + self.counts.shape[2])
+
+    def reached(self) -> np.ndarray:
+        """reached[c, e, y]: whether country c was mentioned for era e in any year up to and including year y."""
+        return np.logical_or.accumulate(self.counts > 0, axis=2)
+
+    def latest_era(self) -> np.ndarray:
+        """latest[c, y]: the latest era reached by country c in year y, or NO_ERA if none was reached yet."""
+        reached = self.reached()
+        last = reached.shape[1] - 1 - np.argmax(reached[:, ::-1, :], axis=1)
+        return np.where(reached.any(axis=1), last, NO_ERA)
+
+    def latest_era_per_code(self, country_codes: dict) -> Tuple[List[str], np.ndarray]:
+        """Like latest_era, combined per map code (several countries can share a code). Unknown countries are
+        dropped. Returns the codes and the array with a row per code."""
+        codes = sorted({country_codes[c] for c in self.countries if c in country_codes})
+        code_index = {code: i for i, code in enumerate(codes)}
+
+        latest = self.latest_era()
+        per_code = np.full((len(codes), latest.shape[1]), NO_ERA, dtype=latest.dtype)
+        for i, country in enumerate(self.countries):
+            if country in country_codes:
+                row = code_index[country_codes[country]]
+                np.maximum(per_code[row], latest[i], out=per_code[row])
+        return codes, per_code
+
+    def frames(self, country_codes: dict) -> Iterator[Tuple[int, Dict[str, List[str]]]]:
+        """
+        Per year from the first year any country reached an era, the codes per era of a map of that year. Eras more
+        than one before the latest era reached anywhere are left empty.
+        """
+        codes, per_code = self.latest_era_per_code(country_codes)
+        latest_overall = per_code.max(axis=0, initial=NO_ERA)
+
+        for y in np.flatnonzero(latest_overall != NO_ERA):
+            eras = per_code[:, y]
+            codes_per_era = {era: [] for era in self.era_names}
+            for i in range(max(latest_overall[y] - 1, 0), len(self.era_names)):
+                codes_per_era[self.era_names[i]] = [codes[j] for j in np.flatnonzero(eras == i)]
+            yield int(self.start + y), codes_per_era
+
+
+class GridYearCounts:
+    """
+    City mentions per year and grid cell of cell_size by cell_size degrees (see SpatialGrid), from the coordinates
+    that offline geocoding attaches to the entries. Most cells are empty in most years, so the counts are kept
+    sparse: counts[i] mentions of year years[i] in cell cells[i], sorted by year and cell.
+    """
+    def __init__(self, years: np.ndarray, cells: np.ndarray, counts: np.ndarray, cell_size: float, start: int,
+                 end: int):
+        self.years = years
+        self.cells = cells
+        self.counts = counts
+        self.cell_size = cell_size
+        self.start = start
+        self.end = end
+        self.shape = grid_shape(cell_size)
+
+    @classmethod
+    def from_data(cls, filtered_data: Union[dict, TemporospatialView], cell_size: float = CELL_SIZE,
+                  start: Optional[int] = None, end: Optional[int] = None) -> "GridYearCounts":
+        """Counts the city mentions of the years start..end (by default, all years in the data)."""
+        if isinstance(filtered_data, TemporospatialView):
+            store, year_mask = filtered_data.store, filtered_data.year_mask
+        else:
+            store = TemporospatialStore.from_temporospatial(filtered_data)
+            year_mask = np.ones(len(store.years), dtype=bool)
+
+        kept_years = store.years[year_mask]
+        if start is None:
+            start = int(kept_years.min()) if len(kept_years) else 0
+        if end is None:
+            end = int(kept_years.max()) if len(kept_years) else 0
+
+        # One (year, cell) pair per kept year of an entry, per city of that entry
+        kept = np.flatnonzero(year_mask & (start <= store.years) & (store.years <= end))
+        entries = store.year_entry_ids()[kept]
+        point_counts = np.diff(store.point_offsets)[entries]
+        first = np.repeat(store.point_offsets[:-1][entries], point_counts)
+        within = np.arange(len(first)) - np.repeat(np.cumsum(point_counts) - point_counts, point_counts)
+        points = store.points[first + within]
+
+        n_cells = int(np.prod(grid_shape(cell_size)))
+        years = np.repeat(store.years[kept].astype(np.int64) - start, point_counts)
+        keys, counts = np.unique(years * n_cells + grid_cells(points[:, 0], points[:, 1], cell_size),
+                                 return_counts=True)
+        return cls(keys // n_cells + start, keys % n_cells, counts, cell_size, start, end)
+
+    def grid(self, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """
+        Dense grid[row, col] of the mentions in the years start..end, rows from the south and columns from the west.
+        """
+        lower = np.searchsorted(self.years, self.start if start is None else start, side="left")
+        upper = np.searchsorted(self.years, self.end if end is None else end, side="right")
+        grid = np.bincount(self.cells[lower:upper], weights=self.counts[lower:upper],
+                           minlength=int(np.prod(self.shape)))
+        return grid.astype(np.int64).reshape(self.shape)
+
+    def frames(self, window: int = 1) -> Iterator[Tuple[int, np.ndarray]]:
+        """Per year from start to end, the grid of the mentions in the window years up to and including it."""
+        for year in range(self.start, self.end + 1):
+            yield year, self.grid(year - window + 1, year)
@@ -0,0 +1,174 @@
+"""
+Offline benchmarks of the analysis on a synthetic corpus (see synthetic_corpus), with results as JSON.
+
+Everything runs in a separate work directory with its own resources/, data/ and logs/, so the benchmarks neither need
+the scraped data nor touch it. By default that is a temporary directory, which is removed afterwards. Example:
+    python benchmark.py --sentences 100000 --output data/benchmark_results.json
+"""
+from typing import *
+import synthetic_corpus
+import log_files
+import subprocess
+import statistics
+import tracemalloc
+import argparse
+import platform
+import datetime
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+BENCHMARKS = ["sentence_tokenize_text", "get_countries", "filter_temporospatial", "filter_outliers",
+              "render_maps_aggregation"]
+
+
+def prepare_workdir(workdir: str, n_cities: int, seed: int):
+    """Creates the work directory with countries.txt and a synthetic worldcities.csv, and makes it the cwd."""
+    countries_path = os.path.abspath("resources/countries.txt")
+    for directory in ["resources", "data", "logs"]:
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    shutil.copyfile(countries_path, os.path.join(workdir, "resources", "countries.txt"))
+    os.chdir(workdir)
+
+    countries = synthetic_corpus.read_countries()
+    cities = synthetic_corpus.generate_cities(countries, n_cities, seed)
+    synthetic_corpus.write_worldcities("resources/worldcities.csv", cities)
+    return countries, [name for name, _, _, _, _ in cities]
+
+
+def measure(function: Callable[[], int], repeat: int, unit: str) -> dict:
+    """Runs function repeat times for the timings and once more under tracemalloc for the peak memory."""
+    times = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "items": items,
+        "unit": unit,
+        "times": times,
+        "best": best,
+        "median": statistics.median(times),
+        "throughput": items / best if best else None,
+        "peak_bytes": peak,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n_sentences: int = 10000, seed: int = 0, workers: int = 1, repeat: int = 3, n_cities: int = 20000,
+        benchmarks: Optional[List[str]] = None, workdir: Optional[str] = None) -> dict:
+    """Runs the benchmarks in workdir, or in a temporary directory if workdir is None."""
+    benchmarks = benchmarks or BENCHMARKS
+    meta = {
+        "sentences": n_sentences,
+        "seed": seed,
+        "workers": workers,
+        "repeat": repeat,
+        "cities": n_cities,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+    cwd = os.getcwd()
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix="txmm_benchmark_")
+    try:
+        countries, city_names = prepare_workdir(workdir, n_cities, seed)
+        # Imported here, since the modules set up their logs relative to the work directory
+        from LocationParser import LocationParser
+        from Processor import Processor
+        from aggregation import EraYearCounts
+        from main import ORDER as order
+
+        corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed, order).corpus(n_sentences)
+        texts = [text for composers in corpus.values() for text in composers.values()]
+
+        loc_parser = LocationParser()  # Compiles the gazetteer, outside of the timings
+        processor = Processor(workers=workers)
+        composers_per_link = processor.preprocess(corpus)
+        sentences = [s for composers in composers_per_link.values() for c in composers for s in c.sentences]
+        data, _, country_codes = processor.filter_temporospatial(composers_per_link)
+        view = Processor.filter_outliers(data, order)
+        meta["composers"] = len(texts)
+        meta["entries"] = sum(len(entries) for entries in data.values())
+
+        def sentence_tokenize_text():
+            return sum(len(Processor.sentence_tokenize_text(text)) for text in texts)
+
+        def get_countries():
+            for sentence in sentences:
+                loc_parser.get_countries(sentence)
+            return len(sentences)
+
+        def filter_temporospatial():
+            processor.filter_temporospatial(composers_per_link)
+            return len(sentences)
+
+        def filter_outliers():
+            return len(Processor.filter_outliers(data, order).store.years)
+
+        def render_maps_aggregation():
+            return len(list(EraYearCounts.from_data(view, order).frames(country_codes)))
+
+        functions = {
+            "sentence_tokenize_text": (sentence_tokenize_text, "sentences"),
+            "get_countries": (get_countries, "sentences"),
+            "filter_temporospatial": (filter_temporospatial, "sentences"),
+            "filter_outliers": (filter_outliers, "years"),
+            "render_maps_aggregation": (render_maps_aggregation, "frames"),
+        }
+        results = {}
+        for name in benchmarks:
+            function, unit = functions[name]
+            print(f"Running {name}", file=sys.stderr)
+            results[name] = measure(function, repeat, unit)
+    finally:
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"meta": meta, "benchmarks": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the analysis on a synthetic corpus")
+    parser.add_argument("--sentences", type=int, default=10000, help="size of the corpus, e.g. 1000 to 1000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="processes used by filter_temporospatial")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--cities", type=int, default=20000, help="cities in the synthetic gazetteer")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="benchmarks to run, all by default")
+    parser.add_argument("--workdir", help="directory to keep the synthetic gazetteer, data and logs in, a temporary "
+                                          "directory by default")
+    parser.add_argument("--output", help="file to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+
+    log_files.start_run()
+    report = run(args.sentences, args.seed, args.workers, args.repeat, args.cities, args.only, args.workdir)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
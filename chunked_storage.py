@@ -0,0 +1,175 @@
+"""
+Chunked, append-friendly storage format for the datasets in ./data.
+
+A file starts with MAGIC, followed by records. Every record is a RECORD_HEADER with the lengths of a msgpack encoded
+key (the link of a per-link dataset, or None for a dataset that is stored as a whole) and of a msgpack encoded
+payload (a list, or a dict for datasets with dict values). A per-link value is spread over as many records as
+needed, so writers can append while data is produced and readers can decode one chunk at a time.
+
+A sidecar index (<file>.idx) lists the (key, offset, length) of every record, so only the records of the requested
+links have to be read. The index is rebuilt by skipping over the record headers when it is missing or outdated.
+"""
+from typing import *
+import msgpack
+import struct
+import os
+
+MAGIC = b"TXMMCHK1"
+RECORD_HEADER = struct.Struct("<II")
+CHUNK_SIZE = 1000
+
+
+def is_chunked(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class ChunkWriter:
+    """
+    Writes records to a chunked file. Items added with append are buffered per link and written in chunks of
+    chunk_size, the index is written on close. A new file is written under a temporary name and only replaces path
+    on close, so an interrupted write never leaves a partial dataset behind.
+    """
+    def __init__(self, path: str, append: bool = False, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffers: Dict[Any, Union[list, dict]] = {}
+
+        if append and os.path.isfile(path) and is_chunked(path):
+            self.index = read_index(path)
+            self.write_path = path
+            self.file = open(path, "ab")
+        else:
+            self.index = []
+            self.write_path = f"{path}.{os.getpid()}.tmp"
+            self.file = open(self.write_path, "wb")
+            self.file.write(MAGIC)
+
+    def write(self, key, payload: Union[list, dict, Any]):
+        """Writes one record right away."""
+        packed_key = msgpack.packb(key)
+        packed_payload = msgpack.packb(payload)
+        offset = self.file.tell()
+        self.file.write(RECORD_HEADER.pack(len(packed_key), len(packed_payload)))
+        self.file.write(packed_key)
+        self.file.write(packed_payload)
+        self.index.append([key, offset, self.file.tell() - offset])
+
+    def append(self, link: str, item, key=None):
+        """Buffers a list item, or a dict item when key is given, and writes the buffer once it is full."""
+        if key is None:
+            buffer = self.buffers.setdefault(link, [])
+            buffer.append(item)
+        else:
+            buffer = self.buffers.setdefault(link, {})
+            buffer[key] = item
+
+        if len(buffer) >= self.chunk_size:
+            self.flush(link)
+
+    def flush(self, link: Optional[str] = None):
+        for key in ([link] if link is not None else list(self.buffers)):
+            buffer = self.buffers.pop(key, None)
+            if buffer:
+                self.write(key, buffer)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.write_path != self.path:
+            os.replace(self.write_path, self.path)
+        with open(f"{self.path}.idx", "wb") as file:
+            file.write(msgpack.packb({"size": os.path.getsize(self.path), "records": self.index}))
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+            return
+        self.file.close()
+        if self.write_path != self.path:
+            os.remove(self.write_path)
+
+
+def write_chunked(path: str, data, per_link: Optional[Callable] = None, chunk_size: int = CHUNK_SIZE,
+                  append: bool = False):
+    """
+    Writes a per-link dict (or any other value as a single record). per_link is applied to every chunk of a list
+    value separately, so it has to map lists item by item. With append, the records are added to an existing chunked
+    file, so readers see the values of links that are written again extended.
+    """
+    with ChunkWriter(path, append=append, chunk_size=chunk_size) as writer:
+        if not isinstance(data, dict):
+            writer.write(None, data)
+            return
+
+        for link, value in data.items():
+            if isinstance(value, dict):
+                items = list(value.items())
+                chunks = [dict(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
+            else:
+                chunks = [value[i:i + chunk_size] for i in range(0, len(value), chunk_size)]
+                if per_link:
+                    chunks = [per_link(chunk) for chunk in chunks]
+            for chunk in chunks or [value]:  # Empty values still get a record, so their link is kept
+                writer.write(link, chunk)
+
+
+def _scan_index(path: str) -> list:
+    index = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.seek(len(MAGIC))
+        while True:
+            offset = file.tell()
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            key_length, payload_length = RECORD_HEADER.unpack(header)
+            if offset + RECORD_HEADER.size + key_length + payload_length > size:
+                break  # Record of an interrupted write
+            key = msgpack.unpackb(file.read(key_length))
+            file.seek(payload_length, os.SEEK_CUR)
+            index.append([key, offset, RECORD_HEADER.size + key_length + payload_length])
+    return index
+
+
+def read_index(path: str) -> list:
+    index_path = f"{path}.idx"
+    if os.path.isfile(index_path):
+        with open(index_path, "rb") as file:
+            index = msgpack.unpackb(file.read())
+        if index["size"] == os.path.getsize(path):
+            return index["records"]
+    return _scan_index(path)
+
+
+def iter_records(path: str, links: Optional[Iterable[str]] = None) -> Iterator[Tuple[Any, Any]]:
+    """Yields the (key, payload) of the records of the given links (or all records), decoding one at a time."""
+    wanted = set(links) if links is not None else None
+
+    with open(path, "rb") as file:
+        for key, offset, length in read_index(path):
+            if wanted is not None and key is not None and key not in wanted:
+                continue
+            file.seek(offset)
+            key_length, payload_length = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+            file.seek(key_length, os.SEEK_CUR)
+            yield key, msgpack.unpackb(file.read(payload_length))
+
+
+def read_chunked(path: str, links: Optional[Iterable[str]] = None):
+    """Reads a chunked file back into the value that was written, limited to the given links."""
+    data = {}
+    for key, payload in iter_records(path, links):
+        if key is None:
+            return payload
+        if key not in data:
+            data[key] = payload
+        elif isinstance(payload, dict):
+            data[key].update(payload)
+        else:
+            data[key].extend(payload)
+    return data
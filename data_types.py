@@ -1,8 +1,19 @@
-from dataclasses import dataclass
-from geopy import Nominatim
+from dataclasses import dataclass, field
 from typing import *
+import functools
 
-nominatim = Nominatim(user_agent="GetLoc")
+
+@functools.lru_cache(maxsize=None)
+def _nominatim():
+    from geopy import Nominatim  # Slow to import, and only needed for online geocoding
+    return Nominatim(user_agent="GetLoc")
+
+
+def __getattr__(name: str):
+    # data_types.nominatim is created on first use
+    if name == "nominatim":
+        return _nominatim()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @dataclass
@@ -20,6 +31,8 @@ class TemporospatialEntry:
     countries: List[str]
     text: str
     composer: str
+    # [lat, lng] of the cities mentioned in the sentence, only filled in by offline geocoding
+    coordinates: List[List[float]] = field(default_factory=list)
 
     def to_dict(self):
         return {
@@ -28,6 +41,7 @@ class TemporospatialEntry:
             "countries": self.countries,
             "text": self.text,
             "composer": self.composer,
+            "coordinates": self.coordinates,
         }
 
     def __iter__(self):
@@ -49,5 +63,21 @@ class TemporospatialEntry:
         return len(self.years)
 
 
+@dataclass
+class FetchFailure:
+    url: str
+    error: str
+    status: Optional[int] = None
+    attempts: int = 0
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "error": self.error,
+            "status": self.status,
+            "attempts": self.attempts,
+        }
+
+
 def temporospatial_from_json(json: dict) -> TemporospatialEntry:
     return TemporospatialEntry(**json)
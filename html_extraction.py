@@ -0,0 +1,273 @@
+"""
+Single-pass extraction of the few things the scraper needs from a page, without building a DOM like BeautifulSoup.
+The results are identical to those of the BeautifulSoup based code in DataCollector (with the html.parser builder),
+including its treatment of nested elements: a descendant search like find_all returns nested matches once for
+every matching ancestor.
+"""
+from html import unescape
+from typing import *
+import re
+
+# Elements reported to the extractors. The nesting of all elements is tracked: an end tag closes every element opened
+# after the matching start tag, like BeautifulSoup does for unclosed elements (e.g. a <p> closed by its </div>).
+TRACKED = {"p", "a", "ul", "table", "tr", "td"}
+# Elements without content or end tag, which BeautifulSoup closes right away
+VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param",
+        "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"}
+# Text in these elements is not part of get_text()
+SKIPPED = {"script", "style", "template"}
+# Elements whose content is raw text, which is not scanned for tags
+RAW_TEXT = {"script", "style"}
+
+# Comments, start/end tags (group 1: "/" for end tags, 2: name, 3: attributes) and declarations
+TOKEN_REGEX = re.compile(
+    r"<!--.*?-->|<(/?)([a-zA-Z][^\t\n\r\f />]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>|<![^>]*>|<\?[^>]*>",
+    re.S
+)
+DISAMBIGUATION_REGEX = re.compile(r"""\bid\s*=\s*["']?disambigbox\b""")
+
+
+def _remove(records: list, record: Any):
+    # By identity, since different (empty) records can compare equal
+    for i in range(len(records) - 1, -1, -1):
+        if records[i] is record:
+            del records[i]
+            return
+
+
+class _Extractor:
+    """
+    Tokenizes html with a single regular expression scan and reports the tokens to the handle_* methods. Much
+    cheaper than html.parser, at the cost of only handling well-formed markup like Wikipedia's.
+    """
+    def __init__(self):
+        self.stack: List[Tuple[str, Any]] = []  # (tag, record) of the open elements, record is None if untracked
+        self.open_counts: Dict[str, int] = {}  # Number of open elements per tag, so end tags need no stack scan
+        self.skip_depth = 0
+        self.disambiguation = False
+
+        # Text of the first child of the innermost anchor, while that first child is still being read
+        self.anchor_text: Optional[List[str]] = None
+        self.anchor_record = None
+
+    def open_element(self, tag: str, attrs: str) -> Any:
+        return None
+
+    def close_element(self, tag: str, record: Any):
+        pass
+
+    def anchor_done(self, record: Any, text: Optional[str]):
+        """Called when the first child of an anchor is known, text is None when it is not a text node."""
+        pass
+
+    def text(self, data: str):
+        pass
+
+    def _end_first_child(self):
+        if self.anchor_text is not None:
+            text = "".join(self.anchor_text) if self.anchor_text else None
+            self.anchor_done(self.anchor_record, text)
+            self.anchor_record = None
+            self.anchor_text = None
+
+    def handle_starttag(self, tag: str, attrs: str):
+        self._end_first_child()
+        if "disambigbox" in attrs and DISAMBIGUATION_REGEX.search(attrs):
+            self.disambiguation = True
+        if tag in SKIPPED:
+            self.skip_depth += 1
+
+        if tag in TRACKED:
+            record = self.open_element(tag, attrs)
+            self.stack.append((tag, record))
+            self.open_counts[tag] = self.open_counts.get(tag, 0) + 1
+            if tag == "a":
+                self.anchor_record = record
+                self.anchor_text = []
+        elif tag not in VOID:
+            self.stack.append((tag, None))
+            self.open_counts[tag] = self.open_counts.get(tag, 0) + 1
+
+    def handle_startendtag(self, tag: str, attrs: str):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        self._end_first_child()
+        if tag in SKIPPED and self.skip_depth:
+            self.skip_depth -= 1
+
+        if self.open_counts.get(tag):
+            while True:
+                open_tag, record = self.stack.pop()
+                self.open_counts[open_tag] -= 1
+                if open_tag in TRACKED:
+                    self.close_element(open_tag, record)
+                if open_tag == tag:
+                    break
+
+    def handle_comment(self):
+        self._end_first_child()
+
+    def handle_data(self, data: str):
+        if self.anchor_text is not None:
+            self.anchor_text.append(data)
+        if not self.skip_depth:
+            self.text(data)
+
+    def run(self, html: str):
+        position = 0
+        length = len(html)
+
+        while position < length:
+            match = TOKEN_REGEX.search(html, position)
+            end = match.start() if match else length
+            if end > position:
+                data = html[position:end]
+                self.handle_data(unescape(data) if "&" in data else data)
+            if not match:
+                break
+            position = match.end()
+
+            closing, tag, attrs = match.groups()
+            if tag is None:
+                if match.group().startswith("<!--"):
+                    self.handle_comment()
+                continue
+
+            tag = tag.lower()
+            if closing:
+                self.handle_endtag(tag)
+            elif attrs.endswith("/"):
+                self.handle_startendtag(tag, attrs)
+            else:
+                self.handle_starttag(tag, attrs)
+                if tag in RAW_TEXT:
+                    close = re.compile(f"</{tag}\\s*>", re.I).search(html, position)
+                    end = close.start() if close else length
+                    if end > position:
+                        self.handle_data(html[position:end])
+                    position = end
+
+        self._end_first_child()
+        while self.stack:
+            open_tag, record = self.stack.pop()
+            if open_tag in TRACKED:
+                self.close_element(open_tag, record)
+        return self
+
+
+class ParagraphExtractor(_Extractor):
+    def __init__(self):
+        super().__init__()
+        self.paragraphs: List[List[str]] = []
+        self.open_paragraphs: List[List[str]] = []
+
+    def open_element(self, tag: str, attrs: str) -> Any:
+        if tag == "p":
+            paragraph = []
+            self.paragraphs.append(paragraph)
+            self.open_paragraphs.append(paragraph)
+            return paragraph
+
+    def close_element(self, tag: str, record: Any):
+        if tag == "p":
+            _remove(self.open_paragraphs, record)
+
+    def text(self, data: str):
+        for paragraph in self.open_paragraphs:
+            paragraph.append(data)
+
+
+class ListAnchorExtractor(_Extractor):
+    def __init__(self):
+        super().__init__()
+        self.lists: List[List[str]] = []
+        self.open_lists: List[List[str]] = []
+
+    def open_element(self, tag: str, attrs: str) -> Any:
+        if tag == "ul":
+            names = []
+            self.lists.append(names)
+            self.open_lists.append(names)
+            return names
+        if tag == "a":
+            return list(self.open_lists)
+
+    def close_element(self, tag: str, record: Any):
+        if tag == "ul":
+            _remove(self.open_lists, record)
+
+    def anchor_done(self, record: Any, text: Optional[str]):
+        if text is not None:
+            for names in record:
+                names.append(text)
+
+
+class _Row:
+    def __init__(self):
+        self.anchors = 0
+        self.cells = 0
+        self.first_anchor_text: Optional[str] = None
+
+
+class TableAnchorExtractor(_Extractor):
+    def __init__(self):
+        super().__init__()
+        self.tables: List[List[_Row]] = []
+        self.open_tables: List[List[_Row]] = []
+        self.open_rows: List[_Row] = []
+
+    def open_element(self, tag: str, attrs: str) -> Any:
+        if tag == "table":
+            rows = []
+            self.tables.append(rows)
+            self.open_tables.append(rows)
+            return rows
+        if tag == "tr":
+            row = _Row()
+            for rows in self.open_tables:
+                rows.append(row)
+            self.open_rows.append(row)
+            return row
+        if tag == "td":
+            for row in self.open_rows:
+                row.cells += 1
+        if tag == "a":
+            first_of = [row for row in self.open_rows if not row.anchors]
+            for row in self.open_rows:
+                row.anchors += 1
+            return first_of
+
+    def close_element(self, tag: str, record: Any):
+        if tag == "table":
+            _remove(self.open_tables, record)
+        if tag == "tr":
+            _remove(self.open_rows, record)
+
+    def anchor_done(self, record: Any, text: Optional[str]):
+        for row in record:
+            row.first_anchor_text = text
+
+
+def paragraph_text(html: str) -> Optional[str]:
+    """The stripped texts of all <p> elements joined by spaces, or None for disambiguation pages."""
+    extractor = ParagraphExtractor().run(html)
+    if extractor.disambiguation:
+        return None
+    return " ".join(["".join(paragraph).strip() for paragraph in extractor.paragraphs])
+
+
+def list_anchor_names(html: str) -> List[str]:
+    """For every <ul>, the texts of all anchors in it that start with a text node, skipping empty names and
+    footnote markers like '[1]'."""
+    extractor = ListAnchorExtractor().run(html)
+    return [name for names in extractor.lists for name in names if len(name) and '[' not in name]
+
+
+def table_anchor_names(html: str, min_rows: int = 70) -> List[str]:
+    """For every table with more than min_rows rows, the stripped text of the first anchor of rows with more than
+    two cells."""
+    extractor = TableAnchorExtractor().run(html)
+    return [row.first_anchor_text.strip() for rows in extractor.tables if len(rows) > min_rows
+            for row in rows if row.anchors and row.cells > 2 and row.first_anchor_text is not None]
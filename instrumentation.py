@@ -0,0 +1,250 @@
+"""
+Lightweight instrumentation of a run. Code is divided into (nested) stages, which record their wall and CPU time
+(including that of child processes that finished during the stage) and any counters that are added while they are
+the innermost stage: item counts, bytes, and hits and misses of caches. Selected stages can be profiled with cProfile,
+and the whole run can be sampled with a profiling timer. Everything ends up in one JSON run report.
+
+Counters are kept per process: work done in pool or crawl worker processes only shows up in the CPU time of the
+stage that waited for them.
+"""
+from contextlib import contextmanager
+from collections import Counter
+from typing import *
+import functools
+import cProfile
+import atexit
+import datetime
+import resource
+import pstats
+import signal
+import json
+import time
+import sys
+import os
+
+REPORT_PATH = "./logs/run_report.json"
+PROFILE_TOP = 25  # Functions per profiled stage in the report
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.children_cpu = 0.0
+        self.counters = Counter()
+
+    def to_dict(self) -> dict:
+        hit_rates = {}
+        for name in self.counters:
+            if name.endswith(".hits"):
+                cache = name[:-len(".hits")]
+                total = self.counters[name] + self.counters[f"{cache}.misses"]
+                hit_rates[cache] = self.counters[name] / total if total else None
+        return {
+            "calls": self.calls,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "children_cpu": self.children_cpu,
+            "counters": dict(self.counters),
+            "cache_hit_rates": hit_rates,
+        }
+
+
+class Sampler:
+    """Statistical profiler: counts the function that is running, per stage, every interval seconds of CPU time."""
+    def __init__(self, instrumentation: "Instrumentation", interval: float = 0.005):
+        self.instrumentation = instrumentation
+        self.interval = interval
+        self.samples: Dict[str, Counter] = {}
+
+    def _sample(self, signum, frame):
+        if frame is None:
+            return
+        code = frame.f_code
+        function = f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+        self.samples.setdefault(self.instrumentation.current or "run", Counter())[function] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        atexit.register(self.stop)  # SIGPROF kills the process once the interpreter resets the handler on exit
+
+    def stop(self):
+        atexit.unregister(self.stop)
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def to_dict(self) -> dict:
+        return {
+            "interval": self.interval,
+            "stages": {stage: [{"function": function, "samples": n} for function, n in counts.most_common(PROFILE_TOP)]
+                       for stage, counts in self.samples.items()},
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, StageStats] = {"run": StageStats()}
+        self.stack: List[str] = []
+        self.profiled: Set[str] = set()
+        self.profiles: Dict[str, pstats.Stats] = {}
+        self.active_profile = False
+        self.sampler: Optional[Sampler] = None
+
+    def configure(self, profile: Iterable[str] = (), sample_interval: Optional[float] = None):
+        """
+        :param profile: Names or paths (like "pipeline/extract") of stages to run under cProfile
+        :param sample_interval: Seconds of CPU time between samples of the sampling profiler, None disables it
+        """
+        self.profiled = set(profile)
+        if self.sampler:
+            self.sampler.stop()
+            self.sampler = None
+        if sample_interval and hasattr(signal, "setitimer"):
+            self.sampler = Sampler(self, sample_interval)
+            self.sampler.start()
+
+    @property
+    def current(self) -> Optional[str]:
+        return "/".join(self.stack) if self.stack else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        path = "/".join(self.stack + [name])
+        stats = self.stages.setdefault(path, StageStats())
+        self.stack.append(name)
+
+        profiler = None
+        if not self.active_profile and (name in self.profiled or path in self.profiled):
+            profiler = cProfile.Profile()
+            self.active_profile = True
+            profiler.enable()
+
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield stats
+        finally:
+            stats.calls += 1
+            stats.wall += time.perf_counter() - wall
+            stats.cpu += time.process_time() - cpu
+            stats.children_cpu += _children_cpu() - children_cpu
+
+            if profiler:
+                profiler.disable()
+                self.active_profile = False
+                if path in self.profiles:
+                    self.profiles[path].add(profiler)
+                else:
+                    self.profiles[path] = pstats.Stats(profiler)
+            self.stack.pop()
+
+    @contextmanager
+    def interleaved(self, name: str) -> Iterator[StageStats]:
+        """
+        Stage for work that the innermost stage pulls in lazily, like the items of a generator it consumes. The work
+        is recorded as a sibling of that stage instead of below it, and its time is not counted for that stage.
+        """
+        if not self.stack:
+            with self.stage(name) as stats:
+                yield stats
+            return
+
+        outer = self.stack.pop()
+        interrupted = self.stages.setdefault("/".join(self.stack + [outer]), StageStats())
+        stats = self.stages.setdefault("/".join(self.stack + [name]), StageStats())
+        before = stats.wall, stats.cpu, stats.children_cpu
+        try:
+            with self.stage(name):
+                yield stats
+        finally:
+            interrupted.wall -= stats.wall - before[0]
+            interrupted.cpu -= stats.cpu - before[1]
+            interrupted.children_cpu -= stats.children_cpu - before[2]
+            self.stack.append(outer)
+
+    def count(self, name: str, n: Union[int, float] = 1):
+        """Adds n to a counter of the innermost stage."""
+        self.stages.setdefault(self.current or "run", StageStats()).counters[name] += n
+
+    def cache(self, name: str, hits: int = 0, misses: int = 0):
+        self.count(f"{name}.hits", hits)
+        self.count(f"{name}.misses", misses)
+
+    def report(self) -> dict:
+        profiles = {}
+        for path, stats in self.profiles.items():
+            functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+            profiles[path] = [{
+                "function": f"{os.path.basename(file)}:{line}({function})",
+                "calls": calls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            } for (file, line, function), (_, calls, tottime, cumtime, _) in functions]
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "wall": time.time() - self.started,
+            "cpu": time.process_time(),
+            "children_cpu": _children_cpu(),
+            "max_rss_kb": usage.ru_maxrss,
+            "argv": sys.argv,
+            "stages": {path: stats.to_dict() for path, stats in self.stages.items()},
+            "profiles": profiles,
+            "samples": self.sampler.to_dict() if self.sampler else None,
+        }
+
+    def write_report(self, path: str = REPORT_PATH) -> dict:
+        report = self.report()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        return report
+
+
+# The instrumentation of this process, used through the functions below
+RUN = Instrumentation()
+
+
+def configure(profile: Iterable[str] = (), sample_interval: Optional[float] = None):
+    RUN.configure(profile, sample_interval)
+
+
+def stage(name: str) -> ContextManager[StageStats]:
+    return RUN.stage(name)
+
+
+def interleaved(name: str) -> ContextManager[StageStats]:
+    return RUN.interleaved(name)
+
+
+def count(name: str, n: Union[int, float] = 1):
+    RUN.count(name, n)
+
+
+def cache(name: str, hits: int = 0, misses: int = 0):
+    RUN.cache(name, hits, misses)
+
+
+def write_report(path: str = REPORT_PATH) -> dict:
+    return RUN.write_report(path)
+
+
+def timed(name: Optional[str] = None):
+    """Decorator running every call of a function as a stage, named after the function by default."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with RUN.stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,52 @@
+"""
+Module loggers that each write to their own file in ./logs. A file is only opened once something is logged to it, so
+importing a module does not touch the file system. Once an entry point has called start_run, the first record of the
+run replaces the log of a previous run, otherwise records are appended.
+"""
+from typing import *
+import logging
+import time
+import os
+
+LOGS_PATH = "./logs"
+FORMAT = '%(levelname)s:%(name)s:%(message)s'
+RUN_STARTED = "TXMM_RUN_STARTED"  # Environment variable, so that worker processes see the same run
+
+
+def start_run():
+    """Starts a run of an entry point, whose logs replace those of earlier runs."""
+    os.environ[RUN_STARTED] = str(time.time())
+
+
+def run_started() -> Optional[float]:
+    started = os.environ.get(RUN_STARTED)
+    return float(started) if started else None
+
+
+class RunFileHandler(logging.FileHandler):
+    """
+    FileHandler that opens its file on the first record, truncating it first if it is older than this run. The file
+    itself is always opened for appending, so records of worker processes that log to it as well are not overwritten.
+    """
+    def __init__(self, path: str):
+        super().__init__(path, mode="a", delay=True)
+        self.path = path
+
+    def _open(self):
+        # Relative to the working directory at the first record, not at import, like the data/ the modules write to
+        self.baseFilename = os.path.abspath(self.path)
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        started = run_started()
+        if started is not None and os.path.isfile(self.baseFilename) and os.path.getmtime(self.baseFilename) < started:
+            open(self.baseFilename, "w").close()
+        return super()._open()
+
+
+def module_logger(name: str, file_name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    file_handler = RunFileHandler(os.path.join(LOGS_PATH, file_name))
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    logger.addHandler(file_handler)
+    logger.propagate = False
+    return logger
@@ -1,20 +1,13 @@
 from DataCollector import DataCollector
 from Processor import Processor
+from Pipeline import Pipeline
+import instrumentation
 import visualization
+import argparse
 import datetime
-import logging
-import os
+import log_files
 
-if os.path.isfile("./logs/main.log"):
-    os.remove("./logs/main.log")
-
-# Setting up the logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('logs/main.log')
-file_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-logger.addHandler(file_handler)
-logger.propagate = False
+logger = log_files.module_logger(__name__, "main.log")
 
 ORDER = [
     ("Medieval", "List of medieval composers", (500, 1400), 'tab:blue'),
@@ -28,23 +21,40 @@ ORDER = [
     # ("21st century", "List of 21st-century classical composers", (2001, datetime.datetime.now().year), 'cyan')
 ]
 
+ANIMATION_START = 750  # First year of the map animation
+GEOCODE = True  # Attach the coordinates of the cities that are found to the entries, for the city density map
 
-def main():
-    processor = Processor()
-    data_collector = DataCollector(processor=processor)
 
-    logger.info("Retrieving temporospatial data")
-    temporospatial_data, countries, country_codes = data_collector.get_temporospatial()
-    logger.info("Filtering outliers")
-    filtered = processor.filter_outliers(temporospatial_data, ORDER)
+def main(report_path: str = instrumentation.REPORT_PATH):
+    processor = Processor(workers=None, geocode=GEOCODE)
+    data_collector = DataCollector(processor=processor)
 
-    logger.info("visualization.scatter_eras()")
-    visualization.scatter_eras(filtered, ORDER)
-    logger.info("visualization.render_maps()")
-    visualization.render_maps(filtered, country_codes, ORDER)
+    try:
+        logger.info("Running the pipeline")
+        filtered, countries, country_codes = Pipeline(data_collector, processor).run(ORDER)
+
+        logger.info("visualization.scatter_eras()")
+        visualization.scatter_eras(filtered, ORDER)
+        logger.info("visualization.animate_maps()")
+        visualization.animate_maps(filtered, country_codes, ORDER, start=ANIMATION_START)
+        if GEOCODE:
+            logger.info("visualization.city_density_map()")
+            visualization.city_density_map(filtered, path="./data/city_density.png", show=False)
+    finally:
+        report = instrumentation.write_report(report_path)
+        logger.info(f"Run report written to {report_path}: {report['wall']:.1f}s wall, {report['cpu']:.1f}s CPU")
 
     pass  # For a debugging breakpoint
 
 
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Run the analysis")
+    arg_parser.add_argument("--profile", nargs="+", default=[], metavar="STAGE",
+                            help="stages (like pipeline/extract) to profile with cProfile")
+    arg_parser.add_argument("--sample-interval", type=float, help="seconds between samples of the sampling profiler")
+    arg_parser.add_argument("--report", default=instrumentation.REPORT_PATH, help="where to write the run report")
+    args = arg_parser.parse_args()
+
+    log_files.start_run()
+    instrumentation.configure(args.profile, args.sample_interval)
+    main(args.report)
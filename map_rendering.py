@@ -0,0 +1,374 @@
+"""
+Renders the yearly map frames. Consecutive years often color the countries exactly the same way, so every unique
+assignment of countries to eras is rendered by pygal only once, with a blank title that keeps the title space free.
+The year titles are then drawn on copies of that map with PIL, which is cheap compared to rendering the SVG. The
+unique maps are distributed over a pool of processes. A manifest keeps track of the rendered frames, so after a
+change in the data only the frames that changed are rendered again. Animations are encoded straight from the
+rendered maps, without writing frames to disk.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+from tqdm import tqdm
+from typing import *
+import itertools
+import hashlib
+import msgpack
+import struct
+import subprocess
+import shutil
+import io
+import re
+import os
+
+MAPS_PATH = "./data/maps"
+MANIFEST_NAME = "manifest"
+RENDER_VERSION = 1  # Bump when a change to the rendering code changes how frames look
+FRAME_REGEX = re.compile(r"map_(-?\d+)\.png")
+TITLE = "Western Classical Musical Eras per Country in {year}"
+
+# Where pygal draws its title (centered, baseline at 26px, 16px monospace, for the default 800x600 chart)
+TITLE_Y = 26
+TITLE_FONT_SIZE = 16
+PNG_COMPRESS_LEVEL = 1  # Frames are intermediate files, writing them fast matters more than their size
+YEARS_PER_TASK = 50
+TITLE_FONTS = ["DejaVuSansMono.ttf", "LiberationMono-Regular.ttf", "Menlo.ttc", "consola.ttf", "cour.ttf"]
+
+
+def frame_hash(codes_per_era: Dict[str, List[str]]) -> str:
+    """Hash of the assignment of map codes to eras, independent of the order of the codes within an era."""
+    return hashlib.sha256(msgpack.packb([[era, sorted(codes)] for era, codes in codes_per_era.items()])).hexdigest()
+
+
+def base_map(codes_per_era: Dict[str, List[str]], era_colors: Tuple[str, ...]) -> bytes:
+    """The map of one assignment as PNG, with an empty title."""
+    from pygal_maps_world.maps import World  # Slow to import, and not needed when all frames are up to date
+    from pygal.style import Style
+    worldmap = World(style=Style(colors=era_colors))
+    worldmap.title = " "
+    for era, codes in codes_per_era.items():
+        worldmap.add(era, codes)
+    return worldmap.render_to_png()
+
+
+def title_font(size: int = TITLE_FONT_SIZE) -> ImageFont.ImageFont:
+    for name in TITLE_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def draw_title(image: Image.Image, title: str, font: ImageFont.ImageFont,
+               chart_height: Optional[int] = None) -> Image.Image:
+    """A copy of image with title drawn where pygal draws it, on a chart of chart_height (by default, the image's)."""
+    titled = image.copy()
+    scale = (chart_height or image.height) / 600
+    ImageDraw.Draw(titled).text((image.width / 2, TITLE_Y * scale), title, fill="black", font=font, anchor="ms")
+    return titled
+
+
+def _render_base(args: Tuple[Dict[str, List[str]], Tuple[str, ...]]) -> bytes:
+    return base_map(*args)
+
+
+def _write_frames(args: Tuple[bytes, List[int], str]) -> int:
+    """Writes a titled copy of one rendered map for each of the years."""
+    png, years, path = args
+    image = Image.open(io.BytesIO(png))
+    image.load()
+    font = title_font(int(round(TITLE_FONT_SIZE * image.height / 600)))
+
+    for year in years:
+        titled = draw_title(image, TITLE.format(year=year), font)
+        titled.save(os.path.join(path, f"map_{year}.png"), compress_level=PNG_COMPRESS_LEVEL)
+    return len(years)
+
+
+def group_frames(frames: Iterable[Tuple[int, Dict[str, List[str]]]]) \
+        -> List[Tuple[str, Dict[str, List[str]], List[int]]]:
+    """Groups the (year, codes per era) frames by assignment, as (hash, codes per era, years) in order of first year."""
+    groups: Dict[str, Tuple[str, Dict[str, List[str]], List[int]]] = {}
+    for year, codes_per_era in frames:
+        digest = frame_hash(codes_per_era)
+        if digest not in groups:
+            groups[digest] = (digest, codes_per_era, [])
+        groups[digest][2].append(year)
+    return list(groups.values())
+
+
+def style_hash(era_colors: Tuple[str, ...]) -> str:
+    """Hash of everything besides the assignment that determines what a frame looks like."""
+    return hashlib.sha256(msgpack.packb([RENDER_VERSION, list(era_colors), TITLE, TITLE_Y, TITLE_FONT_SIZE])).hexdigest()
+
+
+def read_manifest(path: str) -> Tuple[Optional[str], Dict[int, str]]:
+    """The style hash and the frame hash per year of the frames in path, as recorded when they were rendered."""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None, {}
+    with open(manifest_path, "rb") as file:
+        manifest = msgpack.unpackb(file.read())
+    return manifest["style"], {year: digest for year, digest in manifest["frames"]}
+
+
+def write_manifest(path: str, style: str, frame_hashes: Dict[int, str]):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "wb") as file:
+        file.write(msgpack.packb({"style": style, "frames": sorted(frame_hashes.items())}))
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def render_frames(frames: Iterable[Tuple[int, Dict[str, List[str]]]], era_colors: Tuple[str, ...],
+                  path: str = MAPS_PATH, workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Makes path hold map_<year>.png for exactly the given frames, using workers processes (None for one per CPU).
+    A manifest in path records the frame hash of every year, so only frames that are missing or whose assignment
+    changed are rendered, and frames of years that are no longer in frames are removed.
+    """
+    os.makedirs(path, exist_ok=True)
+    groups = group_frames(frames)
+    workers = workers if workers is not None else os.cpu_count()
+    style = style_hash(era_colors)
+    frame_hashes = {year: digest for digest, _, years in groups for year in years}
+
+    rendered_style, rendered = read_manifest(path)
+    if rendered_style != style:
+        rendered = {}
+
+    removed = 0
+    for name in os.listdir(path):
+        match = FRAME_REGEX.fullmatch(name)
+        if match and int(match.group(1)) not in frame_hashes:
+            os.remove(os.path.join(path, name))
+            removed += 1
+
+    todo = []
+    for digest, codes_per_era, years in groups:
+        years = [year for year in years if rendered.get(year) != digest
+                 or not os.path.isfile(os.path.join(path, f"map_{year}.png"))]
+        if years:
+            todo.append((codes_per_era, years))
+
+    # Frames that are about to be overwritten lose their manifest entry first, so an interrupted run never leaves
+    # a frame that the manifest describes wrongly
+    kept = {year: digest for year, digest in rendered.items() if frame_hashes.get(year) == digest}
+    for _, years in todo:
+        for year in years:
+            kept.pop(year, None)
+    write_manifest(path, style, kept)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and todo else None
+    parallel_map = executor.map if executor else map
+    pbar = tqdm(total=sum(len(years) for _, years in todo), desc=f"Rendering {len(todo)} unique maps")
+    try:
+        # Unique maps first, then the titled frames in chunks of years, so one long run of identical years does
+        # not end up on a single worker
+        pngs = list(parallel_map(_render_base, [(codes_per_era, tuple(era_colors)) for codes_per_era, _ in todo]))
+        tasks = [(png, years[i:i + YEARS_PER_TASK], path)
+                 for png, (_, years) in zip(pngs, todo) for i in range(0, len(years), YEARS_PER_TASK)]
+        for written in parallel_map(_write_frames, tasks):
+            pbar.update(written)
+    finally:
+        pbar.close()
+        if executor:
+            executor.shutdown()
+
+    write_manifest(path, style, frame_hashes)
+    return {
+        "frames": len(frame_hashes),
+        "rendered": pbar.n,
+        "unique_maps": len(todo),
+        "removed": removed,
+    }
+
+
+def _render_bases(groups: List[Tuple[str, Dict[str, List[str]], List[int]]], era_colors: Tuple[str, ...],
+                  workers: int) -> Dict[str, Image.Image]:
+    tasks = [(codes_per_era, tuple(era_colors)) for _, codes_per_era, _ in groups]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pngs = list(tqdm(executor.map(_render_base, tasks), total=len(tasks), desc="Rendering unique maps"))
+    else:
+        pngs = [_render_base(task) for task in tqdm(tasks, desc="Rendering unique maps")]
+    return {digest: Image.open(io.BytesIO(png)).convert("RGB") for (digest, _, _), png in zip(groups, pngs)}
+
+
+def animation_frames(frames: Iterable[Tuple[int, Dict[str, List[str]]]], titles: bool = True) \
+        -> Iterator[Tuple[str, Optional[str], int]]:
+    """
+    The frames of an animation as (frame hash, title, number of years it stays on screen). Consecutive identical
+    frames (which only happens without titles) are merged, by adding up their number of years.
+    """
+    previous, repeats = None, 0
+    for year, codes_per_era in frames:
+        frame = (frame_hash(codes_per_era), TITLE.format(year=year) if titles else None)
+        if frame == previous:
+            repeats += 1
+            continue
+        if previous is not None:
+            yield previous + (repeats,)
+        previous, repeats = frame, 1
+    if previous is not None:
+        yield previous + (repeats,)
+
+
+def _shared_palette(images: Iterable[Image.Image]) -> Image.Image:
+    """A 256 color palette for all images, which only hold a few flat colors besides anti-aliased edges."""
+    images = list(images)
+    step = max(1, len(images) // 64)
+    thumbnails = [image.reduce(4) for image in images[::step]]
+    mosaic = Image.new("RGB", (thumbnails[0].width, sum(t.height for t in thumbnails) + 1), "black")
+    for i, thumbnail in enumerate(thumbnails):
+        mosaic.paste(thumbnail, (0, i * thumbnail.height))
+    return mosaic.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+
+def _gif_image(image: Image.Image, position: Tuple[int, int]) -> Tuple[bytes, bytes, bytes]:
+    """
+    Encodes a palette image with PIL as a single frame GIF, and splits that into its header (signature and logical
+    screen descriptor), its global color table and its image (descriptor and LZW data), with the image moved to
+    position. See the GIF89a specification for the layout.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format="GIF", optimize=False)
+    data = buffer.getvalue()
+
+    offset = 13
+    table_size = 3 << ((data[10] & 0x07) + 1) if data[10] & 0x80 else 0
+    table = data[offset:offset + table_size]
+    offset += table_size
+    while data[offset] == 0x21:  # Extensions, e.g. a graphic control extension PIL adds for transparency
+        offset += 2
+        while data[offset]:
+            offset += data[offset] + 1
+        offset += 1
+
+    start = offset
+    if data[offset + 9] & 0x80:  # Local color table
+        offset += 3 << ((data[offset + 9] & 0x07) + 1)
+    offset += 11  # Image descriptor and the minimum LZW code size
+    while data[offset]:
+        offset += data[offset] + 1
+    image_block = bytearray(data[start:offset + 1])
+    struct.pack_into("<HH", image_block, 1, *position)
+    return data[:13], table, bytes(image_block)
+
+
+def write_gif(stream: Iterable[Tuple[str, Optional[str], int]], bases: Dict[str, Image.Image], path: str,
+              fps: float):
+    """
+    Encodes (frame hash, title, repeats) frames into a GIF while they are streamed, without keeping them in memory.
+    The frames share one palette, every map is quantized once, and when only the title changes only the title band
+    is encoded. Every frame is compressed by PIL on its own, the file around them is written here. Repeats become
+    frame durations.
+    """
+    stream = iter(stream)
+    first = next(stream, None)
+    if first is None:
+        raise ValueError(f"No frames to write to {path}")
+
+    palette = _shared_palette(bases.values())
+    quantized: Dict[str, Image.Image] = {}
+    width, height = next(iter(bases.values())).size
+    font = title_font(int(round(TITLE_FONT_SIZE * height / 600)))
+    band = (0, 0, width, int(round((TITLE_Y + TITLE_FONT_SIZE / 2) * height / 600)))
+
+    previous = None
+    global_table = None
+    with open(path, "wb") as file:
+        for digest, title, repeats in itertools.chain([first], stream):
+            if digest not in quantized:
+                quantized[digest] = bases[digest].quantize(palette=palette, dither=Image.Dither.NONE)
+
+            if title is not None:
+                title_band = draw_title(bases[digest].crop(band), title, font, height)
+                title_band = title_band.quantize(palette=palette, dither=Image.Dither.NONE)
+
+            if digest != previous:
+                frame = quantized[digest]
+                if title is not None:
+                    frame = frame.copy()
+                    frame.paste(title_band, band[:2])
+                header, table, image_block = _gif_image(frame, (0, 0))
+            else:
+                _, table, image_block = _gif_image(title_band, band[:2])
+
+            if global_table is None:
+                global_table = table
+                file.write(b"GIF89a" + header[6:] + table)
+                file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", 0) + b"\x00")  # Loop forever
+            if table != global_table and not image_block[9] & 0x80:  # Keep the colors of this frame in a local table
+                size_bits = (len(table) // 3).bit_length() - 2
+                image_block = image_block[:9] + bytes([image_block[9] | 0x80 | size_bits]) + table + image_block[10:]
+
+            # Graphic control extension: the frame is left in place (disposal 1), for the title bands drawn over it
+            delay = int(round(100 * repeats / fps))
+            file.write(b"!\xf9\x04\x04" + struct.pack("<H", delay) + b"\x00\x00")
+            file.write(image_block)
+            previous = digest
+
+        file.write(b";")
+
+
+def write_video(stream: Iterable[Tuple[str, Optional[str], int]], bases: Dict[str, Image.Image], path: str,
+                fps: float):
+    """Pipes (frame hash, title, repeats) frames into ffmpeg as raw video, repeating frames instead of redrawing."""
+    if not bases:
+        raise ValueError(f"No frames to write to {path}")
+    width, height = next(iter(bases.values())).size
+    font = title_font(int(round(TITLE_FONT_SIZE * height / 600)))
+    process = subprocess.Popen([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        "-pix_fmt", "yuv420p", "-c:v", "libx264", "-f", "mp4", path
+    ], stdin=subprocess.PIPE)
+    try:
+        for digest, title, repeats in stream:
+            image = bases[digest] if title is None else draw_title(bases[digest], title, font)
+            data = image.tobytes()
+            for _ in range(repeats):
+                process.stdin.write(data)
+    finally:
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to write {path}")
+
+
+def write_animation(frames: Iterable[Tuple[int, Dict[str, List[str]]]], era_colors: Tuple[str, ...], path: str,
+                    fps: float = 30, titles: bool = True, workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Renders frames straight into an animation, without writing them to disk. A .gif is encoded in-process, other
+    formats (like .mp4) are encoded by ffmpeg. Every unique map is rendered once, using workers processes.
+    """
+    gif = path.lower().endswith(".gif")
+    if not gif and not shutil.which("ffmpeg"):
+        raise RuntimeError(f"ffmpeg is needed to write {path}, write a .gif instead or install ffmpeg")
+
+    frames = list(frames)
+    if not frames:
+        raise ValueError(f"No frames to write to {path}, the selected years hold no maps")
+    groups = group_frames(frames)
+    bases = _render_bases(groups, era_colors, workers if workers is not None else os.cpu_count())
+    stream = list(animation_frames(frames, titles))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if gif:
+            write_gif(tqdm(stream, desc=f"Encoding {path}"), bases, tmp_path, fps)
+        else:
+            write_video(tqdm(stream, desc=f"Encoding {path}"), bases, tmp_path, fps)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "years": len(frames),
+        "frames": len(stream),
+        "unique_maps": len(groups),
+    }
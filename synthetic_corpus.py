@@ -0,0 +1,115 @@
+"""
+Seeded generator of a synthetic corpus that looks like the scraped Wikipedia biographies to the analysis: sentences
+with citations, years (some BC, some outside the era of the composer), country names and city names at roughly the
+density of real composer articles. A matching worldcities.csv in the simplemaps layout is generated as well, so the
+whole analysis can run offline and repeatably.
+"""
+from typing import *
+import random
+import csv
+
+SYLLABLES = ["ber", "lin", "pa", "ris", "ro", "ma", "ven", "ice", "bru", "ges", "wien", "lei", "pzig", "bo", "lo",
+             "gna", "san", "ta", "mar", "se", "ille", "dres", "den", "cor", "do", "ba", "na", "ples", "tou", "rin"]
+WORDS = ["he", "she", "was", "the", "of", "and", "in", "his", "her", "composer", "music", "works", "studied",
+         "organist", "court", "chapel", "opera", "symphony", "mass", "motets", "choir", "master", "published",
+         "premiered", "taught", "pupil", "wrote", "became", "returned", "appointed", "cathedral", "concerto",
+         "string", "quartet", "known", "for", "at", "with", "under", "a", "to", "from", "after", "during", "death"]
+SEPARATORS = [". ", ". ", ". ", "! ", "? "]
+
+YEAR_PROBABILITY = 0.35  # Share of sentences with at least one year
+PLACE_PROBABILITY = 0.3  # Share of sentences with at least one country or city
+CITY_SHARE = 0.6  # Share of place mentions that are cities rather than countries
+OUTLIER_PROBABILITY = 0.05  # Share of years that are not within the era of the composer
+BC_PROBABILITY = 0.01
+CITATION_PROBABILITY = 0.25
+
+
+def _name(rng: random.Random, syllables: Tuple[int, int] = (2, 4)) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables))).capitalize()
+
+
+def generate_cities(countries: List[str], n_cities: int = 20000, seed: int = 0) \
+        -> List[Tuple[str, str, int, float, float]]:
+    """(name, country, population, lat, lng) of n_cities made up cities, some with multi-word names."""
+    rng = random.Random(seed)
+    cities = []
+    for _ in range(n_cities):
+        name = " ".join(_name(rng) for _ in range(rng.choice([1, 1, 1, 1, 2, 2, 3])))
+        population = int(rng.paretovariate(1.2) * 30000)  # About half of them pass MIN_POPULATION
+        cities.append((name, rng.choice(countries), population, rng.uniform(-60, 70), rng.uniform(-180, 180)))
+    return cities
+
+
+def write_worldcities(path: str, cities: List[Tuple[str, str, int, float, float]]):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["city", "city_ascii", "lat", "lng", "country", "iso2", "iso3", "admin_name", "capital",
+                         "population", "id"])
+        for i, (name, country, population, lat, lng) in enumerate(cities):
+            code = "".join(c for c in country if c.isalpha())[:2].upper()
+            writer.writerow([name, name, f"{lat:.4f}", f"{lng:.4f}", country, code, code + "X", "", "",
+                             population, 1000000000 + i])
+
+
+class CorpusGenerator:
+    """
+    Generates composer texts, every call with the same seed and arguments gives the same corpus. The eras are in the
+    shape of main.ORDER, which they default to.
+    """
+    def __init__(self, countries: List[str], city_names: List[str], seed: int = 0, eras: Optional[list] = None):
+        self.rng = random.Random(seed)
+        self.countries = countries
+        self.city_names = city_names
+        if eras is None:
+            from main import ORDER  # Imported here, as the modules set up their logs relative to the work directory
+            eras = ORDER
+        self.eras = eras
+
+    def year(self, era_range: Tuple[int, int]) -> str:
+        rng = self.rng
+        if rng.random() < OUTLIER_PROBABILITY:
+            year = rng.randint(500, 2020)
+        else:
+            year = rng.randint(*era_range)
+        return f"{year} BC" if rng.random() < BC_PROBABILITY else str(year)
+
+    def place(self) -> str:
+        if self.rng.random() < CITY_SHARE:
+            return self.rng.choice(self.city_names)
+        return self.rng.choice(self.countries)
+
+    def sentence(self, era_range: Tuple[int, int]) -> str:
+        rng = self.rng
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 25))]
+        if rng.random() < YEAR_PROBABILITY:
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                words.insert(rng.randrange(len(words) + 1), self.year(era_range))
+        if rng.random() < PLACE_PROBABILITY:
+            for _ in range(rng.choice([1, 1, 2])):
+                words.insert(rng.randrange(len(words) + 1), "in " + self.place())
+        if rng.random() < CITATION_PROBABILITY:
+            words[-1] += f"[{rng.randint(1, 120)}]"
+        sentence = " ".join(words)
+        return sentence[0].upper() + sentence[1:]
+
+    def text(self, n_sentences: int, era_range: Tuple[int, int]) -> str:
+        parts = []
+        for _ in range(n_sentences):
+            parts.append(self.sentence(era_range))
+            parts.append(self.rng.choice(SEPARATORS) if self.rng.random() > 0.02 else ".\n\n")
+        return "".join(parts)
+
+    def corpus(self, n_sentences: int, sentences_per_composer: int = 40) -> Dict[str, Dict[str, str]]:
+        """{link: {composer: text}} with n_sentences sentences in total, spread evenly over the eras."""
+        composers_per_link = {link: {} for _, link, _, _ in self.eras}
+        n_composers = max(1, n_sentences // sentences_per_composer)
+        for i in range(n_composers):
+            _, link, era_range, _ = self.eras[i % len(self.eras)]
+            n = sentences_per_composer if i < n_composers - 1 else n_sentences - i * sentences_per_composer
+            composers_per_link[link][f"{_name(self.rng, (2, 3))} {_name(self.rng)} ({i})"] = self.text(n, era_range)
+        return composers_per_link
+
+
+def read_countries(path: str = "resources/countries.txt") -> List[str]:
+    with open(path, "r") as file:
+        return [line.strip() for line in file if line.strip()]
@@ -0,0 +1,29 @@
+import pytest
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COUNTRIES_PATH = os.path.join(ROOT, "resources", "countries.txt")
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs every test in its own directory, so the data/ and logs/ the modules write to stay out of the repo."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def resources(workdir):
+    """resources/ in the working directory, with the real countries.txt and a synthetic worldcities.csv."""
+    import synthetic_corpus
+    import shutil
+
+    os.makedirs("resources")
+    shutil.copyfile(COUNTRIES_PATH, "resources/countries.txt")
+    countries = synthetic_corpus.read_countries()
+    cities = synthetic_corpus.generate_cities(countries, 2000, seed=0)
+    synthetic_corpus.write_worldcities("resources/worldcities.csv", cities)
+    return countries, [name for name, _, _, _, _ in cities]
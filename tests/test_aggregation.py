@@ -0,0 +1,65 @@
+from aggregation import EraYearCounts
+from LocationParser import LocationParser
+from Processor import Processor
+import synthetic_corpus
+
+ORDER = [("A", "List of medieval composers", (1300, 1600), "tab:blue"),
+         ("B", "List of Renaissance composers", (1500, 1750), "tab:orange"),
+         ("C", "List of Baroque composers", (1700, 1900), "tab:green")]
+
+
+def render_maps_frames(filtered_data, country_codes, order):
+    """The (year, codes per era) of every map, computed like render_maps did before EraYearCounts."""
+    start, end = order[0][2][0], order[-1][2][1]
+    era_names = [e[0] for e in order]
+
+    era_per_year_per_country = {}
+    for name, link, _, _ in order:
+        for entry in filtered_data[link]:
+            for country in entry.countries:
+                if country not in era_per_year_per_country:
+                    era_per_year_per_country[country] = {name: {} for name in era_names}
+                d = era_per_year_per_country[country][name]
+                for year in entry.years:
+                    d[year] = d.get(year, 0) + 1
+
+    last_era = {}
+    frames = []
+    for year in range(start, end + 1):
+        for i, era in enumerate(era_names):
+            for country in era_per_year_per_country:
+                if year in era_per_year_per_country[country][era] and country in country_codes:
+                    code = country_codes[country]
+                    last_era[code] = max(last_era.get(code, i), i)
+        if last_era:
+            codes_per_era = {era: [] for era in era_names}
+            latest_era = 0
+            for code, era in last_era.items():
+                latest_era = max(latest_era, era)
+                codes_per_era[era_names[era]].append(code)
+            for i in range(latest_era - 1):
+                codes_per_era[era_names[i]] = []
+            frames.append((year, codes_per_era))
+    return frames
+
+
+def normalized(frames):
+    return [(year, {era: sorted(codes) for era, codes in codes_per_era.items()}) for year, codes_per_era in frames]
+
+
+def test_frames_match_the_render_maps_loop(resources):
+    countries, city_names = resources
+    corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed=8, eras=ORDER).corpus(6000)
+    processor = Processor()
+    data, _, _ = processor.filter_temporospatial(processor.preprocess(corpus))
+    view = Processor.filter_outliers(data, ORDER)
+
+    codes = dict(LocationParser().country_codes)
+    names = sorted(codes)
+    del codes[names[3]]  # A country without a map code
+    codes[names[5]] = codes[names[6]]  # Two countries on one map
+
+    expected = normalized(render_maps_frames(view, codes, ORDER))
+    assert len(expected) > 500
+    assert normalized(EraYearCounts.from_data(view, ORDER).frames(codes)) == expected
+    assert normalized(EraYearCounts.from_data({link: view[link] for link in view}, ORDER).frames(codes)) == expected
@@ -0,0 +1,89 @@
+from DataCollector import get_data, iter_data, store_data, data_links
+import chunked_storage
+import msgpack
+import pytest
+import os
+
+DATA = {
+    "era0": {f"composer {i}": f"text {i}" for i in range(25)},
+    "era1": {},
+    "era2": {"composer x": "text x"},
+}
+ENTRIES = {"era0": [[i, "entry"] for i in range(23)], "era1": [[0, "entry"]]}
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "data")
+    chunked_storage.write_chunked(path, DATA, chunk_size=10)
+    assert chunked_storage.is_chunked(path)
+    assert chunked_storage.read_chunked(path) == DATA
+    assert list(chunked_storage.read_chunked(path)) == list(DATA)
+    assert len(chunked_storage.read_index(path)) == 5  # era0 in 3 chunks, and one record for era1 and era2 each
+
+    chunked_storage.write_chunked(path, ENTRIES, per_link=lambda chunk: [item[0] for item in chunk], chunk_size=10)
+    assert chunked_storage.read_chunked(path) == {"era0": list(range(23)), "era1": [0]}
+
+    chunked_storage.write_chunked(path, ["countries", {"codes": 1}])
+    assert chunked_storage.read_chunked(path) == ["countries", {"codes": 1}]
+
+
+def test_filtered_read_only_decodes_the_requested_links(tmp_path):
+    path = str(tmp_path / "data")
+    chunked_storage.write_chunked(path, DATA, chunk_size=10)
+    assert chunked_storage.read_chunked(path, ["era2"]) == {"era2": DATA["era2"]}
+    assert {key for key, _ in chunked_storage.iter_records(path, ["era0", "missing"])} == {"era0"}
+
+    # Other records are never decoded, so damaging one does not matter for a filtered read
+    _, offset, length = chunked_storage.read_index(path)[0]
+    with open(path, "r+b") as file:
+        file.seek(offset + length - 4)
+        file.write(b"\xc1" * 4)  # Never used in msgpack
+    assert chunked_storage.read_chunked(path, ["era2"]) == {"era2": DATA["era2"]}
+    with pytest.raises(Exception):
+        chunked_storage.read_chunked(path, ["era0"])
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / "data")
+    chunked_storage.write_chunked(path, {"era0": DATA["era0"]}, chunk_size=10)
+    chunked_storage.write_chunked(path, {"era2": DATA["era2"]}, append=True)
+    assert chunked_storage.read_chunked(path) == {"era0": DATA["era0"], "era2": DATA["era2"]}
+
+
+def test_scan_index_skips_a_truncated_record(tmp_path):
+    path = str(tmp_path / "data")
+    chunked_storage.write_chunked(path, DATA, chunk_size=10)
+    complete = chunked_storage.read_index(path)
+    with open(path, "r+b") as file:
+        file.truncate(os.path.getsize(path) - 3)  # Like a write that was interrupted in the last record
+
+    assert chunked_storage.read_index(path) == complete[:-1]  # The sidecar index no longer matches the size
+    assert chunked_storage.read_chunked(path) == {"era0": DATA["era0"], "era1": {}}
+
+    os.remove(f"{path}.idx")
+    assert chunked_storage.read_index(path) == complete[:-1]
+
+
+def test_legacy_files_are_still_read(workdir):
+    os.makedirs("data")
+    with open("data/scraped_data", "wb") as file:
+        file.write(msgpack.packb(DATA))
+    with open("data/temporospatial_data", "wb") as file:
+        file.write(msgpack.packb(ENTRIES))
+
+    assert get_data("scraped_data") == DATA
+    assert get_data("scraped_data", links=["era2", "missing"]) == {"era2": DATA["era2"]}
+    assert get_data("temporospatial_data", per_link=len) == {"era0": 23, "era1": 1}
+    assert data_links("scraped_data") == ["era0", "era1", "era2"]
+
+    assert list(iter_data("scraped_data", ["era2"])) == [("era2", ("composer x", "text x"))]
+    assert list(iter_data("temporospatial_data")) == [(link, entry) for link, entries in ENTRIES.items()
+                                                       for entry in entries]
+
+
+def test_chunked_files_through_get_data_and_iter_data(workdir):
+    store_data(DATA, "scraped_data")
+    assert chunked_storage.is_chunked("data/scraped_data")
+    assert get_data("scraped_data", links=["era0"]) == {"era0": DATA["era0"]}
+    assert list(iter_data("scraped_data", ["era2"])) == [("era2", ("composer x", "text x"))]
+    assert data_links("scraped_data") == ["era0", "era1", "era2"]
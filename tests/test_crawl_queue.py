@@ -0,0 +1,172 @@
+from CrawlQueue import CrawlQueue, PENDING, IN_FLIGHT, DONE, worker_id
+from DataCollector import DataCollector
+from Fetcher import AsyncFetcher
+from ResponseCache import ResponseCache
+import DataCollector as data_collector_module
+import subprocess
+import msgpack
+import pytest
+import sys
+import os
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return CrawlQueue(str(tmp_path / "queue.sqlite"))
+
+
+def states(queue):
+    return {name: state for name, state in queue.db.execute("SELECT name, state FROM composers")}
+
+
+def test_enqueue_keeps_state_of_queued_composers(queue):
+    assert queue.enqueue({"era0": {"a": "", "b": ""}}) == 2
+    (composer_id, _, _), = queue.claim("w1", 1)
+    queue.complete(composer_id, "w1", "text of a")
+
+    assert queue.enqueue({"era0": {"a": "", "b": "", "c": ""}, "era1": {"d": ""}}) == 2
+    assert states(queue) == {"a": DONE, "b": PENDING, "c": PENDING, "d": PENDING}
+    assert queue.export() == {"era0": {"a": "text of a"}, "era1": {}}
+
+
+def test_claims_are_leases(queue):
+    queue.enqueue({"era0": {name: "" for name in "abcd"}})
+    assert [name for _, _, name in queue.claim("w1", 2)] == ["a", "b"]
+    other = CrawlQueue(queue.path)
+    assert [name for _, _, name in other.claim("w2", 4)] == ["c", "d"]
+    assert other.claim("w2", 4) == []  # Leases of running workers are left alone
+
+    expired = CrawlQueue(queue.path, lease=0)
+    assert [name for _, _, name in expired.claim("w3", 4)] == ["a", "b", "c", "d"]
+
+
+def test_only_the_claiming_worker_finishes_a_composer(queue):
+    queue.enqueue({"era0": {"a": ""}})
+    (composer_id, _, _), = queue.claim("w1", 1)
+    (composer_id, _, _), = CrawlQueue(queue.path, lease=0).claim("w2", 1)  # w1's lease expired
+
+    assert queue.complete(composer_id, "w2", "text of a")
+    assert not queue.fail(composer_id, "w1", "Timeout")
+    assert states(queue) == {"a": DONE}
+    assert queue.export() == {"era0": {"a": "text of a"}}
+
+
+def dead_worker() -> str:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return worker_id(process.pid)
+
+
+def test_reclaim_dead_only_takes_back_stopped_workers(queue):
+    queue.enqueue({"era0": {name: "" for name in "abcd"}})
+    queue.claim(dead_worker(), 1)
+    queue.claim(worker_id(), 1)
+    queue.claim("other-host:1", 1)
+
+    assert queue.reclaim_dead() == 1
+    assert states(queue) == {"a": PENDING, "b": IN_FLIGHT, "c": IN_FLIGHT, "d": PENDING}
+    assert queue.unfinished() == 4
+
+
+def test_resume_takes_back_in_flight_composers(queue):
+    queue.enqueue({"era0": {"a": "", "b": ""}})
+    queue.claim("w1", 1)
+    assert queue.resume(older_than=3600) == 0
+    assert queue.resume() == 1
+    assert set(states(queue).values()) == {PENDING}
+
+
+class StubCollector(DataCollector):
+    def __init__(self, eras: dict, queue_path: str):
+        super().__init__(processor=None, fetcher=AsyncFetcher(cache=None), queue_path=queue_path)
+        self.parser_per_link = {link: None for link in eras}
+        self.eras = eras
+        self.crawled = []
+        self.lists = []
+
+    def get_parsed_data(self, links=None) -> dict:
+        links = list(self.eras) if links is None else list(links)
+        self.lists.append(links)
+        return {link: {name: "" for name in self.eras[link]} for link in links}
+
+    def crawl(self, queue: CrawlQueue, batch_size: int = 64):
+        batch = queue.claim("stub", batch_size)
+        for composer_id, link, name in batch:
+            queue.complete(composer_id, "stub", f"text of {name}")
+        self.crawled.append(sorted(name for _, _, name in batch))
+
+
+def test_scrape_composers_picks_up_new_eras(tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite")
+    assert StubCollector({"era0": ["a", "b"]}, queue_path).scrape_composers() == \
+        {"era0": {"a": "text of a", "b": "text of b"}}
+
+    collector = StubCollector({"era0": ["a", "b"], "era1": ["c"]}, queue_path)
+    assert collector.scrape_composers() == {"era0": {"a": "text of a", "b": "text of b"}, "era1": {"c": "text of c"}}
+    assert collector.crawled == [["c"]]
+
+
+def test_only_eras_that_are_not_stored_are_scraped(tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite")
+    collector = StubCollector({"era0": ["a", "b"]}, queue_path)
+    assert list(collector.iter_composer_texts()) == [("era0", "a", "text of a"), ("era0", "b", "text of b")]
+
+    collector = StubCollector({"era0": ["a", "b"], "era1": ["c"], "era2": []}, queue_path)
+    assert list(collector.iter_composer_texts()) == [("era0", "a", "text of a"), ("era0", "b", "text of b"),
+                                                     ("era1", "c", "text of c")]
+    assert collector.lists == [["era1", "era2"]] and collector.crawled == [["c"]]
+
+    assert list(collector.iter_composer_texts(["era1"])) == [("era1", "c", "text of c")]
+    assert collector.lists == [["era1", "era2"]]  # Every era is stored now, including the one without composers
+
+
+def test_eras_are_added_to_scraped_data_in_the_old_format(tmp_path):
+    os.makedirs("data")
+    with open("data/scraped_data", "wb") as file:
+        file.write(msgpack.packb({"era0": {"a": "old text of a"}}))
+
+    collector = StubCollector({"era0": ["a"], "era1": ["b"]}, str(tmp_path / "queue.sqlite"))
+    assert list(collector.iter_composer_texts()) == [("era0", "a", "old text of a"), ("era1", "b", "text of b")]
+    assert collector.lists == [["era1"]]
+
+
+def test_scrape_composers_crawls_composers_of_a_crashed_run(tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite")
+    queue = CrawlQueue(queue_path)
+    queue.enqueue({"era0": {name: "" for name in "abcdef"}})
+    queue.claim(dead_worker(), 3)
+
+    collector = StubCollector({"era0": list("abcdef")}, queue_path)
+    assert collector.scrape_composers() == {"era0": {name: f"text of {name}" for name in "abcdef"}}
+    assert queue.unfinished() == 0
+
+
+def test_crawl_workers_share_the_rate_limit(tmp_path, monkeypatch):
+    started = []
+
+    class StubProcess:
+        def __init__(self, target, args):
+            started.append(args[-1])
+
+        def start(self):
+            pass
+
+        def is_alive(self):
+            return False
+
+        def join(self):
+            pass
+
+    monkeypatch.setattr(data_collector_module, "Process", StubProcess)
+    queue_path = str(tmp_path / "queue.sqlite")
+    collector = DataCollector(processor=None, fetcher=AsyncFetcher(rate=20, cache=None), crawl_workers=4,
+                              queue_path=queue_path)
+    collector.crawl(CrawlQueue(queue_path))
+    assert [settings["rate"] for settings in started] == [5, 5, 5, 5]
+
+
+def test_fetcher_settings_roundtrip(tmp_path):
+    fetcher = AsyncFetcher(concurrency=3, rate=1.5, retries=1, cache=ResponseCache(str(tmp_path), ttl=5))
+    copy = AsyncFetcher.from_settings(fetcher.settings())
+    assert copy.settings() == fetcher.settings() and copy.cache is not fetcher.cache
+    assert AsyncFetcher.from_settings(AsyncFetcher().settings()).cache is None
@@ -0,0 +1,87 @@
+from ResponseCache import ResponseCache
+from Fetcher import AsyncFetcher
+import asyncio
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+
+class StubServer:
+    """Local HTTP server with a page per test scenario, counting the requests per path."""
+    def __init__(self):
+        self.requests = {}
+        self.app = web.Application()
+        self.app.router.add_get("/{name}", self.handle)
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        name = request.match_info["name"]
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if name == "missing":
+            return web.Response(status=404)
+        if name == "flaky" and self.requests[name] < 3:
+            return web.Response(status=503)
+        if name == "undecodable":
+            return web.Response(body=b"\xff\xfe\xfa", content_type="text/html", charset="utf-8")
+        if name == "etag":
+            if request.headers.get("If-None-Match") == "\"v1\"":
+                return web.Response(status=304)
+            return web.Response(text="<p>etag</p>", content_type="text/html", headers={"ETag": "\"v1\""})
+        return web.Response(text=f"<p>{name}</p>", content_type="text/html")
+
+    async def __aenter__(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+
+def fetch(fetcher, names):
+    async def run():
+        async with StubServer() as server:
+            results, failures = await fetcher.fetch_all([server.url + name for name in names])
+            return server, {url[len(server.url):]: text for url, text in results.items()}, \
+                {failure.url[len(server.url):]: failure for failure in failures}
+    return asyncio.run(run())
+
+
+def test_fetches_concurrently_with_retries_and_failures():
+    fetcher = AsyncFetcher(concurrency=4, rate=0, retries=3, backoff=0.01)
+    names = [f"page{i}" for i in range(20)] + ["flaky", "missing", "undecodable"]
+    server, results, failures = fetch(fetcher, names)
+
+    assert results == {name: f"<p>{name}</p>" for name in names if name.startswith("page") or name == "flaky"}
+    assert server.requests["flaky"] == 3
+    assert set(failures) == {"missing", "undecodable"}
+    assert failures["missing"].status == 404 and server.requests["missing"] == 1
+    assert failures["undecodable"].error.startswith("UnicodeDecodeError")
+    assert fetcher.stats["fetched"] == 21
+
+
+def test_cache_serves_fresh_and_revalidates_stale(tmp_path):
+    fetcher = AsyncFetcher(rate=0, cache=ResponseCache(str(tmp_path / "cache")))
+
+    async def run():
+        async with StubServer() as server:
+            urls = [server.url + "etag", server.url + "page"]
+            rounds = []
+            for ttl in [3600, 3600, 0]:
+                fetcher.cache.ttl = ttl
+                results, failures = await fetcher.fetch_all(urls)
+                assert not failures
+                rounds.append(({url[len(server.url):]: text for url, text in results.items()}, dict(server.requests)))
+            return rounds
+
+    (first, requests), (second, cached_requests), (third, stale_requests) = asyncio.run(run())
+    assert first == second == third == {"etag": "<p>etag</p>", "page": "<p>page</p>"}
+    assert requests == cached_requests == {"etag": 1, "page": 1}
+    # Stale responses are requested again, with a conditional request where there is a validator
+    assert stale_requests == {"etag": 2, "page": 2}
+    assert fetcher.stats["cache_hits"] == 2 and fetcher.stats["revalidated"] == 1 and fetcher.stats["fetched"] == 3
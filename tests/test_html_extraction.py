@@ -0,0 +1,61 @@
+from DataCollector import DataCollector
+import html_extraction
+import pytest
+import os
+
+bs4 = pytest.importorskip("bs4")
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PAGES = ["composer_page.html", "disambiguation_page.html", "list_page.html", "table_page.html"]
+
+
+def fixture(file_name: str) -> str:
+    with open(os.path.join(FIXTURES, file_name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def collector(html_engine: str) -> DataCollector:
+    return DataCollector(processor=None, fetcher=object(), html_engine=html_engine)
+
+
+def soup(html: str):
+    return bs4.BeautifulSoup(html, "html.parser")
+
+
+@pytest.mark.parametrize("file_name", PAGES)
+def test_paragraph_text(file_name):
+    html = fixture(file_name)
+    assert html_extraction.paragraph_text(html) == collector("bs4").extract_text(html)
+
+
+def test_disambiguation_page():
+    assert html_extraction.paragraph_text(fixture("disambiguation_page.html")) is None
+    assert html_extraction.paragraph_text(fixture("composer_page.html"))
+
+
+@pytest.mark.parametrize("file_name", PAGES)
+def test_list_anchor_names(file_name):
+    html = fixture(file_name)
+    assert html_extraction.list_anchor_names(html) == DataCollector.bsoup_list_names(soup(html))
+
+
+@pytest.mark.parametrize("file_name", PAGES)
+def test_table_anchor_names(file_name):
+    html = fixture(file_name)
+    link = "List of Romantic composers"
+    names = html_extraction.table_anchor_names(html)
+    assert names == DataCollector.table_parser({link: {"bsoup": soup(html)}}, link)
+    if file_name == "table_page.html":
+        assert len(names) > 70
+
+
+def test_list_parsers_agree():
+    html = fixture("list_page.html")
+    link = "List of Baroque composers"
+    names = DataCollector.plain_list_parser({link: {"html": html}}, link)
+    assert names == DataCollector.plain_list_parser({link: {"bsoup": soup(html)}}, link)
+    assert names[-1] == "Santa della Pietà"
+
+
+def test_bs4_is_the_default_engine():
+    assert DataCollector(processor=None, fetcher=object()).html_engine == "bs4"
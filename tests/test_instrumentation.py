@@ -0,0 +1,34 @@
+from instrumentation import Instrumentation
+import time
+
+
+def test_interleaved_work_is_not_counted_for_the_consuming_stage():
+    run = Instrumentation()
+
+    def produce():
+        for i in range(3):
+            with run.interleaved("scrape"):
+                time.sleep(0.05)
+                run.count("pages")
+            yield i
+
+    with run.stage("pipeline"):
+        with run.stage("extract"):
+            for _ in produce():
+                run.count("composers")
+
+    stages = run.report()["stages"]
+    assert stages["pipeline/scrape"]["calls"] == 3
+    assert stages["pipeline/scrape"]["wall"] >= 0.15
+    assert stages["pipeline/scrape"]["counters"] == {"pages": 3}
+    assert stages["pipeline/extract"]["wall"] < 0.05
+    assert stages["pipeline/extract"]["counters"] == {"composers": 3}
+    assert stages["pipeline"]["wall"] >= 0.15
+    assert run.stack == []
+
+
+def test_interleaved_outside_of_a_stage_is_a_stage():
+    run = Instrumentation()
+    with run.interleaved("scrape"):
+        pass
+    assert run.report()["stages"]["scrape"]["calls"] == 1
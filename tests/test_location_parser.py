@@ -0,0 +1,66 @@
+from conftest import COUNTRIES_PATH
+from LocationParser import GazetteerMatcher, LocationParser
+from Gazetteer import read_worldcities
+import synthetic_corpus
+import pytest
+import re
+
+
+def regex_countries(countries, cities_lut, sentence):
+    """The matching of the original LocationParser.get_countries: an alternation regex and word n-gram lookups."""
+    found = set(re.findall(r"(" + "|".join(countries) + ")[ .,\\-!?$]", sentence))
+    words = sentence.split(" ")
+    for w in range(1, 4):
+        for i in range(len(words) - (w - 1)):
+            name = " ".join(words[i:i + w])
+            if name in cities_lut:
+                found.add(cities_lut[name])
+    return found
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    countries = synthetic_corpus.read_countries(COUNTRIES_PATH)
+    cities = synthetic_corpus.generate_cities(countries, 2000, seed=1)
+    cities_lut = {name: country for name, country, _, _, _ in cities}
+    return countries, cities, cities_lut
+
+
+EDGE_CASES = [
+    "Born in Niger, moved to Nigeria.",
+    "He lived in Equatorial Guinea and Guinea-Bissau, then Guinea!",
+    "Dominican Republic or Dominica? Both.",
+    "Ending with a country without terminator: France",
+    "France$ and Germany, Austria-Hungary",
+    "Nigeria",
+    "",
+    "   ",
+    "Sudan.South Sudan. ",
+]
+
+
+def test_matcher_parity_with_regex(gazetteer):
+    countries, cities, cities_lut = gazetteer
+    matcher = GazetteerMatcher(countries, cities_lut)
+    generator = synthetic_corpus.CorpusGenerator(countries, [name for name, _, _, _, _ in cities], seed=2)
+    sentences = EDGE_CASES + [generator.sentence((1600, 1800)) for _ in range(3000)]
+
+    for sentence in sentences:
+        assert matcher.match(sentence) == regex_countries(countries, cities_lut, sentence), sentence
+
+
+def test_get_countries_many_matches_get_countries(gazetteer, tmp_path):
+    countries, cities, _ = gazetteer
+    csv_path = str(tmp_path / "worldcities.csv")
+    synthetic_corpus.write_worldcities(csv_path, cities)
+    cities_lut, _, _ = read_worldcities(csv_path)
+    parser = LocationParser(COUNTRIES_PATH, csv_path, str(tmp_path / "gazetteer.bin"))
+    generator = synthetic_corpus.CorpusGenerator(countries, list(cities_lut), seed=3)
+    sentences = EDGE_CASES + [generator.sentence((1400, 1600)) for _ in range(1000)]
+
+    single = [sorted(parser.get_countries(sentence)) for sentence in sentences]
+    found = set(parser.countries_found)
+    parser.countries_found = set()
+    assert [sorted(countries) for countries in parser.get_countries_many(sentences)] == single
+    assert parser.countries_found == found
+    assert single == [sorted(regex_countries(countries, cities_lut, sentence)) for sentence in sentences]
@@ -0,0 +1,52 @@
+import log_files
+import logging
+import os
+
+
+def record(message):
+    return logging.LogRecord("test", logging.INFO, __file__, 0, message, None, None)
+
+
+def write(path, message):
+    handler = log_files.RunFileHandler(path)
+    handler.emit(record(message))
+    handler.close()
+
+
+def test_importing_does_not_start_a_run(monkeypatch):
+    monkeypatch.delenv(log_files.RUN_STARTED, raising=False)
+    os.makedirs("logs")
+    with open("logs/test.log", "w") as file:
+        file.write("earlier run\n")
+
+    write("logs/test.log", "no run")
+    with open("logs/test.log") as file:
+        assert file.read() == "earlier run\nno run\n"
+
+
+def test_a_run_replaces_older_logs_once(monkeypatch):
+    monkeypatch.setenv(log_files.RUN_STARTED, "")  # Restored afterwards
+    os.makedirs("logs")
+    with open("logs/test.log", "w") as file:
+        file.write("earlier run\n")
+    os.utime("logs/test.log", (0, 0))
+    log_files.start_run()
+
+    first = log_files.RunFileHandler("logs/test.log")
+    first.emit(record("first"))
+    write("logs/test.log", "worker")  # Like a worker process that logs to the same file
+    first.emit(record("second"))
+    first.close()
+
+    with open("logs/test.log") as file:
+        assert file.read() == "first\nworker\nsecond\n"
+
+
+def test_the_log_directory_is_resolved_when_the_file_is_opened(tmp_path):
+    handler = log_files.RunFileHandler("logs/test.log")
+    os.makedirs(tmp_path / "later")
+    os.chdir(tmp_path / "later")
+    handler.emit(record("later"))
+    handler.close()
+    assert os.path.isfile(tmp_path / "later" / "logs" / "test.log")
+    assert not os.path.exists(tmp_path / "logs")
@@ -0,0 +1,100 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageSequence = pytest.importorskip("PIL.ImageSequence")
+import map_rendering
+import numpy as np
+import io
+import os
+
+
+def base(color) -> "Image.Image":
+    image = Image.new("RGB", (400, 300), "white")
+    image.paste(color, (50, 100, 350, 250))
+    return image
+
+
+def test_write_gif(tmp_path):
+    bases = {"a": base((200, 30, 30)), "b": base((30, 30, 200))}
+    stream = [("a", "Year 1", 1), ("a", "Year 2", 1), ("b", "Year 3", 3), ("a", None, 2)]
+    path = str(tmp_path / "animation.gif")
+    map_rendering.write_gif(stream, bases, path, fps=10)
+
+    font = map_rendering.title_font(map_rendering.TITLE_FONT_SIZE * 300 // 600)
+    with Image.open(path) as gif:
+        assert gif.info["loop"] == 0
+        frames = [(frame.info["duration"], frame.convert("RGB")) for frame in ImageSequence.Iterator(gif)]
+    assert [duration for duration, _ in frames] == [100, 100, 300, 200]
+    for (digest, title, _), (_, frame) in zip(stream, frames):
+        expected = bases[digest] if title is None else map_rendering.draw_title(bases[digest], title, font)
+        # Up to the shared palette, which only rounds the anti-aliased edges of the title
+        difference = np.abs(np.asarray(frame, dtype=int) - np.asarray(expected, dtype=int)).max(axis=2)
+        assert (difference > 40).mean() < 0.01
+
+
+def test_write_gif_streams_the_frames(tmp_path):
+    bases = {"a": base((200, 30, 30)), "b": base((30, 30, 200))}
+    path = tmp_path / "animation.gif"
+    sizes = []
+
+    def stream():
+        for year in range(20):
+            sizes.append(path.stat().st_size if path.exists() else 0)
+            yield "ab"[year // 5 % 2], f"Year {year}", 1
+
+    map_rendering.write_gif(stream(), bases, str(path), fps=10)
+    assert sizes[-1] > 0  # Frames are written while the stream is still being consumed
+    with Image.open(path) as gif:
+        assert gif.n_frames == 20
+
+
+def test_empty_selection_raises(tmp_path):
+    with pytest.raises(ValueError):
+        map_rendering.write_gif([], {}, str(tmp_path / "empty.gif"), fps=10)
+    with pytest.raises(ValueError):
+        map_rendering.write_animation([], ("#ff0000",), str(tmp_path / "empty.gif"))
+
+
+@pytest.fixture
+def stub_maps(monkeypatch):
+    """Replaces the pygal rendering with flat images, recording the assignments that are rendered."""
+    rendered = []
+
+    def base_map(codes_per_era, era_colors):
+        rendered.append(codes_per_era)
+        image = base(era_colors[len(rendered) % len(era_colors)])
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    monkeypatch.setattr(map_rendering, "base_map", base_map)
+    return rendered
+
+
+def test_render_frames_only_renders_changed_frames(tmp_path, stub_maps):
+    path = str(tmp_path / "maps")
+    colors = ("#ff0000", "#0000ff")
+    a, b = {"era0": ["fr", "de"], "era1": []}, {"era0": ["fr"], "era1": ["de"]}
+    frames = [(1, a), (2, a), (3, b), (4, b)]
+
+    stats = map_rendering.render_frames(frames, colors, path, workers=1)
+    assert (stats["rendered"], stats["unique_maps"], len(stub_maps)) == (4, 2, 2)
+    assert sorted(os.listdir(path)) == ["manifest", "map_1.png", "map_2.png", "map_3.png", "map_4.png"]
+
+    stats = map_rendering.render_frames(frames, colors, path, workers=1)
+    assert (stats["rendered"], stats["unique_maps"], len(stub_maps)) == (0, 0, 2)
+
+    # The same assignment with the eras' codes in another order is the same frame
+    stats = map_rendering.render_frames([(1, a), (2, {"era0": ["de", "fr"], "era1": []}), (3, a)], colors, path,
+                                        workers=1)
+    assert (stats["rendered"], stats["unique_maps"], stats["removed"]) == (1, 1, 1)
+    assert stub_maps[-1] == a
+    assert not os.path.exists(os.path.join(path, "map_4.png"))
+
+    os.remove(os.path.join(path, "map_2.png"))
+    stats = map_rendering.render_frames([(1, a), (2, a), (3, a)], colors, path, workers=1)
+    assert stats["rendered"] == 1
+    assert map_rendering.read_manifest(path)[1] == {year: map_rendering.frame_hash(a) for year in (1, 2, 3)}
+
+    stats = map_rendering.render_frames([(1, a), (2, a), (3, a)], ("#00ff00", "#0000ff"), path, workers=1)
+    assert stats["rendered"] == 3  # Another style invalidates every frame
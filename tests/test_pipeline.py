@@ -0,0 +1,101 @@
+from Pipeline import Pipeline, StageCache
+from Processor import Processor
+from main import ORDER
+import instrumentation
+import synthetic_corpus
+import os
+
+
+class StubCollector:
+    """Serves a fixed corpus like DataCollector.iter_composer_texts, reporting composers in scraped as scraped."""
+    def __init__(self, corpus: dict, scraped: dict):
+        self.corpus = corpus
+        self.parser_per_link = {link: None for link in corpus}
+        self.scraped_counts = scraped
+        self.scraped = {}
+
+    def iter_composer_texts(self, links=None):
+        self.scraped = self.scraped_counts
+        for link, composers in self.corpus.items():
+            if links is None or link in links:
+                for name, text in composers.items():
+                    yield link, name, text
+
+
+def entries(data):
+    return {link: [(e.composer, e.text, e.years, sorted(e.countries)) for e in data[link]] for link in data}
+
+
+def run(corpus, scraped=None, workers=1):
+    processor = Processor(workers=workers)
+    pipeline = Pipeline(StubCollector(corpus, scraped or {}), processor, StageCache("data/stages.sqlite"),
+                        index_path="data/index.npz")
+    return pipeline, pipeline.run(ORDER)
+
+
+def test_pipeline_matches_filter_outliers(resources):
+    countries, city_names = resources
+    corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed=4).corpus(3000)
+    pipeline, (view, found, _) = run(corpus)
+
+    processor = Processor()
+    data, expected_countries, _ = processor.filter_temporospatial(processor.preprocess(corpus))
+    assert entries(view) == entries(Processor.filter_outliers(data, ORDER))
+    assert found == expected_countries
+
+    pipeline, (cached_view, _, _) = run(corpus)
+    assert entries(cached_view) == entries(view)
+    assert pipeline.stats["extract"] == {"cached": sum(len(composers) for composers in corpus.values())}
+
+
+def test_scrape_and_preprocess_are_timed_next_to_extract(resources):
+    countries, city_names = resources
+    corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed=6).corpus(300)
+    before = instrumentation.RUN.report()["stages"]
+    run(corpus)
+    stages = instrumentation.RUN.report()["stages"]
+
+    def calls(path):
+        return stages[path]["calls"] - before.get(path, {"calls": 0})["calls"]
+
+    composers = sum(len(c) for c in corpus.values())
+    assert calls("pipeline/scrape") == composers + 1  # The last pull finds the end of the texts
+    assert calls("pipeline/preprocess") == 2 * composers
+    assert not any(path.startswith("pipeline/extract/") for path in stages)
+
+
+def test_composers_with_the_same_text_keep_their_names(resources):
+    countries, city_names = resources
+    text = "He was organist in France from 1620 to 1650. He died in 1660 in Germany."
+    link = ORDER[2][1]
+    corpus = {l: {} for _, l, _, _ in ORDER}
+    corpus[link] = {"Johann Pachelbel": text, "Pachelbel": text}
+
+    _, (view, _, _) = run(corpus)
+    assert sorted({entry.composer for entry in view[link]}) == ["Johann Pachelbel", "Pachelbel"]
+    assert len(view[link]) == 4
+
+
+def test_scrape_counts_come_from_the_crawl(resources):
+    countries, city_names = resources
+    corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed=5).corpus(400, sentences_per_composer=40)
+    first_link = next(iter(corpus))
+    pipeline, _ = run(corpus, scraped={first_link: 1, "List of 20th-century classical composers": 5})
+    assert pipeline.stats["scrape"] == {"cached": 9, "computed": 1}
+
+
+def test_workers_give_the_same_entries_in_the_same_order(resources):
+    countries, city_names = resources
+    corpus = synthetic_corpus.CorpusGenerator(countries, city_names, seed=7).corpus(2000)
+    composers = Processor().preprocess(corpus)
+
+    serial = Processor(workers=1).filter_temporospatial(composers)
+    parallel = Processor(workers=2, chunk_size=3).filter_temporospatial(composers)
+    assert entries(parallel[0]) == entries(serial[0])
+    assert parallel[1:] == serial[1:]
+
+    _, (serial_view, serial_found, _) = run(corpus, workers=1)
+    os.remove("data/stages.sqlite")
+    _, (parallel_view, parallel_found, _) = run(corpus, workers=2)
+    assert entries(parallel_view) == entries(serial_view)
+    assert parallel_found == serial_found
@@ -0,0 +1,39 @@
+from ResponseCache import ResponseCache
+import os
+
+
+def accessed_at(cache, url):
+    return cache.db.execute("SELECT accessed_at FROM responses WHERE url = ?", (url,)).fetchone()[0]
+
+
+def test_running_total_and_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10_000)
+    for i in range(100):
+        cache.put(f"url{i}", f"{i:04d}" * 50)  # 200 bytes each
+        cache.put(f"copy{i}", f"{i:04d}" * 50)  # Same body, stored once
+        assert cache.total == cache.size() <= 10_000
+
+    objects = sum(len(files) for _, _, files in os.walk(tmp_path / "objects"))
+    assert objects * 200 == cache.total
+    assert cache.get("url99").body == "0099" * 50 and cache.get("url0") is None
+
+
+def test_access_times_are_batched(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("a", "body a")
+    cache.put("b", "body b")
+    written = accessed_at(cache, "a")
+
+    assert cache.get("a").body == "body a"
+    assert accessed_at(cache, "a") == written
+    cache.flush()
+    assert accessed_at(cache, "a") > written
+
+
+def test_shared_between_connections(tmp_path):
+    first, second = ResponseCache(str(tmp_path)), ResponseCache(str(tmp_path))
+    assert first.db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    first.put("a", "body a")
+    assert second.get("a").body == "body a"
+    second.put("b", "body b")
+    assert first.get("b").body == "body b"
@@ -0,0 +1,25 @@
+from data_types import TemporospatialEntry
+import visualization
+import pytest
+import os
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+
+ORDER = [("Baroque", "era0", (1600, 1760), "tab:green"), ("Classical", "era1", (1730, 1820), "tab:red")]
+DATA = {
+    "era0": [TemporospatialEntry([1620, 1650], ["France"], "In 1620 and 1650 in France.", "A")],
+    "era1": [TemporospatialEntry([1790], ["Austria"], "In 1790 in Austria.", "B")],
+}
+
+
+@pytest.mark.parametrize("mode", visualization.SCATTER_MODES)
+def test_scatter_eras(tmp_path, mode):
+    path = str(tmp_path / f"{mode}.png")
+    visualization.scatter_eras(DATA, ORDER, mode=mode, path=path, show=False)
+    assert os.path.getsize(path)
+
+
+def test_scatter_eras_rejects_unknown_modes(tmp_path):
+    with pytest.raises(ValueError):
+        visualization.scatter_eras(DATA, ORDER, mode="hexbin", path=str(tmp_path / "x.png"), show=False)
@@ -1,112 +1,151 @@
-from pygal_maps_world.maps import World
-import matplotlib.pyplot as plt
-from matplotlib import colors
-from pygal.style import Style
+from aggregation import EraYearCounts, GridYearCounts
 from data_types import *
-from tqdm import tqdm
+import instrumentation
 import numpy as np
-import logging
+import log_files
 import os
 
-if os.path.isfile("./logs/visualization.log"):
-    os.remove("./logs/visualization.log")
+logger = log_files.module_logger(__name__, "visualization.log")
 
-# Setting up the logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('logs/visualization.log')
-file_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-logger.addHandler(file_handler)
-logger.propagate = False
+SCATTER_MODES = ["points", "density"]
 
 
-def scatter_eras(filtered_data: dict, order: list):
-    logger.info(f"Scattering the data using order {order}")
+def era_years(filtered_data: dict, link: str) -> np.ndarray:
+    """All year mentions of an era, straight from the columns when filtered_data is a TemporospatialView."""
+    if hasattr(filtered_data, "years"):
+        return filtered_data.years(link)
+    return np.array([year for years, _, _, _ in filtered_data[link] for year in years], dtype=np.int64)
+
+
+def era_hex_colors(order: list) -> Tuple[str, ...]:
+    from matplotlib import colors
+    return tuple(colors.colorConverter.colors[c] for _, _, _, c in order)  # plt colors to hex
+
+
+@instrumentation.timed()
+def scatter_eras(filtered_data: dict, order: list, mode: str = "points", bin_width: int = 5,
+                 path: Optional[str] = None, show: bool = True):
+    """
+    Plots the year mentions per era, against the predefined time periods of the eras. mode "points" draws every
+    mention, mode "density" draws per era a histogram with bins of bin_width years as a colored band, which takes
+    the same time for any number of mentions. The plot is saved to path if given, and only shown if show is True.
+    """
+    if mode not in SCATTER_MODES:
+        raise ValueError(f"Unknown scatter mode {mode}, use one of {SCATTER_MODES}")
+    import matplotlib.pyplot as plt  # Slow to import, so only when plotting
+    from matplotlib import colors
+    logger.info(f"Scattering the data using order {order} (mode {mode})")
     start = order[0][2][0]
     end = order[-1][2][1]
+    bins = np.arange(start, end + bin_width, bin_width)
 
+    fig, ax = plt.subplots()
     for i, (label, link, (lower, upper), color) in enumerate(order):
-        entries = filtered_data[link]
-        ys = []
-        for years, locations, sentence, composer in entries:
-            ys.extend([y for y in years])
+        ys = era_years(filtered_data, link)
         med = np.median(ys)
-        plt.scatter(ys, i*np.ones(len(ys)), alpha=(upper - lower)/5000, color=color, label=f"{i}: {label}", marker='|')
-        plt.vlines(x=[lower, upper], ymin=i-0.1, ymax=i+0.1, linewidth=2, colors='k')
-        plt.scatter(med, i, color='k', marker='*', label="Data median" if i == 6 else None)
-    leg = plt.legend()
-    for lh in leg.legendHandles:
-        if not lh._label == "Data median":
+        if mode == "density":
+            counts, _ = np.histogram(ys, bins=bins)
+            cmap = colors.LinearSegmentedColormap.from_list(link, ["white", color])
+            ax.imshow(counts[np.newaxis, :], cmap=cmap, vmin=0, vmax=max(counts.max(), 1), aspect="auto",
+                      extent=(bins[0], bins[-1], i - 0.4, i + 0.4), interpolation="nearest")
+            ax.plot([], [], color=color, label=f"{i}: {label}")  # Legend entry for the band
+        else:
+            ax.scatter(ys, i*np.ones(len(ys)), alpha=(upper - lower)/5000, color=color, label=f"{i}: {label}",
+                       marker='|')
+        ax.vlines(x=[lower, upper], ymin=i-0.1, ymax=i+0.1, linewidth=2, colors='k')
+        ax.scatter(med, i, color='k', marker='*', label="Data median" if i == len(order) - 1 else None)
+    leg = ax.legend()
+    handles = getattr(leg, "legend_handles", None)  # Named legendHandles before matplotlib 3.7
+    for lh in handles if handles is not None else leg.legendHandles:
+        if not lh.get_label() == "Data median":
             lh.set(alpha=1, linewidth=5)  # Make legend icons properly visible
-    plt.xlim((start, end))
-    plt.xlabel("Year")
-    plt.ylabel("Era number")
-    plt.show()
-
-
-def render_maps(filtered_data: dict, country_codes: dict, order: list):
-    if os.path.isdir("./data/maps") and os.listdir("./data/maps"):
-        logger.info("./data/maps/ already contains files. Rendering of maps is skipped!")
-        return
-
+    ax.set_xlim((start, end))
+    ax.set_ylim((-0.5, len(order) - 0.5))
+    ax.set_xlabel("Year")
+    ax.set_ylabel("Era number")
+
+    if path:
+        fig.savefig(path, bbox_inches="tight")
+        logger.info(f"Saved the scatter plot to {path}")
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+@instrumentation.timed()
+def city_density_map(filtered_data: dict, start: Optional[int] = None, end: Optional[int] = None,
+                     cell_size: float = 2.0, path: Optional[str] = None, show: bool = True):
+    """
+    Plots how often the cities in each grid cell of cell_size degrees are mentioned together with a year in
+    start..end (by default, all years). Needs data extracted with offline geocoding (Processor(geocode=True)).
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib import colors
+
+    with instrumentation.stage("aggregate"):
+        counts = GridYearCounts.from_data(filtered_data, cell_size, start, end)
+        grid = counts.grid()
+    logger.info(f"City density of {counts.start}-{counts.end}: {grid.sum()} mentions in {np.count_nonzero(grid)} "
+                f"cells of {cell_size} degrees")
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    image = ax.imshow(np.ma.masked_equal(grid, 0), origin="lower", extent=(-180, 180, -90, 90), cmap="viridis",
+                      norm=colors.LogNorm(vmin=1, vmax=max(grid.max(), 1)), interpolation="nearest")
+    fig.colorbar(image, ax=ax, label="Mentions")
+    ax.set_title(f"Mentions of cities from {counts.start} to {counts.end}")
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+
+    if path:
+        fig.savefig(path, bbox_inches="tight")
+        logger.info(f"Saved the city density map to {path}")
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+@instrumentation.timed()
+def render_maps(filtered_data: dict, country_codes: dict, order: list, workers: Optional[int] = None):
+    import map_rendering  # Slow to import (pygal, PIL), so only when rendering
     logger.info("Rendering maps!")
-    custom_style = Style(colors=tuple(colors.colorConverter.colors[c] for _, _, _, c in order))  # plt colors to hex
+    era_colors = era_hex_colors(order)
     start = order[0][2][0]
     end = order[-1][2][1]
-    era_names = [e[0] for e in order]
-
-    era_per_year_per_country = {}
-
-    for name, link, (lower, upper), color in order:
-        entries: List[TemporospatialEntry] = filtered_data[link]
-
-        for entry in entries:
-            years, countries, _, _ = entry
-
-            for country in countries:
-                if country not in era_per_year_per_country:
-                    era_per_year_per_country[country] = {
-                        name: {} for name in era_names
-                    }
-                d = era_per_year_per_country[country][name]
-                for year in years:
-                    if year not in d:
-                        d[year] = 0
-                    d[year] += 1
-
-    if not os.path.isdir("./data/maps"):
-        os.mkdir("./data/maps")
-
-    last_era: dict = {}
-
-    pbar = tqdm(total=end-start, desc=f"Creating maps for {end-start} years")
-    for year in range(start, end+1):
-        worldmap = World(style=custom_style)
-        worldmap.title = f"Western Classical Musical Eras per Country in {year}"
-        for i, era in enumerate(era_names):
-            for country in era_per_year_per_country.keys():
-                if year in era_per_year_per_country[country][era]:
-                    if country in country_codes:
-                        code = country_codes[country]
-                        if code not in last_era:
-                            last_era[code] = i
-                        else:
-                            last_era[code] = max(last_era[code], i)
-
-        if last_era:
-            codes_per_era = {
-                era: [] for era in era_names
-            }
-            latest_era = 0
-            for code, era in last_era.items():
-                latest_era = max(latest_era, era)
-                codes_per_era[era_names[era]].append(code)
-
-            for i in range(latest_era-1):
-                codes_per_era[era_names[i]] = []
-
-            for era in era_names:
-                worldmap.add(era, codes_per_era[era])
-            worldmap.render_to_png(f"data/maps/map_{year}.png")
-        pbar.update(1)
-    pbar.close()
+
+    with instrumentation.stage("aggregate"):
+        counts = EraYearCounts.from_data(filtered_data, order, start, end)
+        frames = list(counts.frames(country_codes))
+
+    with instrumentation.stage("render"):
+        stats = map_rendering.render_frames(frames, era_colors, "./data/maps", workers)
+        for name, n in stats.items():
+            instrumentation.count(name, n)
+    logger.info(f"Maps for {stats['frames']} years: rendered {stats['rendered']} frames from {stats['unique_maps']} "
+                f"unique maps, removed {stats['removed']} stale frames")
+
+
+@instrumentation.timed()
+def animate_maps(filtered_data: dict, country_codes: dict, order: list, path: str = "./data/map_animation.gif",
+                 start: Optional[int] = None, end: Optional[int] = None, fps: float = 30, titles: bool = True,
+                 workers: Optional[int] = None):
+    """
+    Encodes the maps of the years start..end (by default, the range of order) straight into an animation. Without
+    titles, years with the same map are merged into one longer frame.
+    """
+    import map_rendering
+    era_colors = era_hex_colors(order)
+    start = order[0][2][0] if start is None else start
+    end = order[-1][2][1] if end is None else end
+    logger.info(f"Animating maps from {start} to {end} into {path}")
+
+    with instrumentation.stage("aggregate"):
+        counts = EraYearCounts.from_data(filtered_data, order)  # The whole range, so eras reached before start count
+        frames = [(year, codes_per_era) for year, codes_per_era in counts.frames(country_codes)
+                  if start <= year <= end]
+
+    with instrumentation.stage("encode"):
+        stats = map_rendering.write_animation(frames, era_colors, path, fps, titles, workers)
+        for name, n in stats.items():
+            instrumentation.count(name, n)
+        instrumentation.count("bytes", os.path.getsize(path))
+    logger.info(f"Encoded {stats['frames']} frames for {stats['years']} years from {stats['unique_maps']} unique maps")